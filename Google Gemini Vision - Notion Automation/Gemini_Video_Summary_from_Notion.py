@@ -1,31 +1,22 @@
 ###Trim_mp4_and_send_to_GCP###
 # This script is responsible for downloading a video from a Notion database, potentially compressing it, and then uploading it to Google Cloud Storage.
-# pipedream add-package moviepy
+# The shared helpers (video_cache, ...) live in misc_automations/ and are deployed alongside these steps.
+# pipedream add-package ffmpeg-python
 # pipedream add-package google-cloud-aiplatform
 import os
 import requests
-from google.oauth2 import service_account
 from google.cloud import storage
-from moviepy.editor import VideoFileClip
-
-
-def save_creds():
-    """A hack within pipedream env to save Google Cloud credentials to a temporary file."""
-    auth = {
-        "type": "service_account",
-        "project_id": os.getenv("GOOGLE_PROJECT_ID"),
-        "private_key_id": os.getenv("GOOGLE_PRIVATE_KEY_ID"),
-        "private_key": os.getenv("GOOGLE_PRIVATE_KEY").replace("\\n", "\n"),
-        "client_email": os.getenv("GOOGLE_CLIENT_EMAIL"),
-        "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-        "client_x509_cert_url": os.getenv("CLIENT_CERT_URL"),
-        "universe_domain": "googleapis.com",
-    }
-    with open("/tmp/google_auth.json", "w") as outfile:
-        json.dump(auth, outfile)
+
+import google_credentials
+import storage_backends
+import tracing
+import video_cache
+import video_compression
+import video_stream
+import workspaces
+
+# Reserved for a download whose size the server doesn't report.
+DEFAULT_DOWNLOAD_BYTES = 1024 * 1024 * 1024
 
 
 def upload_blob(storage_client, bucket_name, source_file_name, destination_blob_name):
@@ -37,81 +28,128 @@ def upload_blob(storage_client, bucket_name, source_file_name, destination_blob_
     :param source_file_name: Path to the file to be uploaded.
     :param destination_blob_name: Name to be assigned to the file in the bucket.
     """
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-
-    blob.upload_from_filename(source_file_name)
+    backend = storage_backends.GCSBackend(storage_client, bucket_name)
+    with tracing.span("upload", size_bytes=os.path.getsize(source_file_name)):
+        backend.upload_file(source_file_name, destination_blob_name)
 
     print(f"File {source_file_name} uploaded to {destination_blob_name}.")
 
 
-def download_video(url, filename):
+def download_video(response, filename):
     """
-    Downloads a video from a given URL and saves it to a local file.
+    Saves a streamed video download to a local file.
 
-    :param url: URL of the video to be downloaded.
+    :param response: requests Response opened with stream=True.
     :param filename: Local path where the video will be saved.
     """
-    response = requests.get(url, stream=True)
-    with open(filename, "wb") as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
+    with tracing.span("download") as span:
+        with open(filename, "wb") as file:
+            for chunk in response.iter_content(chunk_size=8192):
+                file.write(chunk)
+        span.set(size_bytes=os.path.getsize(filename))
 
 
 def compress_video(input_filename, target_size_MB):
     """
-    Compresses the video to a specified size.
+    Compresses the video to a specified size with the shared ffmpeg engine.
 
     :param input_filename: Path to the input video file.
     :param target_size_MB: Target size of the video in Megabytes.
+    :returns: CompressionResult with the achieved size, wall time and passes.
     """
-    clip = VideoFileClip(input_filename)
+    result = video_compression.compress_video(input_filename, target_size_MB * 1024)
+    print(
+        f"Compressed to {result.size_kb:.0f} KB in {result.wall_time:.1f}s "
+        f"({result.passes} pass(es))."
+    )
+    return result
 
-    # Calculate the target bitrate based on the target size (in bits)
-    target_size_bits = target_size_MB * 8 * 1024 * 1024
-    duration = clip.duration
-    target_bitrate = target_size_bits / duration
 
-    # Compress the video
-    clip.write_videofile(input_filename, bitrate=target_bitrate)
+def stream_video(storage_client, url, max_size_MB):
+    """
+    Streams the video from Notion into GCS without writing it to /tmp.
+
+    :param storage_client: Initialized Google Cloud Storage client.
+    :param url: URL of the video to be streamed.
+    :param max_size_MB: Size above which the video is transcoded on the fly.
+    :returns: Dict with the GCS URI and the input's SHA-256.
+    """
+    bucket = storage_client.bucket(os.getenv("GOOGLE_BLOB"))
+    result = video_stream.stream_to_gcs(url, bucket, max_size_MB * 1024)
+    print(
+        f"Streamed {result.bytes_in} bytes to {result.blob_name} "
+        f"({result.bytes_out} bytes, transcoded={result.transcoded})."
+    )
+    return {
+        "file": None,
+        "gcs_uri": "gs://%s/%s" % (bucket.name, result.blob_name),
+        "sha256": result.sha256,
+    }
 
 
+@tracing.instrument_handler("gemini_upload")
 def handler(pd: "pipedream"):
     """
     Main handler function for processing video files.
 
+    Set VIDEO_PIPELINE_MODE=stream to stream download, transcode and upload
+    without temp files.
+
     :param pd: Pipedream context object containing information about the trigger event.
-    :returns: Path to the processed video file.
+    :returns: Dict with the cached compressed video path (None if the original
+        was uploaded), its GCS URI and the input's SHA-256.
     """
-    mp4_file = "/tmp/video.mp4"
     max_size_MB = 9
     notion_video_url = pd.steps["retrieve_block"]["$return_value"]["children"][0][
         "video"
     ]["file"]["url"]
 
-    download_video(notion_video_url, mp4_file)
-    original_size_MB = os.path.getsize(mp4_file) / (1024 * 1024)
-
-    if original_size_MB <= max_size_MB:
-        print("File size is already under 9MB, no need to compress.")
-    else:
-        compress_video(mp4_file, max_size_MB)
-
-    save_creds()
-    credentials = service_account.Credentials.from_service_account_file(
-        "/tmp/google_auth.json"
-    )
-
-    storage_client = storage.Client(credentials=credentials)
-    upload_blob(
-        storage_client,
-        bucket_name=os.getenv("GOOGLE_BLOB"),
-        source_file_name=mp4_file,
-        destination_blob_name="video.mp4",
-    )
+    if os.getenv("VIDEO_PIPELINE_MODE") == "stream":
+        return stream_video(
+            storage.Client(credentials=google_credentials.shared_credentials()),
+            notion_video_url,
+            max_size_MB,
+        )
+
+    with requests.get(notion_video_url, stream=True) as response:
+        size = int(response.headers.get("Content-Length") or DEFAULT_DOWNLOAD_BYTES)
+        # The download, plus the compressed output and its sample encode.
+        with workspaces.workspace(
+            "gemini-upload", size + 2 * max_size_MB * 1024 * 1024
+        ) as workspace:
+            mp4_file = workspace.path_for("video.mp4")
+            download_video(response, mp4_file)
+            cache = video_cache.VideoCache()
+            digest = video_cache.file_sha256(mp4_file)
+            original_size_MB = os.path.getsize(mp4_file) / (1024 * 1024)
+
+            cached_file = None
+            if cache.has_compressed(digest):
+                print("Compressed video found in cache, no need to compress.")
+                mp4_file = cached_file = cache.compressed_path(digest)
+            elif original_size_MB <= max_size_MB:
+                print("File size is already under 9MB, no need to compress.")
+            else:
+                compress_video(mp4_file, max_size_MB)
+                mp4_file = cached_file = cache.store_compressed(digest, mp4_file)
+
+            storage_client = storage.Client(
+                credentials=google_credentials.shared_credentials()
+            )
+            upload_blob(
+                storage_client,
+                bucket_name=os.getenv("GOOGLE_BLOB"),
+                source_file_name=mp4_file,
+                destination_blob_name=video_cache.blob_name(digest),
+            )
 
     # Return data for use in future steps
-    return mp4_file
+    blob_name = video_cache.blob_name(digest)
+    return {
+        "file": cached_file,
+        "gcs_uri": "gs://%s/%s" % (os.getenv("GOOGLE_BLOB"), blob_name),
+        "sha256": digest,
+    }
 
 
 ###Send_to_Gemini###
@@ -120,50 +158,23 @@ def handler(pd: "pipedream"):
 import json
 import os
 import requests
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel
 from vertexai.preview import generative_models
-from google.oauth2 import service_account
 import re
 
-
-def save_creds():
-    auth = {
-        "type": "service_account",
-        "project_id": os.getenv("GOOGLE_PROJECT_ID"),
-        "private_key_id": os.getenv("GOOGLE_PRIVATE_KEY_ID"),
-        "private_key": os.getenv("GOOGLE_PRIVATE_KEY").replace("\\n", "\n"),
-        "client_email": os.getenv("GOOGLE_CLIENT_EMAIL"),
-        "client_id": os.getenv("GOOGLE_CLIENT_ID"),
-        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-        "token_uri": "https://oauth2.googleapis.com/token",
-        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-        "client_x509_cert_url": os.getenv("CLIENT_CERT_URL"),
-        "universe_domain": "googleapis.com",
-    }
-    with open("/tmp/google_auth.json", "w") as outfile:
-        json.dump(auth, outfile)
+import gemini_client
+import summary_parser
+import tracing
+import video_cache
 
 
-def get_video_summary():
+def stream_video_summary(gcs_uri="gs://notion3000/video.mp4"):
     """
-    Generates a summary for a video using the Gemini model.
+    Streams a summary for a video from the Gemini model.
 
-    :returns: A string containing the HTML-formatted summary of the video.
+    :param gcs_uri: GCS URI of the uploaded video.
+    :returns: Generator of text chunks of the HTML-formatted summary.
     """
-    save_creds()
-    credentials = service_account.Credentials.from_service_account_file(
-        "/tmp/google_auth.json"
-    )
-
-    vertexai.init(
-        credentials=credentials,
-        project=os.getenv("GOOGLE_PROJECT_ID"),
-        location=os.getenv("GOOGLE_LOCATION"),
-    )
-    gemini_pro_vision_model = GenerativeModel("gemini-pro-vision")
-
-    response = gemini_pro_vision_model.generate_content(
+    return gemini_client.default_client().stream(
         [
             """Imagine yourself as a visionary leader in the field of technology and innovation, akin to well-known figures like Sam Altman. Your expertise is in identifying and interpreting emerging trends in technology, startups, and global developments. You have recently viewed a short video that you find particularly insightful in terms of its implications for the future. Your task is to create a comprehensive summary of this video that includes:
 - a creative title that captures the essence of the video
@@ -181,17 +192,19 @@ Please format your response using HTML tags as follows:
 </KEYPOINTS>
 <SUMMARY> [Your analytical summary here, encompassing the key insights and their wider implications] </SUMMARY>
 <TAGS> [comma seperated 1-word tags that you choose to label the video as] </TAGS>""",
-            generative_models.Part.from_uri(
-                "gs://notion3000/video.mp4", mime_type="video/mp4"
-            ),
-        ],
-        stream=True,
+            generative_models.Part.from_uri(gcs_uri, mime_type="video/mp4"),
+        ]
     )
 
-    final = ""
-    for chunk in response:
-        final += chunk.text
-    return final
+
+def get_video_summary(gcs_uri="gs://notion3000/video.mp4"):
+    """
+    Generates a summary for a video using the Gemini model.
+
+    :param gcs_uri: GCS URI of the uploaded video.
+    :returns: A string containing the HTML-formatted summary of the video.
+    """
+    return "".join(stream_video_summary(gcs_uri))
 
 
 def parse_html_tags(input_string):
@@ -201,39 +214,10 @@ def parse_html_tags(input_string):
     :param input_string: String containing HTML-tagged content.
     :returns: A dictionary with parsed content categorized by HTML tags.
     """
-    # Define a dictionary to hold the parsed content
-    parsed_content = {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
-
-    # Define regular expression patterns for each tag
-    title_pattern = r"<TITLE>(.*?)</TITLE>"
-    keypoints_pattern = r"<KEYPOINTS>(.*?)</KEYPOINTS>"
-    summary_pattern = r"<SUMMARY>(.*?)</SUMMARY>"
-    tags_pattern = r"<TAGS>(.*?)</TAGS>"
-
-    # Extract content for each tag
-    title_match = re.search(title_pattern, input_string, re.DOTALL)
-    if title_match:
-        parsed_content["TITLE"] = title_match.group(1).strip()
-
-    keypoints_match = re.search(keypoints_pattern, input_string, re.DOTALL)
-    if keypoints_match:
-        parsed_content["KEYPOINTS"] = keypoints_match.group(1).strip()
-
-    summary_match = re.search(summary_pattern, input_string, re.DOTALL)
-    if summary_match:
-        parsed_content["SUMMARY"] = summary_match.group(1).strip()
-
-    tags_match = re.search(tags_pattern, input_string, re.DOTALL)
-    if tags_match:
-        # Split the keypoints into a list
-        tags = tags_match.group(1).strip().split(",")
-        tags = [x.strip() for x in tags]
-        # Clean up each keypoint
-        parsed_content["TAGS"] = tags
-
-    return parsed_content
+    return summary_parser.parse_summary(input_string)
 
 
+@tracing.instrument_handler("gemini_summary")
 def handler(pd: "pipedream"):
     """
     Main handler function for summarizing video content.
@@ -241,5 +225,15 @@ def handler(pd: "pipedream"):
     :param pd: Pipedream context object containing information about the trigger event.
     :returns: A dictionary containing the parsed summary of the video.
     """
-    summary = get_video_summary()
-    return parse_html_tags(summary)
+    upload = pd.steps["Trim_mp4_and_send_to_GCP"]["$return_value"]
+    cache = video_cache.VideoCache()
+    parsed = cache.load_summary(upload["sha256"])
+    if parsed is not None:
+        print("Summary found in cache, skipping Gemini.")
+        return parsed
+
+    parsed = summary_parser.parse_chunks(
+        tracing.stream("llm", stream_video_summary(upload["gcs_uri"]))
+    )
+    cache.store_summary(upload["sha256"], parsed)
+    return parsed
@@ -0,0 +1,98 @@
+"""
+Benchmark: generic link text extraction, BeautifulSoup get_text() vs html_extract.
+
+Runs on the pages in fixtures/html_corpus by default: news, blog, docs,
+landing, essay and forum layouts with the usual nav, header, footer, inline
+scripts and styles around the content. Point it at a directory of saved pages
+(*.html, e.g. "Save Page As" or `curl -o`) to measure your own links. Run from
+misc_automations/:
+
+    python -m benchmarks.bench_html_extract
+    python -m benchmarks.bench_html_extract path/to/corpus --max-chars 20000
+"""
+import argparse
+import glob
+import os
+import time
+
+import html_extract
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "fixtures", "html_corpus")
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def legacy_extract(html):
+    """The original get_page_text parse."""
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+def timed(func, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chars = sum(len(func(html)) for html in pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, chars
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "corpus",
+        nargs="?",
+        default=DEFAULT_CORPUS,
+        help="Directory of saved .html pages (default: the shipped corpus)",
+    )
+    parser.add_argument("--max-chars", type=int, default=html_extract.DEFAULT_MAX_CHARS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.corpus, "*.htm*"))):
+        with open(path, encoding="utf-8", errors="replace") as infile:
+            pages.append(infile.read())
+    if not pages:
+        parser.error("No .html files in %s" % args.corpus)
+    print(
+        "%d pages, %.1f MB of HTML"
+        % (len(pages), sum(len(html) for html in pages) / 1e6)
+    )
+
+    candidates = []
+    if BeautifulSoup is not None:
+        candidates.append(("bs4 html.parser get_text", legacy_extract))
+    if html_extract.lxml is not None:
+        candidates.append(
+            (
+                "html_extract lxml",
+                lambda html: html_extract.extract_text(html, args.max_chars, "lxml"),
+            )
+        )
+    candidates.append(
+        (
+            "html_extract stdlib",
+            lambda html: html_extract.extract_text(html, args.max_chars, "stdlib"),
+        )
+    )
+
+    print("%-28s %10s %12s %14s" % ("extractor", "ms/page", "chars/page", "~tokens/page"))
+    for name, func in candidates:
+        elapsed, chars = timed(func, pages, args.repeat)
+        print(
+            "%-28s %10.2f %12d %14d"
+            % (
+                name,
+                elapsed * 1000 / len(pages),
+                chars // len(pages),
+                chars // len(pages) // 4,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: what the video path vs the keyframe path sends to Gemini.
+
+For each input video, prepares the model input both ways and reports the
+bytes that would be uploaded and the local preparation wall time:
+
+  video      the current path: x264 compression to --size-kb if needed
+  keyframes  scene-change JPEGs plus low-bitrate mono audio, no x264
+
+Run from misc_automations/ with ffmpeg on the PATH:
+
+    python -m benchmarks.bench_keyframes clip1.mp4 clip2.mp4 --max-frames 8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import video_compression
+import video_keyframes
+
+
+def prepare_video(path, workdir, size_kb):
+    """The current path: compress a copy of the input if it's over size_kb."""
+    copy = os.path.join(workdir, "video.mp4")
+    shutil.copyfile(path, copy)
+    if os.path.getsize(copy) > size_kb * 1024:
+        video_compression.compress_video(copy, size_kb)
+    return os.path.getsize(copy), 1
+
+
+def prepare_keyframes(path, workdir, max_frames, threshold):
+    media = video_keyframes.extract_media(path, workdir, max_frames, threshold)
+    parts = video_keyframes.part_files(media)
+    return sum(os.path.getsize(part) for part, _ in parts), len(parts)
+
+
+def timed(prepare, path, *args):
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        size, parts = prepare(path, workdir, *args)
+        return size, parts, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("videos", nargs="+", help="Input .mp4 files")
+    parser.add_argument("--size-kb", type=int, default=9500)
+    parser.add_argument(
+        "--max-frames", type=int, default=video_keyframes.DEFAULT_MAX_FRAMES
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=video_keyframes.DEFAULT_SCENE_THRESHOLD
+    )
+    args = parser.parse_args()
+
+    print(
+        "%-28s %-10s %12s %6s %9s"
+        % ("video", "mode", "upload KB", "parts", "wall s")
+    )
+    totals = {"video": [0, 0.0], "keyframes": [0, 0.0]}
+    for path in args.videos:
+        results = [
+            ("video", timed(prepare_video, path, args.size_kb)),
+            (
+                "keyframes",
+                timed(prepare_keyframes, path, args.max_frames, args.threshold),
+            ),
+        ]
+        for mode, (size, parts, elapsed) in results:
+            totals[mode][0] += size
+            totals[mode][1] += elapsed
+            print(
+                "%-28s %-10s %12.0f %6d %9.2f"
+                % (os.path.basename(path)[:28], mode, size / 1024, parts, elapsed)
+            )
+
+    (video_bytes, video_time), (frame_bytes, frame_time) = totals.values()
+    print()
+    print(
+        "keyframes: %.1fx fewer upload bytes, %.1fx faster preparation"
+        % (video_bytes / max(frame_bytes, 1), video_time / max(frame_time, 1e-9))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark: streamed summary parsing, legacy concat + regex vs summary_parser.
+
+Run from misc_automations/:
+
+    python -m benchmarks.bench_summary_parser
+"""
+import argparse
+import re
+import timeit
+
+from summary_parser import FIELDS, parse_chunks
+
+
+def legacy_parse(chunks):
+    """The original get_video_summary + parse_html_tags path."""
+    final = ""
+    for chunk in chunks:
+        final += chunk
+    parsed_content = {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+    for field in FIELDS:
+        match = re.search(r"<%s>(.*?)</%s>" % (field, field), final, re.DOTALL)
+        if match:
+            value = match.group(1).strip()
+            if field == "TAGS":
+                value = [x.strip() for x in value.split(",")]
+            parsed_content[field] = value
+    return parsed_content
+
+
+def make_chunks(summary_chars, chunk_size):
+    """Builds a synthetic model response split into stream-sized chunks."""
+    response = (
+        "<TITLE> The Future of Everything </TITLE>\n<KEYPOINTS>\n"
+        + "".join("- Key point number %d\n" % i for i in range(5))
+        + "</KEYPOINTS>\n<SUMMARY> "
+        + ("Lorem ipsum dolor sit amet. " * (summary_chars // 28 + 1))[:summary_chars]
+        + " </SUMMARY>\n<TAGS> startups, ai, trends </TAGS>"
+    )
+    return [response[i : i + chunk_size] for i in range(0, len(response), chunk_size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("%10s %8s %12s %12s %8s" % ("chars", "chunks", "legacy ms", "stream ms", "speedup"))
+    for size in (1000, 10000, 100000, 1000000):
+        chunks = make_chunks(size, args.chunk_size)
+        assert legacy_parse(chunks) == parse_chunks(chunks)
+        number = max(1, 200000 // size)
+        legacy = min(
+            timeit.repeat(lambda: legacy_parse(chunks), number=number, repeat=args.repeat)
+        )
+        stream = min(
+            timeit.repeat(lambda: parse_chunks(chunks), number=number, repeat=args.repeat)
+        )
+        print(
+            "%10d %8d %12.3f %12.3f %7.2fx"
+            % (
+                size,
+                len(chunks),
+                legacy * 1000 / number,
+                stream * 1000 / number,
+                legacy / stream,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Offline end-to-end benchmark for the video, links and task reminder handlers.
+
+Every external service is replaced by a local fake from benchmarks.fakes with
+configurable latency and error injection, the handlers are driven with the
+recorded pd events in benchmarks/fixtures, and per-stage latency percentiles
+and throughput are reported. Run from misc_automations/:
+
+    python -m benchmarks.e2e --iterations 20 --latency 0.02 --error-rate 0.05
+"""
+import argparse
+import copy
+import datetime
+import functools
+import inspect
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks import fakes
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BENCH_SECRETS = {
+    "NOTION": "secret_bench",
+    "MEDIA_SAVES_DB": "bench-media-db",
+    "PUSHOVER_APP": "bench-app",
+    "PUSHOVER_USER": "bench-user",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET": "bench",
+}
+
+
+class Pipedream:
+    """Minimal pd object: handlers only read pd.steps."""
+
+    def __init__(self, event):
+        self.steps = copy.deepcopy(event["steps"])
+
+
+def load_fixture(name, web_url=""):
+    with open(os.path.join(FIXTURES, name)) as infile:
+        return json.loads(infile.read().replace("{web}", web_url))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+class StageRecorder:
+    """
+    Wraps module functions to record how long each call takes, per stage.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage, elapsed, failed=False):
+        with self._lock:
+            self.samples[stage].append(elapsed)
+            self.errors[stage] += failed
+
+    def wrap(self, owner, name, stage):
+        """
+        Replaces owner.name with a timed wrapper.
+
+        Generators are timed until they are exhausted, so streamed stages
+        (e.g. the Gemini response) report their full duration.
+        """
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            except Exception:
+                self.record(stage, time.perf_counter() - started, failed=True)
+                raise
+            if not inspect.isgenerator(result):
+                self.record(stage, time.perf_counter() - started)
+                return result
+            return self._timed_generator(stage, started, result)
+
+        setattr(owner, name, timed)
+
+    def _timed_generator(self, stage, started, generator):
+        failed = True
+        try:
+            yield from generator
+            failed = False
+        finally:
+            self.record(stage, time.perf_counter() - started, failed)
+
+    def report(self):
+        rows = []
+        for stage in sorted(self.samples):
+            samples = self.samples[stage]
+            rows.append(
+                {
+                    "stage": stage,
+                    "count": len(samples),
+                    "errors": self.errors[stage],
+                    "p50_ms": percentile(samples, 0.5) * 1000,
+                    "p90_ms": percentile(samples, 0.9) * 1000,
+                    "p99_ms": percentile(samples, 0.99) * 1000,
+                    "max_ms": max(samples) * 1000,
+                }
+            )
+        return rows
+
+
+def run_handler(recorder, stage, handler, pd):
+    started = time.perf_counter()
+    try:
+        handler(pd)
+    except Exception:
+        recorder.record(stage, time.perf_counter() - started, failed=True)
+        return False
+    recorder.record(stage, time.perf_counter() - started)
+    return True
+
+
+def bench_video(args, recorder, services, workdir):
+    import types
+
+    import config
+    import gemini_client
+    import video_summarize
+
+    config.REGISTRY.register(
+        "GEMINI_CLIENT",
+        lambda: gemini_client.GeminiClient(model_factory=lambda: services["gemini"]),
+    )
+    video_summarize.generative_models = types.SimpleNamespace(
+        Part=types.SimpleNamespace(from_uri=lambda uri, mime_type: (uri, mime_type))
+    )
+    recorder.wrap(video_summarize, "compress_if_needed", "video.compress")
+    recorder.wrap(video_summarize, "save_to_google_cloud", "video.upload")
+    recorder.wrap(video_summarize, "stream_video_summary", "video.llm")
+    recorder.wrap(video_summarize, "create_notion_page", "video.notion_write")
+
+    event = load_fixture("video_event.json")
+    body = event["steps"]["trigger"]["event"]["body"]
+    original_name = body["filename"]
+    for iteration in range(args.iterations):
+        # Fresh random bytes per iteration keep the content-addressed cache cold.
+        body["filename"] = "bench_%d_%s" % (iteration, original_name)
+        path = os.path.join("/tmp", body["filename"])
+        with open(path, "wb") as outfile:
+            outfile.write(os.urandom(args.video_kb * 1024))
+        try:
+            run_handler(
+                recorder, "video.handler", video_summarize.handler, Pipedream(event)
+            )
+        finally:
+            # The handler moves the upload into the workspace inputs.
+            if os.path.exists(path):
+                os.remove(path)
+    return args.iterations
+
+
+def bench_links(args, recorder, services, workdir):
+    import links
+
+    links.LangChainLLM = lambda: services["llm"]
+    links.SCRAPERS = links.scraper_registry.ScraperPool(
+        {
+            platform: lambda: services["scraper"]
+            for platform in ("Threads", "Twitter", "Instagram", "YouTube")
+        }
+    )
+    recorder.wrap(links, "get_link_data", "links.fetch")
+    recorder.wrap(services["llm"], "summarize", "links.llm")
+    recorder.wrap(links, "create_notion_page", "links.notion_write")
+
+    events = load_fixture("links_events.json", services["web"].base_url)
+    for event in events:
+        run_handler(recorder, "links.handler", links.handler, Pipedream(event))
+
+    # Query suffixes make every batch URL distinct to the seen-index.
+    processor = links.EnhancedLinkProcessor()
+    urls = [
+        "%s%sbench=%d"
+        % (url, "&" if "?" in url else "?", iteration)
+        for iteration in range(args.iterations)
+        for url in (
+            event["steps"]["trigger"]["event"]["properties"]["URL"]["url"]
+            for event in events
+        )
+    ]
+    started = time.perf_counter()
+    results = processor.process_batch(urls)
+    failed = any(result.error is not None for result in results)
+    recorder.record("links.process_batch", time.perf_counter() - started, failed)
+    return len(events) + len(urls)
+
+
+def bench_tasks(args, recorder, services, workdir):
+    import secrets_cache
+    import task_reminders
+
+    task_reminders.SecretsManager.cache = secrets_cache.SecretsCache(
+        "notionGPT", lambda: services["secrets"]
+    )
+    # get_client keeps the client only while the token matches the secret.
+    task_reminders.NotionManager.client = services["notion"]
+    task_reminders.NotionManager.token = BENCH_SECRETS["NOTION"]
+    recorder.wrap(task_reminders.SecretsManager, "get_secrets", "tasks.secrets")
+    recorder.wrap(task_reminders.TaskSource, "sync", "tasks.query")
+    recorder.wrap(task_reminders, "process_tasks", "tasks.notify")
+
+    # The recorded query steps become the fake task database, due dates set so
+    # each task lands in the bucket it came from.
+    event = load_fixture("task_reminders_event.json")
+    today = datetime.date.fromisoformat(task_reminders.today_in())
+    offsets = {"Late_tasks": -2, "Today_tasks": 0, "Upcoming_tasks": 1}
+    tasks = services["notion"].tasks
+    for step, offset in offsets.items():
+        for page in event["steps"][step]["$return_value"]["results"]:
+            page = copy.deepcopy(page)
+            due = (today + datetime.timedelta(days=offset)).isoformat()
+            page["properties"][task_reminders.DUE_PROPERTY] = {
+                "type": "date",
+                "date": {"start": due},
+            }
+            tasks.append(page)
+
+    for iteration in range(args.iterations):
+        # One edit per run, so every run after the first is a one-task delta.
+        edited = tasks[iteration % len(tasks)]
+        edited["last_edited_time"] = "2030-01-01T00:%02d:00.000Z" % (iteration % 60)
+        run_handler(
+            recorder, "tasks.handler", task_reminders.handler, Pipedream({"steps": {}})
+        )
+    return args.iterations
+
+
+def configure(args, workdir, web):
+    """Points every module-level setting at the fakes; must run before the imports."""
+    os.environ.update(
+        {
+            "PUSHOVER_URL": web.base_url + "/1/messages.json",
+            "VIDEO_CACHE_DIR": os.path.join(workdir, "video_cache"),
+            "HTTP_CACHE_DIR": os.path.join(workdir, "http_cache"),
+            "CHUNK_SUMMARY_CACHE_DIR": os.path.join(workdir, "chunk_summaries"),
+            "LINK_INDEX_DB": os.path.join(workdir, "link_index.sqlite3"),
+            "JOB_QUEUE_DB": os.path.join(workdir, "job_queue.sqlite3"),
+            "NOTION_TASKS_DB": "bench-tasks-db",
+            "TASK_SNAPSHOT_PATH": os.path.join(workdir, "notion_tasks.json"),
+            "REMINDER_STATE_DB": os.path.join(workdir, "reminder_state.sqlite3"),
+            "WORKSPACE_DIR": os.path.join(workdir, "workspaces"),
+            "WORKSPACE_RAM_DIR": os.path.join(workdir, "ram_workspaces"),
+            "GOOGLE_BLOB": "bench-bucket",
+            "STORAGE_BACKEND": "gcs",
+        }
+    )
+    import config
+    import http_fetcher
+    import secrets_cache
+    import url_index
+
+    services = {
+        "secrets": fakes.FakeSecretsManager(
+            {"notionGPT": BENCH_SECRETS}, faults(args)
+        ),
+        "notion": fakes.FakeNotion(faults(args)),
+        "gcs": fakes.FakeStorageClient(faults(args)),
+        "gemini": fakes.FakeGemini(
+            faults(args), ttft=args.llm_ttft, chunk_latency=args.llm_chunk_latency
+        ),
+        "llm": fakes.FakeLLM(faults(args)),
+        "scraper": fakes.FakeScraper(faults(args)),
+        "web": web,
+    }
+    config.REGISTRY.register(
+        "SECRETS",
+        lambda: secrets_cache.SecretsCache("notionGPT", lambda: services["secrets"]),
+    )
+    config.REGISTRY.register("NOTION_CLIENT", lambda: services["notion"])
+    config.REGISTRY.register("GCS_CREDENTIALS", object)
+    config.REGISTRY.register("GCS_CLIENT", lambda: services["gcs"])
+    config.REGISTRY.register(
+        "HTTP_FETCHER",
+        lambda: http_fetcher.HttpFetcher(cache_dir=os.environ["HTTP_CACHE_DIR"]),
+    )
+    config.REGISTRY.register(
+        "LINK_INDEX", lambda: url_index.SeenIndex(os.environ["LINK_INDEX_DB"])
+    )
+    return services
+
+
+def faults(args):
+    return fakes.FaultInjector(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def print_report(rows, throughput):
+    print(
+        "%-22s %6s %6s %9s %9s %9s %9s"
+        % ("stage", "count", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms")
+    )
+    for row in rows:
+        print(
+            "%-22s %6d %6d %9.1f %9.1f %9.1f %9.1f"
+            % (
+                row["stage"],
+                row["count"],
+                row["errors"],
+                row["p50_ms"],
+                row["p90_ms"],
+                row["p99_ms"],
+                row["max_ms"],
+            )
+        )
+    print()
+    for name, stats in throughput.items():
+        print(
+            "%-8s %5d runs in %7.2fs  %7.2f runs/s"
+            % (name, stats["runs"], stats["seconds"], stats["per_second"])
+        )
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--handlers", default="video,links,tasks")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="Seconds added to each fake call"
+    )
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-ttft", type=float, default=0.2)
+    parser.add_argument("--llm-chunk-latency", type=float, default=0.005)
+    parser.add_argument("--video-kb", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--json", action="store_true", help="Print the report as JSON"
+    )
+    args = parser.parse_args()
+
+    handlers = {"video": bench_video, "links": bench_links, "tasks": bench_tasks}
+    recorder = StageRecorder()
+    throughput = {}
+    with tempfile.TemporaryDirectory() as workdir, fakes.FakeWebServer(
+        faults(args), faults(args)
+    ) as web:
+        services = configure(args, workdir, web)
+        for name in args.handlers.split(","):
+            started = time.perf_counter()
+            runs = handlers[name](args, recorder, services, workdir)
+            elapsed = time.perf_counter() - started
+            throughput[name] = {
+                "runs": runs,
+                "seconds": elapsed,
+                "per_second": runs / elapsed,
+            }
+
+    rows = recorder.report()
+    # A handler that never succeeds means the harness measured nothing useful.
+    broken = [
+        row["stage"]
+        for row in rows
+        if row["stage"].endswith(".handler") and row["errors"] == row["count"]
+    ]
+    if args.json:
+        print(json.dumps({"stages": rows, "throughput": throughput}, indent=2))
+    else:
+        print_report(rows, throughput)
+    if broken:
+        print("failed on every run: %s" % ", ".join(broken), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,410 @@
+"""
+Local stand-ins for the external services the handlers talk to.
+
+Every fake takes a FaultInjector, so latency and error rates can be dialled
+in per service. Pushover and generic web pages are served by a real local
+HTTP server, because those paths go through aiohttp/requests.
+"""
+import base64
+import hashlib
+import http.server
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+from secrets_cache import LocalSecretsManager
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+
+class InjectedError(Exception):
+    """Raised by fakes when the fault injector decides a call fails."""
+
+
+class FaultInjector:
+    """
+    Adds latency and random failures to fake service calls.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        """
+        :param latency: Base latency per call, in seconds.
+        :param jitter: Uniform random latency added on top, in seconds.
+        :param error_rate: Probability that a call fails.
+        :param seed: Seed for reproducible runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def should_fail(self):
+        with self._lock:
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def call(self, error_factory=InjectedError):
+        """Sleeps for the configured latency and raises error_factory() on failure."""
+        self.delay()
+        if self.should_fail():
+            raise error_factory()
+
+
+class FakeSecretsManager(LocalSecretsManager):
+    """Secrets Manager client with injected latency and failures."""
+
+    def __init__(self, secrets, faults=None):
+        super().__init__(secrets)
+        self.faults = faults or FaultInjector()
+
+    def get_secret_value(self, SecretId):
+        self.faults.call()
+        return super().get_secret_value(SecretId)
+
+
+def _notion_error():
+    from notion_client.errors import RequestTimeoutError
+
+    return RequestTimeoutError()
+
+
+class FakeNotion:
+    """
+    notion_client.Client stand-in that records created pages.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.pages = self
+        self.databases = self
+        self.data_sources = self
+        self.created = []
+        self.tasks = []
+        self._lock = threading.Lock()
+
+    def create(self, parent, properties):
+        self.faults.call(_notion_error)
+        page_id = uuid.uuid4().hex
+        with self._lock:
+            self.created.append({"parent": parent, "properties": properties})
+        return {"id": page_id, "url": "https://www.notion.so/%s" % page_id}
+
+    def retrieve(self, database_id):
+        """databases.retrieve with the single data source Notion creates."""
+        self.faults.call(_notion_error)
+        return {"id": database_id, "data_sources": [{"id": database_id, "name": ""}]}
+
+    def query(self, data_source_id, **kwargs):
+        """
+        data_sources.query over self.tasks, paginated like the real API. Only the
+        last_edited_time on_or_after filter is applied; others match everything.
+        """
+        self.faults.call(_notion_error)
+        tasks = self.tasks
+        since = (
+            (kwargs.get("filter") or {}).get("last_edited_time", {}).get("on_or_after")
+        )
+        if since:
+            tasks = [task for task in tasks if task["last_edited_time"] >= since]
+        page_size = kwargs.get("page_size", 100)
+        start = int(kwargs.get("start_cursor") or 0)
+        results = tasks[start : start + page_size]
+        more = start + page_size < len(tasks)
+        return {
+            "results": results,
+            "has_more": more,
+            "next_cursor": str(start + page_size) if more else None,
+        }
+
+
+class FakeBlob:
+    """Enough of google.cloud.storage.Blob for the storage backends."""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+
+    @property
+    def _data(self):
+        return self.bucket.objects.get(self.name)
+
+    def exists(self):
+        self.bucket.faults.delay()
+        return self.name in self.bucket.objects
+
+    def reload(self):
+        self.bucket.faults.delay()
+
+    @property
+    def size(self):
+        return len(self._data) if self._data is not None else None
+
+    @property
+    def md5_hash(self):
+        # Like GCS, composite objects carry only a CRC32C.
+        if self._data is None or self.name in self.bucket.composed:
+            return None
+        return base64.b64encode(hashlib.md5(self._data).digest()).decode()
+
+    @property
+    def crc32c(self):
+        if self._data is None or google_crc32c is None:
+            return None
+        return base64.b64encode(google_crc32c.Checksum(self._data).digest()).decode()
+
+    def _put(self, data, composed=False):
+        self.bucket.faults.call()
+        self.bucket.objects[self.name] = data
+        if composed:
+            self.bucket.composed.add(self.name)
+        else:
+            self.bucket.composed.discard(self.name)
+
+    def upload_from_filename(self, filename, content_type=None):
+        with open(filename, "rb") as infile:
+            self._put(infile.read())
+
+    def upload_from_file(self, file_obj, size=None, content_type=None):
+        self._put(file_obj.read(size) if size is not None else file_obj.read())
+
+    def compose(self, sources):
+        self._put(b"".join(source._data for source in sources), composed=True)
+
+    def delete(self):
+        self.bucket.objects.pop(self.name, None)
+        self.bucket.composed.discard(self.name)
+
+
+class FakeBucket:
+    def __init__(self, name, faults):
+        self.name = name
+        self.faults = faults
+        self.objects = {}
+        self.composed = set()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def rename_blob(self, blob, new_name):
+        self.objects[new_name] = self.objects.pop(blob.name)
+        if blob.name in self.composed:
+            self.composed.discard(blob.name)
+            self.composed.add(new_name)
+        return FakeBlob(self, new_name)
+
+
+class FakeStorageClient:
+    """google.cloud.storage.Client stand-in keeping objects in memory."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.buckets = {}
+
+    def bucket(self, name):
+        if name not in self.buckets:
+            self.buckets[name] = FakeBucket(name, self.faults)
+        return self.buckets[name]
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+CANNED_SUMMARY = """<TITLE> A Benchmark Video </TITLE>
+<KEYPOINTS>
+- The pipeline ran end to end
+- Every service was faked
+- Latency was injected
+</KEYPOINTS>
+<SUMMARY> %s </SUMMARY>
+<TAGS> benchmark, offline </TAGS>"""
+
+
+class FakeGemini:
+    """
+    GenerativeModel stand-in streaming a canned tagged response.
+    """
+
+    def __init__(
+        self,
+        faults=None,
+        ttft=0.0,
+        chunk_latency=0.0,
+        chunk_size=40,
+        summary_words=120,
+    ):
+        """
+        :param faults: FaultInjector applied before the first token.
+        :param ttft: Extra time to first token, in seconds.
+        :param chunk_latency: Delay between streamed chunks, in seconds.
+        :param chunk_size: Characters per streamed chunk.
+        :param summary_words: Length of the canned SUMMARY field.
+        """
+        self.faults = faults or FaultInjector()
+        self.ttft = ttft
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.response = CANNED_SUMMARY % " ".join(
+            itertools.islice(
+                itertools.cycle(["insight", "trend", "impact"]), summary_words
+            )
+        )
+        self.requests = 0
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.requests += 1
+        self.faults.call()
+        time.sleep(self.ttft)
+        if not stream:
+            return _Chunk(self.response)
+        return self._stream()
+
+    def _stream(self):
+        for start in range(0, len(self.response), self.chunk_size):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            yield _Chunk(self.response[start : start + self.chunk_size])
+
+
+class FakeLLM:
+    """LangChainLLM stand-in returning a parsed summary."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+
+    def summarize(self, text):
+        self.faults.call()
+        return {
+            "TITLE": (text or "Untitled")[:60],
+            "KEYPOINTS": "- Fetched %d characters" % len(text or ""),
+            "SUMMARY": "Offline benchmark summary.",
+            "TAGS": ["benchmark"],
+        }
+
+
+class FakeScraper:
+    """Platform scraper stand-in (Instagram/Threads/Twitter/YouTube)."""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+
+    def get_data(self, page_id):
+        self.faults.call()
+        return "Scraped post %s with a caption and a few comments." % page_id
+
+
+class FakeWebServer:
+    """
+    Local HTTP server playing Pushover (POST /1/messages.json) and a website
+    (GET /page/<n>), with injected latency and 429/500 responses.
+    """
+
+    def __init__(
+        self,
+        pushover_faults=None,
+        web_faults=None,
+        page_paragraphs=200,
+        pushover_token=None,
+    ):
+        """
+        :param pushover_token: If set, other app tokens are rejected like
+            Pushover does, with HTTP 400 and {"token": "invalid"}.
+        """
+        self.pushover_faults = pushover_faults or FaultInjector()
+        self.pushover_token = pushover_token
+        self.web_faults = web_faults or FaultInjector()
+        self.page = (
+            "<html><head><script>var tracking = 1;</script></head><body>"
+            "<nav><a href='/'>Home</a></nav><article><h1>Fake article</h1>"
+            + "".join(
+                "<p>Paragraph %d of the article.</p>" % i
+                for i in range(page_paragraphs)
+            )
+            + "</article><footer>Footer</footer></body></html>"
+        ).encode()
+        self.messages = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(
+                self, status, body, content_type="application/json", headers=()
+            ):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                server.pushover_faults.delay()
+                token = payload.get("token", [None])[0]
+                if server.pushover_token and token != server.pushover_token:
+                    body = {
+                        "token": "invalid",
+                        "errors": ["application token is invalid"],
+                        "status": 0,
+                    }
+                    self._reply(400, json.dumps(body).encode())
+                    return
+                if server.pushover_faults.should_fail():
+                    self._reply(429, b'{"status":0}', headers=[("Retry-After", "0")])
+                    return
+                server.messages.append(payload)
+                self._reply(200, json.dumps({"status": 1}).encode())
+
+            def do_GET(self):
+                server.web_faults.delay()
+                if server.web_faults.should_fail():
+                    self._reply(500, b"error", "text/plain")
+                    return
+                self._reply(
+                    200,
+                    server.page,
+                    "text/html; charset=utf-8",
+                    [("Cache-Control", "no-store")],
+                )
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:%d" % self.httpd.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
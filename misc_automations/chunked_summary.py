@@ -0,0 +1,227 @@
+"""
+This module summarizes long link text with a map-reduce over token-bounded chunks.
+
+Text is split on structural boundaries (paragraphs, then sentences, then
+words) into chunks that fit a token budget. Each chunk is summarized in
+parallel with bounded concurrency, and the partial summaries are reduced
+into the usual TITLE/KEYPOINTS/SUMMARY/TAGS shape by one more call.
+Partial summaries are cached by chunk content, so a retry only redoes the
+chunks that failed. Tokens are counted with tiktoken when it is installed
+and estimated from the character count otherwise.
+"""
+# pipedream add-package tiktoken
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a characters-per-token estimate.
+    tiktoken = None
+
+DEFAULT_CHUNK_TOKENS = int(os.environ.get("LINK_CHUNK_TOKENS", 3000))
+DEFAULT_MAP_CONCURRENCY = int(os.environ.get("LINK_MAP_CONCURRENCY", 4))
+CACHE_DIR = os.environ.get("CHUNK_SUMMARY_CACHE_DIR", "/tmp/chunk_summaries")
+CHARS_PER_TOKEN = 4
+# Bump when the way partial summaries are produced changes, to invalidate the cache.
+CACHE_VERSION = "1"
+# A reduce whose input still doesn't fit is chunked again, at most this deep.
+MAX_REDUCE_DEPTH = 3
+
+_PARAGRAPHS = re.compile(r"\s*\n\s*")
+_SENTENCES = re.compile(r"(?<=[.!?])\s+")
+_encoding = None
+
+
+def count_tokens(text):
+    """Returns the number of tokens in text (estimated without tiktoken)."""
+    global _encoding
+    if tiktoken is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _split(text, max_tokens):
+    """Splits one oversized piece on the next finer boundary."""
+    for pattern in (_PARAGRAPHS, _SENTENCES):
+        pieces = [piece for piece in pattern.split(text) if piece.strip()]
+        if len(pieces) > 1:
+            return pieces
+    words = text.split()
+    if len(words) > 1:
+        middle = len(words) // 2
+        return [" ".join(words[:middle]), " ".join(words[middle:])]
+    # A single huge "word": cut it by characters.
+    size = max(1, max_tokens * CHARS_PER_TOKEN)
+    return [text[start : start + size] for start in range(0, len(text), size)]
+
+
+def chunk_text(text, max_tokens=DEFAULT_CHUNK_TOKENS, count=count_tokens):
+    """
+    Splits text into chunks of at most max_tokens tokens on structural boundaries.
+
+    Paragraphs are kept whole when they fit, and consecutive pieces are packed
+    greedily into a chunk, so chunks end at paragraph or sentence breaks.
+
+    :param text: The text to split.
+    :param max_tokens: Token budget per chunk.
+    :param count: Token counter, count_tokens by default.
+    :return: List of chunks, in order. Empty text gives an empty list.
+    """
+    pending = [text]
+    pieces = []
+    while pending:
+        piece = pending.pop(0)
+        if not piece.strip():
+            continue
+        if count(piece) <= max_tokens:
+            pieces.append(piece.strip())
+        else:
+            pending[:0] = _split(piece, max_tokens)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class ChunkCache:
+    """
+    Disk cache of partial summaries, keyed by the chunk's content.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    @staticmethod
+    def key(chunk):
+        return hashlib.sha256((CACHE_VERSION + "\0" + chunk).encode()).hexdigest()
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning("Ignoring corrupt chunk summary %s", key)
+            return None
+
+    def put(self, key, summary):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        work_path = "%s.%s.tmp" % (path, threading.get_ident())
+        with open(work_path, "w") as outfile:
+            json.dump(summary, outfile)
+        os.replace(work_path, path)
+
+
+def format_partial(index, summary):
+    """Renders a partial summary as text for the reduce call."""
+    tags = summary.get("TAGS") or []
+    if not isinstance(tags, str):
+        tags = ", ".join(tags)
+    return "Part %d: %s\n%s\n%s\nTags: %s" % (
+        index + 1,
+        summary.get("TITLE", ""),
+        summary.get("KEYPOINTS", ""),
+        summary.get("SUMMARY", ""),
+        tags,
+    )
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes text of any length with a single-call summarize function.
+    """
+
+    def __init__(
+        self,
+        summarize,
+        max_tokens=DEFAULT_CHUNK_TOKENS,
+        concurrency=DEFAULT_MAP_CONCURRENCY,
+        cache=None,
+        slots=None,
+    ):
+        """
+        :param summarize: Callable(text) returning a TITLE/KEYPOINTS/SUMMARY/TAGS
+            dict, e.g. LangChainLLM().summarize.
+        :param max_tokens: Token budget of each chunk.
+        :param concurrency: Chunks summarized at once.
+        :param cache: ChunkCache for partial summaries; None disables caching.
+        :param slots: Optional semaphore every LLM call must hold, shared with
+            other users of the same model.
+        """
+        self._summarize = summarize
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+        self.cache = cache
+        self.slots = slots
+
+    def _call(self, text):
+        if self.slots is None:
+            return self._summarize(text)
+        with self.slots:
+            return self._summarize(text)
+
+    def summarize_chunk(self, chunk):
+        """Summarizes one chunk, served from the cache when possible."""
+        key = ChunkCache.key(chunk) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        summary = self._call(chunk)
+        if key is not None:
+            self.cache.put(key, summary)
+        return summary
+
+    def _map(self, chunks):
+        with tracing.span("llm_map", chunks=len(chunks)):
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [executor.submit(self.summarize_chunk, c) for c in chunks]
+            errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                # Finished chunks are cached; a retry only redoes the failed ones.
+                logging.warning("%s of %s chunks failed", len(errors), len(chunks))
+                raise errors[0]
+            return [future.result() for future in futures]
+
+    def summarize(self, text, depth=0):
+        """
+        Summarizes text, chunking and reducing when it exceeds the budget.
+
+        :param text: The text to summarize.
+        :return: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+        """
+        chunks = chunk_text(text, self.max_tokens)
+        if len(chunks) <= 1:
+            return self.summarize_chunk(text)
+        partials = self._map(chunks)
+        combined = "\n\n".join(
+            format_partial(index, partial) for index, partial in enumerate(partials)
+        )
+        if depth + 1 < MAX_REDUCE_DEPTH and count_tokens(combined) > self.max_tokens:
+            return self.summarize(combined, depth + 1)
+        with tracing.span("llm_reduce", parts=len(partials)):
+            return self._call(combined)
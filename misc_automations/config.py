@@ -1,88 +1,197 @@
-import http.client
-import json
 import os
-import urllib
+import threading
 
 import boto3
 from google.cloud import storage
-from google.oauth2 import service_account
 from notion_client import Client
 
+import gemini_client
+import google_credentials
+import http_fetcher
+import job_queue
+import notifications
+from notion_writer import NotionWriter
+import secrets_cache
+import tracing
+import url_index
 
-def create_notion_page(summary_content, notion_client, ios=False):
-    """Create a new page in Notion based on the summary content."""
-    response = notion_client.pages.create(
-        parent={"database_id": config.SECRETS["MEDIA_SAVES_DB"]},
-        properties={
-            "Name": {"title": [{"text": {"content": summary_content["TITLE"]}}]},
-            "Key points": {
-                "rich_text": [{"text": {"content": summary_content["KEYPOINTS"]}}]
-            },
-            "Summary": {
-                "rich_text": [{"text": {"content": summary_content["SUMMARY"]}}]
-            },
-            "Tags": {
-                "multi_select": [{"name": tag} for tag in summary_content["TAGS"]]
-            },
-        },
+
+def create_notion_page(summary_content, notion_client=None, ios=False):
+    """
+    Create a new page in Notion based on the summary content.
+
+    An auth error refreshes the secrets, rebuilds the Notion clients and
+    retries once.
+    """
+
+    def create():
+        if notion_client is None:
+            writer = get_client("NOTION_WRITER")
+        else:
+            writer = NotionWriter(
+                notion_client, get_client("SECRETS")["MEDIA_SAVES_DB"]
+            )
+        return writer.create(summary_content, ios=ios)
+
+    return get_client("SECRETS").call_with_refresh(create)
+
+
+def get_secrets():
+    """Returns the notionGPT secrets, served from the TTL cache when fresh."""
+    with tracing.span("secrets"):
+        return get_client("SECRETS").get()
+
+
+def _secrets_cache():
+    cache = secrets_cache.from_environment(
+        "notionGPT",
+        "us-east-1",
+        aws_access_key_id=os.environ["AWSKEY"],
+        aws_secret_access_key=os.environ["AWSSECRET"],
     )
-    if ios:
-        notion_url = response["url"].replace(
-            "https://www.notion.so/", "notion://notion.so/"
+    cache.on_rotation(lambda _: [REGISTRY.reset(name) for name in SECRET_CLIENTS])
+    return cache
+
+
+def send_notification(message):
+    def send():
+        [(_, status)] = notifications.send_messages(
+            get_client("SECRETS"), [(0, {"message": message})]
         )
-    else:
-        notion_url = response["url"]
-    return notion_url
+        if isinstance(status, Exception):
+            raise status
+        return status
 
+    return get_client("SECRETS").call_with_refresh(send)
 
-def get_secrets():
-    secret_name = "notionGPT"
-    region_name = "us-east-1"
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session(os.environ["AWSKEY"], os.environ["AWSSECRET"])
-    client = session.client(service_name="secretsmanager", region_name=region_name)
+class ClientRegistry:
+    """
+    Builds shared clients on first use and keeps them for the life of the worker.
 
-    get_secret_value_response = client.get_secret_value(SecretId=secret_name)
+    Each client is registered as a zero-argument factory. Nothing is constructed
+    until a handler asks for it, so a cold start only pays for the clients it uses.
+    """
 
-    secret = get_secret_value_response["SecretString"]
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
 
-    return json.loads(secret)
+    def register(self, name, factory):
+        """
+        Registers (or replaces) the factory for a client and drops any cached instance.
 
+        :param name: Name the client is exposed under, e.g. "NOTION_CLIENT".
+        :param factory: Callable with no arguments that builds the client.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
 
-def send_notification(message):
-    conn = http.client.HTTPSConnection("api.pushover.net:443")
-    conn.request(
-        "POST",
-        "/1/messages.json",
-        urllib.parse.urlencode(
-            {
-                "token": SECRETS["PUSHOVER_APP"],
-                "user": SECRETS["PUSHOVER_USER"],
-                "message": message,
-            }
-        ),
-        {"Content-type": "application/x-www-form-urlencoded"},
-    )
-    conn.getresponse()
-    return 200
+    def get(self, name):
+        """
+        Returns the client registered under name, building it on first use.
+
+        :param name: Name of the client.
+        :return: The memoized client instance.
+        """
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError("No client registered under %r" % name)
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
 
+    def __contains__(self, name):
+        return name in self._factories
 
-SECRETS = get_secrets()
+    def touched(self):
+        """Returns the names of the clients that have been built so far."""
+        with self._lock:
+            return sorted(self._instances)
+
+    def reset(self, name=None):
+        """Drops one cached client (or all of them) so the next use rebuilds it."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+REGISTRY = ClientRegistry()
+# Clients built from the secret, rebuilt after a rotation.
+SECRET_CLIENTS = ("S3_CLIENT", "S3_RESOURCE", "NOTION_CLIENT", "NOTION_WRITER")
 GITHUB_REPO_URL = "git@github.com:takline/automation.git"
-S3_CLIENT = boto3.client(
-    "s3",
-    aws_access_key_id=SECRETS["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=SECRETS["AWS_SECRET"],
-)
-S3_RESOURCE = boto3.resource(
-    "s3",
-    "us-east-1",
-    aws_access_key_id=SECRETS["AWS_ACCESS_KEY_ID"],
-    aws_secret_access_key=SECRETS["AWS_SECRET"],
-)
-NOTION_CLIENT = Client(auth=SECRETS["NOTION"])
-GCS_CREDENTIALS = service_account.Credentials.from_service_account_file(
-    "google_auth.json"
-)
-GCS_CLIENT = storage.Client(credentials=GCS_CREDENTIALS)
+
+
+def get_client(name):
+    """Returns the shared client registered under name, building it on first use."""
+    return REGISTRY.get(name)
+
+
+def touched_clients():
+    """Returns the names of the clients this worker has actually built."""
+    return REGISTRY.touched()
+
+
+def _s3_client():
+    secrets = get_client("SECRETS")
+    return boto3.client(
+        "s3",
+        aws_access_key_id=secrets["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=secrets["AWS_SECRET"],
+    )
+
+
+def _s3_resource():
+    secrets = get_client("SECRETS")
+    return boto3.resource(
+        "s3",
+        "us-east-1",
+        aws_access_key_id=secrets["AWS_ACCESS_KEY_ID"],
+        aws_secret_access_key=secrets["AWS_SECRET"],
+    )
+
+
+def _notion_client():
+    return Client(auth=get_client("SECRETS")["NOTION"])
+
+
+def _notion_writer():
+    return NotionWriter(
+        get_client("NOTION_CLIENT"), get_client("SECRETS")["MEDIA_SAVES_DB"]
+    )
+
+
+def _gcs_credentials():
+    return google_credentials.shared_credentials()
+
+
+def _gcs_client():
+    return storage.Client(credentials=get_client("GCS_CREDENTIALS"))
+
+
+REGISTRY.register("SECRETS", _secrets_cache)
+REGISTRY.register("S3_CLIENT", _s3_client)
+REGISTRY.register("S3_RESOURCE", _s3_resource)
+REGISTRY.register("NOTION_CLIENT", _notion_client)
+REGISTRY.register("NOTION_WRITER", _notion_writer)
+REGISTRY.register("GCS_CREDENTIALS", _gcs_credentials)
+REGISTRY.register("GCS_CLIENT", _gcs_client)
+REGISTRY.register("GEMINI_CLIENT", gemini_client.default_client)
+REGISTRY.register("HTTP_FETCHER", http_fetcher.HttpFetcher)
+REGISTRY.register("LINK_INDEX", url_index.SeenIndex)
+REGISTRY.register("JOB_QUEUE", job_queue.JobQueue)
+
+
+def __getattr__(name):
+    # Keeps `config.NOTION_CLIENT` and friends working without building them at import.
+    if name in REGISTRY:
+        return REGISTRY.get(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,219 @@
+"""
+This module keeps one Gemini model client per process and paces the requests
+sent to it.
+
+Vertex AI is initialized and the model built once, on first use. Requests go
+through an adaptive concurrency limit (AIMD) that backs off when Gemini
+answers 429/RESOURCE_EXHAUSTED and creeps back up while requests succeed,
+so a burst of videos runs at the quota instead of failing. Failed requests
+are retried with backoff as long as no text has been streamed yet, and each
+request has a deadline for the first token and one for the whole response.
+Every request is traced with its time to first token and total latency.
+"""
+# pipedream add-package google-cloud-aiplatform
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+
+import vertexai
+from vertexai.preview.generative_models import GenerativeModel
+
+import google_credentials
+import tracing
+from ratelimit import AdaptiveLimiter, backoff_delay
+
+MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-pro-vision")
+INITIAL_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", 4))
+MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 16))
+MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 4))
+FIRST_TOKEN_DEADLINE = float(os.environ.get("GEMINI_FIRST_TOKEN_DEADLINE", 120))
+REQUEST_DEADLINE = float(os.environ.get("GEMINI_DEADLINE", 600))
+
+THROTTLE_ERRORS = ("ResourceExhausted", "TooManyRequests")
+THROTTLE_MARKERS = ("429", "RESOURCE_EXHAUSTED")
+RETRY_ERRORS = THROTTLE_ERRORS + (
+    "ServiceUnavailable",
+    "InternalServerError",
+    "GatewayTimeout",
+    "DeadlineExceeded",
+    "Aborted",
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when Gemini doesn't answer within the request's deadline."""
+
+
+def is_throttled(error):
+    """True if the error is Gemini rejecting a request for quota."""
+    message = str(error)
+    return type(error).__name__ in THROTTLE_ERRORS or any(
+        marker in message for marker in THROTTLE_MARKERS
+    )
+
+
+def is_retryable(error):
+    """True for throttling, server errors, timeouts and dropped connections."""
+    return (
+        is_throttled(error)
+        or type(error).__name__ in RETRY_ERRORS
+        or isinstance(error, (ConnectionError, TimeoutError))
+    )
+
+
+def _read_stream(response, chunks, cancelled):
+    # Runs on a daemon thread so the caller can stop waiting at the deadline.
+    try:
+        for chunk in response:
+            if cancelled.is_set():
+                return
+            chunks.put(("chunk", chunk.text))
+        chunks.put(("done", None))
+    except BaseException as error:
+        chunks.put(("error", error))
+
+
+class GeminiClient:
+    """
+    Process-wide Gemini client with adaptive concurrency, retries and deadlines.
+    """
+
+    def __init__(
+        self,
+        model_name=MODEL_NAME,
+        model_factory=None,
+        limiter=None,
+        max_retries=MAX_RETRIES,
+        first_token_deadline=FIRST_TOKEN_DEADLINE,
+        deadline=REQUEST_DEADLINE,
+    ):
+        """
+        :param model_name: Gemini model to use.
+        :param model_factory: Callable returning the model; builds a Vertex AI
+            GenerativeModel if None.
+        :param limiter: AdaptiveLimiter shared by all requests.
+        :param max_retries: Retries after a retryable failure.
+        :param first_token_deadline: Seconds to wait for the first chunk.
+        :param deadline: Seconds the whole response may take.
+        """
+        self.model_name = model_name
+        self.model_factory = model_factory or self._vertex_model
+        self.limiter = limiter or AdaptiveLimiter(
+            INITIAL_CONCURRENCY, maximum=MAX_CONCURRENCY
+        )
+        self.max_retries = max_retries
+        self.first_token_deadline = first_token_deadline
+        self.deadline = deadline
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _vertex_model(self):
+        vertexai.init(
+            credentials=google_credentials.shared_credentials(),
+            project=os.getenv("GOOGLE_PROJECT_ID"),
+            location=os.getenv("GOOGLE_LOCATION"),
+        )
+        return GenerativeModel(self.model_name)
+
+    @property
+    def model(self):
+        """The model, initialized on first use."""
+        with self._lock:
+            if self._model is None:
+                self._model = self.model_factory()
+            return self._model
+
+    def _chunks(self, contents, span):
+        """Streams one request's text, enforcing the deadlines."""
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        response = self.model.generate_content(contents, stream=True)
+        threading.Thread(
+            target=_read_stream, args=(response, chunks, cancelled), daemon=True
+        ).start()
+        received = False
+        try:
+            while True:
+                if received:
+                    timeout = self.deadline - span.elapsed
+                else:
+                    timeout = min(self.first_token_deadline, self.deadline)
+                try:
+                    kind, value = chunks.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    raise DeadlineExceeded(
+                        "No %s from %s after %.1fs"
+                        % ("end" if received else "token", self.model_name, timeout)
+                    )
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                if not received:
+                    span.mark("first_token")
+                    received = True
+                yield value
+        finally:
+            cancelled.set()
+
+    def stream(self, contents):
+        """
+        Streams Gemini's response to contents.
+
+        Failures before the first chunk are retried; once text has been
+        yielded an error is raised to the caller.
+
+        :param contents: Prompt parts, as for GenerativeModel.generate_content.
+        :return: Generator of text chunks.
+        """
+        attempt = 0
+        while True:
+            ticket = self.limiter.acquire()
+            span = tracing.TRACER.start_span(
+                "gemini",
+                model=self.model_name,
+                attempt=attempt,
+                limit=round(self.limiter.limit, 2),
+                in_flight=self.limiter.in_flight,
+            )
+            yielded = False
+            throttled = False
+            try:
+                for text in self._chunks(contents, span):
+                    yielded = True
+                    yield text
+            except GeneratorExit:
+                span.finish()
+                raise
+            except Exception as error:
+                throttled = is_throttled(error)
+                span.set(throttled=throttled)
+                span.finish(error)
+                if yielded or attempt >= self.max_retries or not is_retryable(error):
+                    raise
+                logging.warning(
+                    "Gemini attempt %s failed, retrying: %s", attempt + 1, error
+                )
+            else:
+                span.finish()
+                return
+            finally:
+                self.limiter.release(
+                    ticket, throttled=throttled, success=span.error is None
+                )
+                tracing.TRACER.record(span)
+            time.sleep(backoff_delay(attempt, base=2.0, cap=60.0))
+            attempt += 1
+
+    def generate(self, contents):
+        """Returns Gemini's complete response text."""
+        return "".join(self.stream(contents))
+
+
+@functools.lru_cache(maxsize=None)
+def default_client():
+    """Returns the process-wide client, so every request shares one limit."""
+    return GeminiClient()
@@ -0,0 +1,140 @@
+"""
+This module builds the Google service account credentials once, in memory,
+and shares them between the storage and Vertex AI clients.
+
+The key comes from the GOOGLE_* environment variables (or, without them,
+the file named by GOOGLE_APPLICATION_CREDENTIALS), so nothing is written to
+disk. The credentials are scoped up front: clients only copy credentials
+that still need scopes, so every client holds the same object and one
+access token. The token is refreshed ahead of expiry, by the caller that
+notices first or by a background thread, so no request waits on the token
+exchange.
+"""
+# pipedream add-package google-auth
+import datetime
+import functools
+import logging
+import os
+import threading
+import time
+
+import google.auth.transport.requests
+from google.oauth2 import service_account
+
+import tracing
+
+SCOPES = ("https://www.googleapis.com/auth/cloud-platform",)
+# Tokens are refreshed this long before they expire.
+REFRESH_MARGIN = float(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN", 300))
+# Retry delay for the background refresh after a failure.
+RETRY_SECONDS = 30
+
+
+def service_account_info(environ=os.environ):
+    """
+    Builds the service account key from the environment.
+
+    :param environ: Mapping holding the GOOGLE_* variables.
+    :return: Key dict as in a service account JSON file, or None if
+        GOOGLE_PRIVATE_KEY isn't set.
+    """
+    private_key = environ.get("GOOGLE_PRIVATE_KEY")
+    if not private_key:
+        return None
+    return {
+        "type": "service_account",
+        "project_id": environ.get("GOOGLE_PROJECT_ID"),
+        "private_key_id": environ.get("GOOGLE_PRIVATE_KEY_ID"),
+        "private_key": private_key.replace("\\n", "\n"),
+        "client_email": environ.get("GOOGLE_CLIENT_EMAIL"),
+        "client_id": environ.get("GOOGLE_CLIENT_ID"),
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class CredentialsProvider:
+    """
+    Holds one set of scoped credentials and keeps their token fresh.
+    """
+
+    def __init__(self, info=None, refresh_margin=REFRESH_MARGIN, background=True):
+        """
+        :param info: Service account key dict; read from the environment if None.
+        :param refresh_margin: Seconds before expiry a token is refreshed.
+        :param background: Refresh from a daemon thread as well as on access.
+        """
+        self.info = info
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self._credentials = None
+        self._request = None
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def _build(self):
+        info = self.info or service_account_info()
+        if info is not None:
+            return service_account.Credentials.from_service_account_info(
+                info, scopes=SCOPES
+            )
+        return service_account.Credentials.from_service_account_file(
+            os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "google_auth.json"),
+            scopes=SCOPES,
+        )
+
+    def _seconds_left(self):
+        if not self._credentials.token or self._credentials.expiry is None:
+            return 0
+        return (self._credentials.expiry - _utcnow()).total_seconds()
+
+    def _refresh_if_needed(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._build()
+                self._request = google.auth.transport.requests.Request()
+            if self._seconds_left() > self.refresh_margin:
+                return
+            with tracing.span("token_refresh"):
+                self._credentials.refresh(self._request)
+
+    def _refresh_loop(self):
+        while True:
+            with self._lock:
+                wait = self._seconds_left() - self.refresh_margin
+            time.sleep(max(wait, 1))
+            try:
+                self._refresh_if_needed()
+            except Exception as error:
+                logging.warning("Google token refresh failed: %s", error)
+                time.sleep(RETRY_SECONDS)
+
+    def credentials(self):
+        """
+        Returns the shared credentials, with a token valid for at least the
+        refresh margin.
+        """
+        self._refresh_if_needed()
+        if self.background and self._refresher is None:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(
+                        target=self._refresh_loop, name="google-token", daemon=True
+                    )
+                    self._refresher.start()
+        return self._credentials
+
+
+@functools.lru_cache(maxsize=None)
+def default_provider():
+    """Returns the process-wide provider, so every client shares one token."""
+    return CredentialsProvider()
+
+
+def shared_credentials():
+    """Returns the process-wide credentials, freshly tokened."""
+    return default_provider().credentials()
@@ -0,0 +1,233 @@
+"""
+This module extracts the readable text of an HTML page for summarization.
+
+Scripts, styles, navigation, headers, footers and other boilerplate are
+dropped, the main content (<article>/<main>) is preferred, and extraction
+stops early once a character budget is reached. lxml is used when it is
+installed; otherwise a streaming html.parser backend is used.
+"""
+# pipedream add-package lxml
+import os
+import re
+from html.parser import HTMLParser
+
+try:
+    import lxml.html
+except ImportError:  # Fall back to the streaming stdlib parser.
+    lxml = None
+
+DEFAULT_MAX_CHARS = int(os.environ.get("LINK_TEXT_BUDGET", 20000))
+SKIP_TAGS = frozenset(
+    (
+        "title",
+        "script",
+        "style",
+        "noscript",
+        "template",
+        "svg",
+        "canvas",
+        "iframe",
+        "nav",
+        "header",
+        "footer",
+        "aside",
+        "form",
+        "button",
+        "select",
+    )
+)
+MAIN_TAGS = frozenset(("article", "main"))
+BLOCK_TAGS = frozenset(
+    (
+        "p",
+        "div",
+        "section",
+        "article",
+        "main",
+        "br",
+        "li",
+        "ul",
+        "ol",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "blockquote",
+        "pre",
+        "tr",
+        "table",
+        "figcaption",
+    )
+)
+# Void elements never get an end tag, so they must not open a skipped region.
+VOID_TAGS = frozenset(("br", "hr", "img", "input", "meta", "link", "source", "wbr"))
+# Main content shorter than this is treated as a false positive (e.g. a teaser card).
+MIN_MAIN_CHARS = 200
+FEED_SIZE = 64 * 1024
+
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_NEWLINES = re.compile(r"\s*\n\s*")
+
+
+def normalize_whitespace(text):
+    """Collapses runs of spaces and blank lines."""
+    return _NEWLINES.sub("\n", _SPACES.sub(" ", text)).strip()
+
+
+class _TextBuffer:
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+
+    def add(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def text(self):
+        return normalize_whitespace("".join(self.parts))[: self.max_chars]
+
+
+class StreamingExtractor(HTMLParser):
+    """
+    Single-pass extractor built on the stdlib HTML parser.
+    """
+
+    def __init__(self, max_chars=DEFAULT_MAX_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.page = _TextBuffer(max_chars)
+        self.main = _TextBuffer(max_chars)
+        # A region is left on the end tag matching the tag that opened it;
+        # same-named tags nested inside are counted so they don't close it early.
+        # Other tags inside are ignored, since <li>, <p> and friends often
+        # close implicitly and would never balance a plain depth counter.
+        self.skip_tag = None
+        self.skip_depth = 0
+        self.main_tag = None
+        self.main_depth = 0
+
+    @property
+    def done(self):
+        return self.main.full or self.page.full
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag == "br":
+                self._add("\n")
+            return
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+        if tag in SKIP_TAGS:
+            self.skip_tag, self.skip_depth = tag, 1
+            return
+        if self.main_tag is not None:
+            if tag == self.main_tag:
+                self.main_depth += 1
+        elif tag in MAIN_TAGS or dict(attrs).get("role") == "main":
+            self.main_tag, self.main_depth = tag, 1
+        if tag in BLOCK_TAGS:
+            self._add("\n")
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self.skip_tag is not None:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip_tag = None
+            return
+        if tag in BLOCK_TAGS:
+            self._add("\n")
+        if tag == self.main_tag:
+            self.main_depth -= 1
+            if not self.main_depth:
+                self.main_tag = None
+
+    def handle_data(self, data):
+        if self.skip_tag is None:
+            self._add(data)
+
+    def _add(self, text):
+        self.page.add(text)
+        if self.main_tag is not None:
+            self.main.add(text)
+
+    def text(self):
+        main = self.main.text()
+        if self.main.full or len(main) >= MIN_MAIN_CHARS:
+            return main
+        return self.page.text()
+
+
+def _extract_stdlib(html, max_chars):
+    extractor = StreamingExtractor(max_chars)
+    for start in range(0, len(html), FEED_SIZE):
+        extractor.feed(html[start : start + FEED_SIZE])
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text()
+
+
+def _iter_text(element, max_chars):
+    buffer = _TextBuffer(max_chars)
+    # A node's tail follows its whole subtree, so it is emitted on the end event.
+    for event, node in lxml.etree.iterwalk(element, events=("start", "end")):
+        if buffer.full:
+            break
+        tag = node.tag if isinstance(node.tag, str) else ""
+        if event == "start":
+            if tag in BLOCK_TAGS:
+                buffer.add("\n")
+            if tag and node.text:
+                buffer.add(node.text)
+            continue
+        if tag in BLOCK_TAGS:
+            buffer.add("\n")
+        if node.tail and node is not element:
+            buffer.add(node.tail)
+    return buffer.text()
+
+
+def _extract_lxml(html, max_chars):
+    try:
+        document = lxml.html.document_fromstring(html)
+    except (ValueError, lxml.etree.ParserError):
+        # e.g. a str carrying an XML encoding declaration.
+        return _extract_stdlib(html, max_chars)
+    for element in document.xpath(
+        "|".join("//%s" % tag for tag in sorted(SKIP_TAGS)) + "|//comment()"
+    ):
+        element.drop_tree()
+    for element in document.xpath("//article|//main|//*[@role='main']"):
+        text = _iter_text(element, max_chars)
+        if len(text) >= min(MIN_MAIN_CHARS, max_chars):
+            return text
+    body = document.find("body")
+    return _iter_text(body if body is not None else document, max_chars)
+
+
+def extract_text(html, max_chars=DEFAULT_MAX_CHARS, backend=None):
+    """
+    Extracts the main readable text of an HTML document.
+
+    :param html: HTML source.
+    :param max_chars: Character budget; extraction stops once it is reached.
+    :param backend: "lxml" or "stdlib"; defaults to lxml when installed.
+    :return: Normalized text of at most max_chars characters.
+    """
+    if backend is None:
+        backend = "lxml" if lxml is not None else "stdlib"
+    if backend == "lxml":
+        return _extract_lxml(html, max_chars)
+    return _extract_stdlib(html, max_chars)
@@ -0,0 +1,245 @@
+"""
+This module provides the shared HTTP fetcher used for generic page fetches.
+
+It reuses pooled connections per host, applies timeouts and a body size cap,
+and keeps an on-disk HTTP cache that honours Cache-Control, ETag and
+Last-Modified, revalidating stale entries with conditional requests.
+"""
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", "/tmp/http_cache")
+DEFAULT_TIMEOUT = (5, 20)
+DEFAULT_MAX_BODY_SIZE = int(os.environ.get("HTTP_MAX_BODY_SIZE", 5 * 1024 * 1024))
+USER_AGENT = "Mozilla/5.0 (compatible; NotionAutomations/1.0)"
+
+FetchResult = namedtuple("FetchResult", "url status text from_cache truncated")
+
+
+def parse_cache_control(value):
+    """
+    Parses a Cache-Control header into a dict of lower-cased directives.
+
+    :param value: Header value, may be None.
+    :return: Dict mapping directive to its value (True for bare directives).
+    """
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else True
+    return directives
+
+
+def freshness_lifetime(headers, now):
+    """
+    Returns how long a response may be served without revalidation.
+
+    :param headers: Response headers.
+    :param now: Current time, in seconds since the epoch.
+    :return: Lifetime in seconds (0 means revalidate every time).
+    """
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return 0
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return max(0, email.utils.parsedate_to_datetime(expires).timestamp() - now)
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+
+class FetchStats:
+    """
+    Thread-safe counters describing the cache's effect.
+    """
+
+    FIELDS = ("hits", "misses", "revalidated", "bytes_saved", "bytes_fetched")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    def snapshot(self):
+        """Returns a copy of the counters."""
+        with self._lock:
+            return dict(self._counts)
+
+
+class HttpFetcher:
+    """
+    Pooled, caching HTTP GET client.
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        timeout=DEFAULT_TIMEOUT,
+        max_body_size=DEFAULT_MAX_BODY_SIZE,
+        pool_connections=32,
+        pool_maxsize=8,
+        clock=time.time,
+    ):
+        """
+        :param cache_dir: Directory of the on-disk cache, or None to disable it.
+        :param timeout: (connect, read) timeout in seconds.
+        :param max_body_size: Bytes read per response before the body is truncated.
+        :param pool_connections: Number of hosts with a kept-alive pool.
+        :param pool_maxsize: Connections kept alive per host.
+        :param clock: Time source, in seconds since the epoch.
+        """
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_body_size = max_body_size
+        self.clock = clock
+        self.stats = FetchStats()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_text(self, url):
+        """
+        Fetches a URL and returns its decoded body.
+
+        :param url: URL to fetch.
+        :return: Response text.
+        :raises requests.RequestException: On network errors and 4xx/5xx responses.
+        """
+        return self.fetch(url).text
+
+    def fetch(self, url):
+        """
+        Fetches a URL, serving it from the cache when fresh or still valid.
+
+        :param url: URL to fetch.
+        :return: FetchResult(url, status, text, from_cache, truncated).
+        :raises requests.RequestException: On network errors and 4xx/5xx responses.
+        """
+        now = self.clock()
+        entry = self._load(url)
+        if entry is not None and now < entry["expires_at"]:
+            self.stats.add(hits=1, bytes_saved=len(entry["body"]))
+            return FetchResult(url, 200, self._decode(entry), True, False)
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with self.session.get(
+            url, headers=headers, timeout=self.timeout, stream=True
+        ) as response:
+            if response.status_code == 304 and entry is not None:
+                self.stats.add(revalidated=1, bytes_saved=len(entry["body"]))
+                entry["expires_at"] = now + freshness_lifetime(response.headers, now)
+                self._store(url, entry)
+                return FetchResult(url, 200, self._decode(entry), True, False)
+            response.raise_for_status()
+            body, truncated = self._read_body(response)
+
+        self.stats.add(misses=1, bytes_fetched=len(body))
+        entry = {
+            "url": url,
+            "body": body,
+            "encoding": response.encoding or "utf-8",
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires_at": now + freshness_lifetime(response.headers, now),
+        }
+        if not truncated and self._cacheable(response, entry, now):
+            self._store(url, entry)
+        return FetchResult(url, response.status_code, self._decode(entry), False, truncated)
+
+    def _read_body(self, response):
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_body_size:
+                logging.info("Truncated %s at %s bytes", response.url, self.max_body_size)
+                return b"".join(chunks)[: self.max_body_size], True
+        return b"".join(chunks), False
+
+    def _cacheable(self, response, entry, now):
+        directives = parse_cache_control(response.headers.get("Cache-Control"))
+        if "no-store" in directives or response.status_code != 200:
+            return False
+        return bool(entry["etag"] or entry["last_modified"] or entry["expires_at"] > now)
+
+    @staticmethod
+    def _decode(entry):
+        try:
+            return entry["body"].decode(entry["encoding"], errors="replace")
+        except LookupError:
+            return entry["body"].decode("utf-8", errors="replace")
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def _load(self, url):
+        if not self.cache_dir:
+            return None
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as infile:
+                entry = json.load(infile)
+            with open(body_path, "rb") as infile:
+                entry["body"] = infile.read()
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _store(self, url, entry):
+        if not self.cache_dir:
+            return
+        meta_path, body_path = self._paths(url)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        suffix = ".%d.tmp" % threading.get_ident()
+        with open(body_path + suffix, "wb") as outfile:
+            outfile.write(entry["body"])
+        os.replace(body_path + suffix, body_path)
+        metadata = {name: value for name, value in entry.items() if name != "body"}
+        with open(meta_path + suffix, "w") as outfile:
+            json.dump(metadata, outfile)
+        os.replace(meta_path + suffix, meta_path)
@@ -0,0 +1,544 @@
+"""
+This module runs the handler pipelines as durable, resumable jobs.
+
+Jobs live in a SQLite database in WAL mode. Each job kind maps to a
+Pipeline of named stages; the value of every finished stage (compressed
+file, GCS URI, raw LLM output, Notion URL, ...) is checkpointed, so a job
+that crashes or times out resumes from its last completed stage instead of
+starting over. Workers lease jobs, keep the lease alive with heartbeats,
+and a lease that stops being renewed is taken over by another worker.
+
+Run a worker daemon with:
+
+    python job_queue.py --concurrency 4 --modules video_summarize,links
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import tracing
+from ratelimit import backoff_delay
+
+DEFAULT_DB_PATH = os.environ.get("JOB_QUEUE_DB", "/tmp/job_queue.sqlite3")
+# "inline" runs a handler's job in the handler; "queue" only enqueues it for a worker.
+JOB_MODE = os.environ.get("JOB_MODE", "inline")
+LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 120))
+# Inline leases are short, so a retry of a crashed or timed-out handler takes over
+# quickly; INLINE_WAIT_SECONDS bounds how long it waits for another owner.
+INLINE_LEASE_SECONDS = float(os.environ.get("JOB_INLINE_LEASE_SECONDS", 15))
+INLINE_WAIT_SECONDS = float(os.environ.get("JOB_INLINE_WAIT_SECONDS", 600))
+DEFAULT_CONCURRENCY = int(os.environ.get("JOB_WORKERS", 2))
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Job kind -> Pipeline, filled in by the modules that define the pipelines.
+PIPELINES = {}
+
+
+class LeaseLost(Exception):
+    """Raised when a worker no longer holds the lease of the job it is running."""
+
+
+class Job:
+    """A leased job: its payload and the checkpoints of its completed stages."""
+
+    def __init__(self, job_id, kind, payload, checkpoints, attempts, state=None):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.checkpoints = checkpoints
+        self.attempts = attempts
+        self.state = state
+
+
+class Pipeline:
+    """
+    An ordered list of named stages.
+
+    Each stage is called as stage(payload, checkpoints) and returns a
+    JSON-serializable value, which is checkpointed under the stage's name.
+    The last stage's value is the job's result.
+    """
+
+    def __init__(self, stages):
+        """
+        :param stages: List of (name, callable) pairs in execution order.
+        """
+        self.stages = list(stages)
+
+    def run(self, job, checkpoint):
+        """
+        Runs the stages that have no checkpoint yet.
+
+        :param job: The Job to run.
+        :param checkpoint: Callable(stage, value) persisting a stage's value.
+        :return: Value of the last stage.
+        """
+        for name, stage in self.stages:
+            if name in job.checkpoints:
+                logging.info("Job %s: resuming past stage %s", job.id, name)
+                continue
+            value = stage(job.payload, job.checkpoints)
+            checkpoint(name, value)
+            job.checkpoints[name] = value
+        return job.checkpoints[self.stages[-1][0]]
+
+
+def register_pipeline(kind, stages):
+    """Registers the pipeline workers run for jobs of the given kind."""
+    PIPELINES[kind] = Pipeline(stages)
+    return PIPELINES[kind]
+
+
+class JobQueue:
+    """
+    SQLite-backed queue with leases, heartbeats, checkpoints and retries.
+    """
+
+    def __init__(
+        self, path=DEFAULT_DB_PATH, lease_seconds=LEASE_SECONDS, clock=time.time
+    ):
+        """
+        :param path: SQLite database file, shared by every worker on the host.
+        :param lease_seconds: How long a lease lasts without a heartbeat.
+        :param clock: Time source, in seconds since the epoch.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY,"
+                " kind TEXT NOT NULL,"
+                " dedupe_key TEXT,"
+                " payload TEXT NOT NULL,"
+                " state TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL,"
+                " available_at REAL NOT NULL,"
+                " lease_owner TEXT,"
+                " lease_expires REAL,"
+                " checkpoints TEXT NOT NULL DEFAULT '{}',"
+                " result TEXT,"
+                " error TEXT,"
+                " updated_at REAL NOT NULL"
+                ")"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, available_at)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key)"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def enqueue(
+        self, kind, payload, dedupe_key=None, max_attempts=DEFAULT_MAX_ATTEMPTS
+    ):
+        """
+        Adds a job to the queue.
+
+        :param kind: Pipeline to run, e.g. "video".
+        :param payload: JSON-serializable job input.
+        :param dedupe_key: If a job has this key, its ID is returned instead of
+            adding a second job; a failed one is requeued with fresh attempts,
+            so it resumes from its checkpoints.
+        :param max_attempts: Runs before the job is marked failed.
+        :return: Job ID.
+        """
+        now = self.clock()
+        with self._transaction() as connection:
+            if dedupe_key is not None:
+                row = connection.execute(
+                    "SELECT id, state FROM jobs WHERE dedupe_key = ?"
+                    " ORDER BY id DESC LIMIT 1",
+                    (dedupe_key,),
+                ).fetchone()
+                if row is not None:
+                    if row[1] == "failed":
+                        connection.execute(
+                            "UPDATE jobs SET state = 'queued', attempts = 0,"
+                            " max_attempts = ?, available_at = ?, error = NULL,"
+                            " updated_at = ? WHERE id = ?",
+                            (max_attempts, now, now, row[0]),
+                        )
+                    return row[0]
+            cursor = connection.execute(
+                "INSERT INTO jobs (kind, dedupe_key, payload, state, max_attempts,"
+                " available_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (kind, dedupe_key, json.dumps(payload), max_attempts, now, now),
+            )
+            return cursor.lastrowid
+
+    def lease(self, owner, kinds=None, job_id=None, lease_seconds=None):
+        """
+        Leases the oldest runnable job: queued and due, or running with an
+        expired lease (its worker died).
+
+        :param owner: Worker ID taking the lease.
+        :param kinds: Only lease jobs of these kinds.
+        :param job_id: Lease this specific job instead, ignoring its retry backoff.
+        :param lease_seconds: Lease length; defaults to the queue's.
+        :return: Job, or None if nothing is runnable.
+        """
+        now = self.clock()
+        lease_seconds = lease_seconds or self.lease_seconds
+        query = (
+            "SELECT id, kind, payload, checkpoints, attempts FROM jobs"
+            " WHERE ((state = 'queued' AND available_at <= ?)"
+            " OR (state = 'running' AND lease_expires < ?))"
+        )
+        params = [now, now]
+        if job_id is not None:
+            # A caller asking for one job runs it now, even while it backs off.
+            params = [float("inf"), now]
+            query += " AND id = ?"
+            params.append(job_id)
+        if kinds:
+            query += " AND kind IN (%s)" % ",".join("?" * len(kinds))
+            params += list(kinds)
+        query += " ORDER BY available_at LIMIT 1"
+        with self._transaction() as connection:
+            row = connection.execute(query, params).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1,"
+                " lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                (owner, now + lease_seconds, now, row[0]),
+            )
+        return Job(
+            row[0], row[1], json.loads(row[2]), json.loads(row[3]), row[4] + 1
+        )
+
+    def _update_leased(self, job_id, owner, assignments, params):
+        cursor = self._connection().execute(
+            "UPDATE jobs SET %s, updated_at = ? WHERE id = ? AND lease_owner = ?"
+            " AND state = 'running'" % assignments,
+            list(params) + [self.clock(), job_id, owner],
+        )
+        if cursor.rowcount != 1:
+            raise LeaseLost("Job %s is no longer leased by %s" % (job_id, owner))
+
+    def heartbeat(self, job_id, owner, lease_seconds=None):
+        """
+        Extends a lease.
+
+        :param lease_seconds: New lease length; defaults to the queue's.
+        :raises LeaseLost: If the lease expired and another worker took the job.
+        """
+        self._update_leased(
+            job_id,
+            owner,
+            "lease_expires = ?",
+            [self.clock() + (lease_seconds or self.lease_seconds)],
+        )
+
+    def checkpoint(self, job_id, owner, stage, value, lease_seconds=None):
+        """Persists the value of a completed stage and extends the lease."""
+        self._update_leased(
+            job_id,
+            owner,
+            "checkpoints = json_set(checkpoints, ?, json(?)), lease_expires = ?",
+            [
+                "$." + stage,
+                json.dumps(value),
+                self.clock() + (lease_seconds or self.lease_seconds),
+            ],
+        )
+
+    def complete(self, job_id, owner, result):
+        """Marks a job done with its result."""
+        self._update_leased(
+            job_id,
+            owner,
+            "state = 'done', result = ?, lease_owner = NULL",
+            [json.dumps(result)],
+        )
+
+    def fail(self, job_id, owner, error, retry=True):
+        """
+        Releases a job after an error: requeued with backoff while it has
+        attempts left, marked failed otherwise. Its checkpoints are kept.
+        """
+        row = self._connection().execute(
+            "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if retry and row is not None and row[0] < row[1]:
+            self._update_leased(
+                job_id,
+                owner,
+                "state = 'queued', available_at = ?, error = ?, lease_owner = NULL",
+                [self.clock() + backoff_delay(row[0]), str(error)],
+            )
+        else:
+            self._update_leased(
+                job_id,
+                owner,
+                "state = 'failed', error = ?, lease_owner = NULL",
+                [str(error)],
+            )
+
+    def get(self, job_id):
+        """
+        Returns a job's current state.
+
+        :return: Job with state, checkpoints and (for done jobs) a result
+            attribute, or None for an unknown ID.
+        """
+        row = self._connection().execute(
+            "SELECT id, kind, payload, checkpoints, attempts, state, result, error"
+            " FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = Job(
+            row[0], row[1], json.loads(row[2]), json.loads(row[3]), row[4], row[5]
+        )
+        job.result = json.loads(row[6]) if row[6] is not None else None
+        job.error = row[7]
+        return job
+
+    def find(self, dedupe_key):
+        """
+        Returns the job enqueued with a dedupe key, like get.
+
+        :return: Job, or None if no job has the key.
+        """
+        row = self._connection().execute(
+            "SELECT id FROM jobs WHERE dedupe_key = ? ORDER BY id DESC LIMIT 1",
+            (dedupe_key,),
+        ).fetchone()
+        return self.get(row[0]) if row is not None else None
+
+
+class Worker:
+    """
+    Leases jobs and runs their pipelines, heartbeating while they run.
+    """
+
+    def __init__(
+        self,
+        queue,
+        pipelines=None,
+        concurrency=DEFAULT_CONCURRENCY,
+        owner=None,
+        poll_interval=1.0,
+        lease_seconds=None,
+    ):
+        """
+        :param queue: JobQueue to work on.
+        :param pipelines: Dict of job kind to Pipeline; defaults to PIPELINES.
+        :param concurrency: Jobs run at once by run_forever.
+        :param owner: Worker ID; defaults to host:pid.
+        :param poll_interval: Seconds to wait when the queue is empty.
+        :param lease_seconds: Lease length of this worker's jobs; defaults to
+            the queue's.
+        """
+        self.queue = queue
+        self.pipelines = PIPELINES if pipelines is None else pipelines
+        self.concurrency = concurrency
+        self.owner = owner or "%s:%s" % (socket.gethostname(), os.getpid())
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds or queue.lease_seconds
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def run_job(self, job):
+        """
+        Runs a leased job to completion, or releases it for a retry.
+
+        :param job: Job returned by JobQueue.lease.
+        :return: The job's result.
+        """
+        with self._lock:
+            self._active.add(job.id)
+        try:
+            with tracing.span(
+                "job", kind=job.kind, job_id=job.id, attempt=job.attempts
+            ):
+                result = self.pipelines[job.kind].run(
+                    job,
+                    lambda stage, value: self.queue.checkpoint(
+                        job.id, self.owner, stage, value, self.lease_seconds
+                    ),
+                )
+            self.queue.complete(job.id, self.owner, result)
+            return result
+        except LeaseLost:
+            raise
+        except Exception as error:
+            logging.warning(
+                "Job %s failed on attempt %s: %s", job.id, job.attempts, error
+            )
+            self.queue.fail(job.id, self.owner, error)
+            raise
+        finally:
+            with self._lock:
+                self._active.discard(job.id)
+
+    def run_inline(self, job_id, wait_seconds=INLINE_WAIT_SECONDS):
+        """
+        Runs one specific job in the calling thread, e.g. inside a handler.
+
+        While another owner holds the lease, e.g. an earlier attempt of the same
+        handler, this polls until the job is done or the lease expires and can
+        be taken over.
+
+        :param job_id: ID of the job.
+        :param wait_seconds: How long to wait for another owner.
+        :return: The job's result (immediately, if it is already done).
+        :raises LeaseLost: If the job is not done and stays leased for
+            wait_seconds, or cannot run at all.
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            job = self.queue.lease(
+                self.owner, job_id=job_id, lease_seconds=self.lease_seconds
+            )
+            if job is not None:
+                break
+            existing = self.queue.get(job_id)
+            if existing is not None and existing.state == "done":
+                return existing.result
+            if (
+                existing is None
+                or existing.state != "running"
+                or time.monotonic() >= deadline
+            ):
+                raise LeaseLost("Job %s is not runnable" % job_id)
+            time.sleep(self.poll_interval)
+        with self._heartbeats():
+            return self.run_job(job)
+
+    def _heartbeat_loop(self, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                active = list(self._active)
+            for job_id in active:
+                try:
+                    self.queue.heartbeat(job_id, self.owner, self.lease_seconds)
+                except LeaseLost as error:
+                    logging.warning("%s", error)
+
+    @contextmanager
+    def _heartbeats(self):
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._heartbeat_loop, args=(stop,), daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _work(self, stop):
+        while not stop.is_set():
+            job = self.queue.lease(self.owner, kinds=list(self.pipelines))
+            if job is None:
+                stop.wait(self.poll_interval)
+                continue
+            try:
+                self.run_job(job)
+            except Exception:
+                pass  # Already logged and released by run_job.
+            tracing.TRACER.write_metrics()
+
+    def run_forever(self, stop=None):
+        """
+        Runs jobs on concurrency threads until stop is set.
+
+        :param stop: threading.Event ending the loop; runs forever if None.
+        """
+        stop = stop or threading.Event()
+        with self._heartbeats(), ThreadPoolExecutor(self.concurrency) as executor:
+            for _ in range(self.concurrency):
+                executor.submit(self._work, stop)
+
+
+def run_handler_job(kind, payload, dedupe_key=None, queue=None):
+    """
+    Enqueues a job for a handler and, in inline mode, runs it right away.
+
+    A retried handler passing the same dedupe_key resumes the existing job from
+    its checkpoints instead of starting a new one.
+
+    :param kind: Pipeline to run.
+    :param payload: JSON-serializable job input.
+    :param dedupe_key: See JobQueue.enqueue.
+    :param queue: JobQueue; defaults to the shared one from config.
+    :return: The job's result inline, {"job_id": id} in queue mode.
+    """
+    if queue is None:
+        import config
+
+        queue = config.get_client("JOB_QUEUE")
+    job_id = queue.enqueue(kind, payload, dedupe_key=dedupe_key)
+    if JOB_MODE != "inline":
+        return {"job_id": job_id}
+    # One owner per invocation: a retry in the same warm process must not pass
+    # for the attempt it replaces.
+    worker = Worker(
+        queue,
+        owner="inline:%s:%s:%s"
+        % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]),
+        lease_seconds=INLINE_LEASE_SECONDS,
+    )
+    return worker.run_inline(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs queued handler jobs.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument(
+        "--modules",
+        default="video_summarize,links",
+        help="Modules whose pipelines to run",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Pipelines register themselves on the importable module, not on __main__.
+    registry = importlib.import_module("job_queue")
+    for module in args.modules.split(","):
+        importlib.import_module(module)
+    registry.Worker(
+        registry.JobQueue(args.db), registry.PIPELINES, args.concurrency
+    ).run_forever()
+
+
+if __name__ == "__main__":
+    main()
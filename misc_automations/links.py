@@ -2,19 +2,39 @@
 This module provides functionality to extract information from URLs,
 retrieve page text, and scrape data based on the company associated with the URL.
 """
-import json
+import functools
 import logging
-import os
-import re
-import time
+import threading
 import urllib.parse
-from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from bs4 import BeautifulSoup
 from langchainllm import LangChainLLM
 from scrapers import Instagram, Threads, Twitter, YouTube
 
+import chunked_summary
+import config
+import html_extract
+import job_queue
+import scraper_registry
+import tracing
+import url_index
+
+
+# Long-lived scraper instances, shared across URLs and threads.
+SCRAPERS = scraper_registry.ScraperPool(
+    {"Threads": Threads, "Twitter": Twitter, "Instagram": Instagram, "YouTube": YouTube}
+)
+LinkResult = namedtuple("LinkResult", "url notion_url error")
+
+# Concurrent fetches allowed per scraped platform; other hosts get DEFAULT_HOST_LIMIT each.
+DEFAULT_DOMAIN_LIMITS = {"Instagram": 2, "Threads": 2, "Twitter": 2, "YouTube": 4}
+DEFAULT_HOST_LIMIT = 4
+# Version of the dict handler returns. 1 was the extracted link text itself;
+# 2 runs the whole pipeline and returns the Notion page (see handler).
+RESULT_VERSION = 2
+
 
 class EnhancedLinkProcessor:
     """
@@ -22,52 +42,158 @@ class EnhancedLinkProcessor:
     and saving to a Notion database.
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_workers=16,
+        llm_concurrency=4,
+        notion_concurrency=3,
+        domain_limits=None,
+    ):
+        """
+        :param max_workers: Threads used by process_batch.
+        :param llm_concurrency: Summaries in flight at once.
+        :param notion_concurrency: Notion writes in flight at once.
+        :param domain_limits: Concurrent fetches per platform (see DEFAULT_DOMAIN_LIMITS).
+        """
         self.lang_model = LangChainLLM()  # Initialize the language model
+        self.max_workers = max_workers
+        self.domain_limits = dict(DEFAULT_DOMAIN_LIMITS, **(domain_limits or {}))
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        # Long pages are summarized chunk by chunk; every call holds an LLM slot.
+        self.summarizer = chunked_summary.MapReduceSummarizer(
+            self.lang_model.summarize,
+            cache=chunked_summary.ChunkCache(),
+            slots=self._llm_slots,
+        )
+        self._notion_slots = threading.BoundedSemaphore(notion_concurrency)
+        self._domain_slots = {}
+        self._domain_lock = threading.Lock()
+
+    def _domain_slot(self, url):
+        """Returns the semaphore limiting concurrent fetches for the URL's platform or host."""
+        domain = parse_url(url)[0]
+        key = scraper_registry.platform_for_host(domain) or domain
+        with self._domain_lock:
+            if key not in self._domain_slots:
+                limit = self.domain_limits.get(key, DEFAULT_HOST_LIMIT)
+                self._domain_slots[key] = threading.BoundedSemaphore(limit)
+            return self._domain_slots[key]
+
+    def fetch_text(self, url):
+        """Step 1: Use existing functionality to get link data."""
+        with self._domain_slot(url):
+            return get_link_data(url)
+
+    def summarize(self, link_text):
+        """Step 2: Use the LangChainLLM to analyze and summarize the link text."""
+        with tracing.span("llm", input_chars=len(link_text)):
+            return self.summarizer.summarize(link_text)
+
+    def save(self, summary_content):
+        """Step 3: Create a new Notion page with the summary."""
+        with self._notion_slots:
+            return create_notion_page(summary_content)
 
     def process_link(self, url):
         """
         Process the given URL to extract information, generate a summary, and save to Notion.
 
+        Links already in the seen-index (under any URL variant) short-circuit to
+        their existing Notion page.
+
         :param url: The URL to process.
-        :return: URL of the created Notion page.
+        :return: URL of the created (or existing) Notion page.
+        :raises url_index.InFlightError: If another worker is processing the same link.
+        """
+        index = config.get_client("LINK_INDEX")
+        canonical_url = url_index.canonicalize_url(url)
+        claimed, existing_url = index.claim(canonical_url)
+        if existing_url is not None:
+            logging.info("Skipping duplicate link %s: %s", url, existing_url)
+            return existing_url
+        if not claimed:
+            raise url_index.InFlightError(canonical_url)
+
+        try:
+            link_text = self.fetch_text(url)
+            summary_content = self.summarize(link_text)
+            notion_page_url = self.save(summary_content)
+        except BaseException:
+            index.release(canonical_url)
+            raise
+
+        index.record(canonical_url, notion_page_url)
+        return notion_page_url
+
+    def process_batch(self, urls):
         """
-        # Step 1: Use existing functionality to get link data
-        link_text = get_link_data(url)
+        Process many URLs concurrently. A failing URL doesn't abort the batch.
 
-        # Step 2: Use the LangChainLLM to analyze and summarize the link text
-        summary_content = self.lang_model.summarize(link_text)
+        Variants of the same link are processed once, and every one of them gets
+        that result.
 
-        # Step 3: Create a new Notion page with the summary
-        notion_page_url = create_notion_page(summary_content)
+        :param urls: Iterable of URLs to process.
+        :return: List of LinkResult(url, notion_url, error) in input order.
+        """
+        urls = list(urls)
+        keys = []
+        for url in urls:
+            try:
+                keys.append(url_index.canonicalize_url(url))
+            except ValueError:
+                keys.append(url)  # process_link reports the error.
+        # The first variant of each link stands in for the others.
+        firsts = {}
+        for key, url in zip(keys, urls):
+            firsts.setdefault(key, url)
 
-        return notion_page_url
+        def process_one(url):
+            try:
+                return self.process_link(url), None
+            except Exception as error:
+                logging.warning("Failed to process %s: %s", url, error)
+                return None, error
 
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(firsts, executor.map(process_one, firsts.values())))
+        return [LinkResult(url, *results[key]) for url, key in zip(urls, keys)]
 
-def create_notion_page(summary_content):
-    """Create a new page in Notion based on the summary content."""
-    response = config.NOTION_CLIENT.pages.create(
-        parent={"database_id": config.SECRETS["MEDIA_SAVES_DB"]},
-        properties={
-            "Name": {"title": [{"text": {"content": summary_content["TITLE"]}}]},
-            "Key points": {
-                "rich_text": [{"text": {"content": summary_content["KEYPOINTS"]}}]
-            },
-            "Summary": {
-                "rich_text": [{"text": {"content": summary_content["SUMMARY"]}}]
-            },
-            "Tags": {
-                "multi_select": [{"name": tag} for tag in summary_content["TAGS"]]
-            },
-        },
-    )
-    logging.info(
-        "%s Created Notion page: %s",
-        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-        summary_content["TITLE"],
+
+@functools.lru_cache(maxsize=None)
+def shared_processor():
+    """Returns the EnhancedLinkProcessor the link job pipeline runs on."""
+    return EnhancedLinkProcessor()
+
+
+def fetch_stage(payload, checkpoints):
+    return shared_processor().fetch_text(payload["url"])
+
+
+def summarize_stage(payload, checkpoints):
+    return shared_processor().summarize(checkpoints["link_text"])
+
+
+def save_stage(payload, checkpoints):
+    notion_url = shared_processor().save(checkpoints["summary"])
+    config.get_client("LINK_INDEX").record(
+        url_index.canonicalize_url(payload["url"]), notion_url
     )
+    return {"url": notion_url}
+
 
-    return response["url"]
+job_queue.register_pipeline(
+    "link",
+    [
+        ("link_text", fetch_stage),
+        ("summary", summarize_stage),
+        ("notion_page", save_stage),
+    ],
+)
+
+
+def create_notion_page(summary_content):
+    """Create a new page in Notion based on the summary content."""
+    return config.create_notion_page(summary_content)
 
 
 def get_page_text(url):
@@ -78,14 +204,25 @@ def get_page_text(url):
     :return: Text content of the webpage or error message.
     """
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        return soup.get_text()
+        with tracing.span("download") as span:
+            html = config.get_client("HTTP_FETCHER").get_text(url)
+            span.set(chars=len(html))
+        with tracing.span("extract") as span:
+            text = html_extract.extract_text(html)
+            span.set(chars=len(text))
+        return text
     except requests.RequestException as e:
         return str(e)
 
 
+def fetch_stats():
+    """
+    Returns the page cache counters (hits, misses, revalidated, bytes_saved,
+    bytes_fetched) for this worker.
+    """
+    return config.get_client("HTTP_FETCHER").stats.snapshot()
+
+
 def parse_url(url):
     """
     Parses the given URL and extracts the domain and path.
@@ -101,22 +238,12 @@ def parse_url(url):
 
 def map_domain_to_company(domain):
     """
-    Maps domain to company name using a direct lookup dictionary.
+    Maps domain to company name using the precompiled scraper domain index.
 
     :param domain: The domain to map.
     :return: Mapped company name or "N/A" if not found.
     """
-    domain_company_map = {
-        "instagram": "Instagram",
-        "threads.": "Threads",
-        "youtube": "YouTube",
-        "x.com": "Twitter",
-        "twitter": "Twitter",
-    }
-    for key in domain_company_map:
-        if key in domain:
-            return domain_company_map[key]
-    return "N/A"
+    return scraper_registry.platform_for_host(domain) or "N/A"
 
 
 def extract_page_id(domain, path, query):
@@ -128,12 +255,8 @@ def extract_page_id(domain, path, query):
     :param query: The query of the URL.
     :return: Extracted page ID.
     """
-    if domain == "youtube.com":
-        query_params = urllib.parse.parse_qs(query)
-        return query_params.get("v", [None])[0]
-    else:
-        path_parts = path.strip("/").split("/")
-        return path_parts[-1]
+    platform = scraper_registry.platform_for_host(domain)
+    return scraper_registry.extract_page_id(platform, domain, path, query)
 
 
 def get_link_data(url):
@@ -143,31 +266,35 @@ def get_link_data(url):
     :param url: The URL to extract data from.
     :return: Extracted data or webpage text as fallback.
     """
-    domain, path = parse_url(url)[:2]
-    company = map_domain_to_company(domain)
-    page_id = extract_page_id(domain, path, urllib.parse.urlparse(url).query)
-
-    if company == "Threads":
-        scraper = Threads()
-    elif company == "Twitter":
-        scraper = Twitter()
-    elif company == "Instagram":
-        scraper = Instagram()
-    elif company == "YouTube":
-        scraper = YouTube()
-    else:
+    route = scraper_registry.route(url)
+    if route.platform is None:
         return get_page_text(url)
 
-    return scraper.get_data(page_id)
+    with tracing.span("scrape", platform=route.platform):
+        return SCRAPERS.get_data(route.platform, route.page_id)
 
 
+@tracing.instrument_handler("links")
 def handler(pd):
     """
-    Handler function to process URLs and extract link data.
+    Handler function that enqueues the link pipeline (extract, summarize,
+    save to Notion) and, with JOB_MODE=inline (the default), runs it right away.
+
+    Result version 2: the step no longer returns the extracted link text (v1)
+    but one of the dicts below, each with "version": 2. Downstream steps that
+    read the text should take it from the Notion page instead.
 
     :param pd: Pipedream context or similar context object.
-    :return: Extracted link data.
+    :return: {"url": notion_url} inline, {"job_id": id} in queue mode, or
+        {"duplicate_of": notion_url} for a link that already has a Notion page.
     """
     url = pd.steps["trigger"]["event"]["properties"]["URL"]["url"]
-    link_data = get_link_data(url)
-    return link_data
+    canonical_url = url_index.canonicalize_url(url)
+    notion_url = config.get_client("LINK_INDEX").lookup(canonical_url)
+    if notion_url is not None:
+        result = {"duplicate_of": notion_url}
+    else:
+        result = job_queue.run_handler_job(
+            "link", {"url": url}, dedupe_key=canonical_url
+        )
+    return dict(result, version=RESULT_VERSION)
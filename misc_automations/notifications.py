@@ -0,0 +1,249 @@
+"""
+This module sends Pushover notifications through a single asyncio dispatcher.
+
+One dispatcher is kept per process: it runs its own event loop on a daemon
+thread, so every handler call shares one keep-alive connection pool and one
+token bucket instead of fixed sleeps. It sends in priority order and retries
+transient failures with backoff, honouring Retry-After.
+"""
+# pipedream add-package aiohttp
+import asyncio
+import datetime
+import email.utils
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+
+import aiohttp
+
+import tracing
+from ratelimit import TokenBucket, backoff_delay
+
+PUSHOVER_URL = os.environ.get(
+    "PUSHOVER_URL", "https://api.pushover.net/1/messages.json"
+)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Pushover truncates longer messages and rejects longer titles.
+MAX_MESSAGE_LENGTH = 1024
+MAX_TITLE_LENGTH = 250
+
+
+class DeliveryError(Exception):
+    """Raised when a notification could not be delivered."""
+
+    def __init__(self, status, body):
+        super().__init__("Pushover returned %s: %s" % (status, body))
+        self.status = status
+        self.body = body
+
+
+class PushoverAuthError(DeliveryError):
+    """
+    Raised when Pushover rejects the app token or user key.
+
+    Pushover reports these as HTTP 400, e.g. {"token": "invalid"}; auth_failed
+    lets secrets_cache.is_auth_error refresh the credentials.
+    """
+
+    auth_failed = True
+
+
+def delivery_error(status, body):
+    """
+    Builds the error for a failed Pushover response.
+
+    :param status: HTTP status code.
+    :param body: Response body.
+    :return: PushoverAuthError if the credentials were rejected, else DeliveryError.
+    """
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        fields = None
+    if isinstance(fields, dict) and "invalid" in (
+        fields.get("token"),
+        fields.get("user"),
+    ):
+        return PushoverAuthError(status, body)
+    return DeliveryError(status, body)
+
+
+def retry_after_seconds(value):
+    """
+    Parses a Retry-After header.
+
+    :param value: Delay in seconds or an HTTP date.
+    :return: Seconds to wait, or None if the value can't be parsed.
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+class PushoverDispatcher:
+    """
+    Sends Pushover messages concurrently under a shared rate limit.
+
+    dispatch runs on the dispatcher's own event loop, so its connection pool
+    and token bucket outlive a single call.
+    """
+
+    def __init__(
+        self,
+        token,
+        user,
+        rate=float(os.environ.get("PUSHOVER_RATE", 2)),
+        burst=int(os.environ.get("PUSHOVER_BURST", 5)),
+        max_concurrency=4,
+        max_retries=3,
+        timeout=10,
+        url=PUSHOVER_URL,
+    ):
+        """
+        :param token: Pushover application token.
+        :param user: Pushover user key.
+        :param rate: Messages per second allowed by the limiter.
+        :param burst: Messages that may be sent back to back.
+        :param max_concurrency: Open connections (and in-flight requests) in the pool.
+        :param max_retries: Retries for 429, 5xx and connection errors.
+        :param timeout: Per-request timeout in seconds.
+        :param url: Messages endpoint, overridable for local fakes.
+        """
+        self.token = token
+        self.user = user
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.url = url
+        self.retries = 0
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="pushover", daemon=True
+                ).start()
+            return self._loop
+
+    def _client_session(self):
+        # Created on the dispatcher's loop and reused by every later call.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency, keepalive_timeout=30
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def send_all(self, messages):
+        """
+        Sends messages, lowest priority value first.
+
+        :param messages: Iterable of (priority, payload) tuples. Payloads hold the
+            Pushover fields other than token and user.
+        :return: List of (payload, status or exception) in input order.
+        """
+        queue = asyncio.PriorityQueue()
+        counter = itertools.count()
+        results = []
+        for priority, payload in messages:
+            index = next(counter)
+            results.append([payload, None])
+            queue.put_nowait((priority, index, payload))
+
+        session = self._client_session()
+
+        async def worker():
+            while not queue.empty():
+                _, index, payload = queue.get_nowait()
+                try:
+                    results[index][1] = await self._send(session, payload)
+                except Exception as error:
+                    logging.warning("Notification failed: %s", error)
+                    results[index][1] = error
+
+        workers = min(self.max_concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return [tuple(result) for result in results]
+
+    def dispatch(self, messages):
+        """Blocking wrapper around send_all for synchronous handlers."""
+        return asyncio.run_coroutine_threadsafe(
+            self.send_all(messages), self._event_loop()
+        ).result()
+
+    async def _send(self, session, payload):
+        data = dict(payload, token=self.token, user=self.user)
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire_async()
+            try:
+                async with session.post(self.url, data=data) as response:
+                    body = await response.text()
+                    if response.status < 400:
+                        return response.status
+                    if response.status not in RETRY_STATUS_CODES:
+                        raise delivery_error(response.status, body)
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after:
+                        delay = retry_after_seconds(retry_after)
+                        if delay is not None:
+                            self.bucket.penalize(delay)
+                    error = DeliveryError(response.status, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = exc
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(backoff_delay(attempt))
+        raise error
+
+
+@functools.lru_cache(maxsize=None)
+def shared_dispatcher(token, user, **kwargs):
+    """
+    Returns the process-wide dispatcher for a set of credentials, so every call
+    shares one rate limit and connection pool.
+    """
+    return PushoverDispatcher(token, user, **kwargs)
+
+
+def send_messages(secrets, messages, **kwargs):
+    """
+    Sends prioritised messages with the Pushover credentials in secrets.
+
+    :param secrets: Mapping holding PUSHOVER_APP and PUSHOVER_USER.
+    :param messages: Iterable of (priority, payload) tuples.
+    :param kwargs: PushoverDispatcher options.
+    :return: List of (payload, status or exception) in input order.
+    """
+    messages = list(messages)
+    dispatcher = shared_dispatcher(
+        secrets["PUSHOVER_APP"], secrets["PUSHOVER_USER"], **kwargs
+    )
+    retries = dispatcher.retries
+    with tracing.span("notify", messages=len(messages)) as span:
+        results = dispatcher.dispatch(messages)
+        span.set(
+            retries=dispatcher.retries - retries,
+            failed=sum(isinstance(status, Exception) for _, status in results),
+        )
+    return results
@@ -0,0 +1,160 @@
+"""
+This module writes summary pages to the Notion media database.
+
+All page creations go through one NotionWriter, which paces requests to
+Notion's rate limit (about 3 requests per second) and retries 429 and
+transient errors with jittered backoff, honouring Retry-After.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from notion_client import APIResponseError
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+import tracing
+from ratelimit import TokenBucket, backoff_delay
+
+RETRY_STATUS_CODES = (409, 429, 500, 502, 503, 504)
+
+
+def page_properties(summary_content):
+    """
+    Builds the Notion page properties for a parsed summary.
+
+    :param summary_content: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+    :return: Properties dict for pages.create.
+    """
+    return {
+        "Name": {"title": [{"text": {"content": summary_content["TITLE"]}}]},
+        "Key points": {
+            "rich_text": [{"text": {"content": summary_content["KEYPOINTS"]}}]
+        },
+        "Summary": {"rich_text": [{"text": {"content": summary_content["SUMMARY"]}}]},
+        "Tags": {"multi_select": [{"name": tag} for tag in summary_content["TAGS"]]},
+    }
+
+
+def ios_url(url):
+    """Rewrites a Notion web URL so it opens in the iOS app."""
+    return url.replace("https://www.notion.so/", "notion://notion.so/")
+
+
+def retry_after(error):
+    """
+    Returns the Retry-After delay of a Notion error, if it carries one.
+
+    :param error: Exception raised by notion_client.
+    :return: Seconds to wait, or None.
+    """
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error):
+    """Returns True for rate limiting, conflicts, timeouts and 5xx responses."""
+    if isinstance(error, RequestTimeoutError):
+        return True
+    if isinstance(error, (APIResponseError, HTTPResponseError)):
+        return error.status in RETRY_STATUS_CODES
+    return False
+
+
+class NotionWriter:
+    """
+    Creates Notion pages under a shared token bucket.
+    """
+
+    def __init__(
+        self,
+        notion_client,
+        database_id,
+        rate=float(os.environ.get("NOTION_RATE", 3)),
+        burst=3,
+        max_workers=3,
+        max_retries=5,
+        sleep=time.sleep,
+    ):
+        """
+        :param notion_client: A notion_client.Client.
+        :param database_id: ID of the database pages are created in.
+        :param rate: Requests per second allowed by the limiter.
+        :param burst: Requests that may be sent back to back.
+        :param max_workers: Page creations in flight at once for create_many.
+        :param max_retries: Retries per page before giving up.
+        :param sleep: Sleep function, replaceable in tests.
+        """
+        self.notion_client = notion_client
+        self.database_id = database_id
+        self.bucket = TokenBucket(rate, burst)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def create(self, summary_content, ios=False):
+        """
+        Creates one page, waiting for the rate limiter and retrying as needed.
+
+        :param summary_content: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+        :param ios: Return a notion:// URL that opens in the iOS app.
+        :return: URL of the created page.
+        """
+        properties = page_properties(summary_content)
+        with tracing.span("notion_write") as span:
+            for attempt in range(self.max_retries + 1):
+                span.set(retries=attempt)
+                self.bucket.acquire()
+                try:
+                    response = self.notion_client.pages.create(
+                        parent={"database_id": self.database_id},
+                        properties=properties,
+                    )
+                    break
+                except Exception as error:
+                    if not is_retryable(error) or attempt == self.max_retries:
+                        raise
+                    delay = retry_after(error)
+                    if delay is not None:
+                        self.bucket.penalize(delay)
+                        delay += random.uniform(0, 1)
+                    else:
+                        delay = backoff_delay(attempt)
+                    with self._lock:
+                        self.retries += 1
+                    logging.info(
+                        "Notion write failed (%s), retrying in %.1fs", error, delay
+                    )
+                    self.sleep(delay)
+
+        logging.info("Created Notion page: %s", summary_content["TITLE"])
+        return ios_url(response["url"]) if ios else response["url"]
+
+    def create_many(self, summaries, ios=False):
+        """
+        Creates a batch of pages concurrently, as fast as the rate limit allows.
+
+        A failed page doesn't abort the batch; its exception is returned in place.
+
+        :param summaries: Iterable of summary dicts.
+        :param ios: Return notion:// URLs that open in the iOS app.
+        :return: List of page URLs or exceptions, in input order.
+        """
+
+        def create_or_error(summary_content):
+            try:
+                return self.create(summary_content, ios=ios)
+            except Exception as error:
+                logging.warning("Notion write failed for good: %s", error)
+                return error
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(create_or_error, summaries))
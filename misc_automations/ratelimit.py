@@ -0,0 +1,133 @@
+"""
+This module provides the rate limiting primitives shared by the API clients
+(Pushover, Notion, Gemini).
+"""
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter usable from both threads and asyncio tasks.
+
+    Callers reserve tokens up front, so waiters are served in arrival order and
+    a burst never exceeds the bucket capacity.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum burst size; defaults to one second of tokens.
+        :param clock: Monotonic time source, in seconds.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket, going into debt if needed.
+
+        :param tokens: Number of tokens to take.
+        :return: Seconds the caller must wait before acting.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def penalize(self, seconds):
+        """Empties the bucket for the given number of seconds, e.g. after a 429."""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def acquire(self, tokens=1):
+        """Blocks the calling thread until tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        """Waits without blocking the event loop until tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """
+    Returns an exponential backoff delay with full jitter.
+
+    :param attempt: Zero-based retry attempt.
+    :param base: Delay of the first retry, in seconds.
+    :param cap: Upper bound on the delay, in seconds.
+    :return: Seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adapted with AIMD: it grows by about one slot per full
+    window of successful requests and is halved when the server throttles.
+
+    Only a request that started after the last decrease can decrease the limit
+    again, so one burst of 429s halves it once instead of collapsing it to the
+    minimum.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=None, decrease=0.5):
+        """
+        :param initial: Starting number of concurrent requests.
+        :param minimum: Lower bound on the limit.
+        :param maximum: Upper bound on the limit; defaults to 4x the initial.
+        :param decrease: Factor the limit is multiplied by on throttling.
+        """
+        self.minimum = minimum
+        self.maximum = maximum if maximum is not None else 4 * initial
+        self.decrease = decrease
+        self.limit = float(max(minimum, initial))
+        self.in_flight = 0
+        self._epoch = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until a slot is free.
+
+        :return: Ticket to pass to release.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return self._epoch
+
+    def release(self, ticket, throttled=False, success=True):
+        """
+        Frees a slot and adapts the limit to the request's outcome.
+
+        :param ticket: Value returned by acquire.
+        :param throttled: The server rejected the request for quota (429).
+        :param success: The request completed; other failures leave the limit as is.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                if ticket == self._epoch:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._epoch += 1
+            elif success:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
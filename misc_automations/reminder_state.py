@@ -0,0 +1,108 @@
+"""
+This module remembers which task reminders were already sent, so a task
+that stays late for a week isn't announced on every run.
+
+A reminder is identified by the task ID, the task's last_edited_time and the
+group it was sent under (e.g. "Late task"): editing a task or moving it to
+another group makes it due for a reminder again, anything else is
+suppressed until the dedupe window has passed. The store is a SQLite
+database in WAL mode, like the link index.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.environ.get("REMINDER_STATE_DB", "/tmp/reminder_state.sqlite3")
+# Slightly under a day, so a daily run that fires a little early still reminds.
+DEFAULT_WINDOW = float(os.environ.get("REMINDER_DEDUPE_SECONDS", 20 * 60 * 60))
+# Rows are kept at least this long after they stop mattering, then pruned.
+RETENTION = 7 * 24 * 60 * 60
+
+
+def reminder_key(group, task):
+    """Returns the (task_id, last_edited_time, group) a reminder is tracked by."""
+    return task["id"], task.get("last_edited_time") or "", group
+
+
+class ReminderState:
+    """
+    Persistent record of sent reminders.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, window=DEFAULT_WINDOW, clock=time.time):
+        """
+        :param path: SQLite database file.
+        :param window: Seconds during which a sent reminder is not repeated;
+            0 disables deduplication.
+        :param clock: Time source, in seconds since the epoch.
+        """
+        self.path = path
+        self.window = window
+        self.clock = clock
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS reminders ("
+                " task_id TEXT NOT NULL,"
+                " last_edited_time TEXT NOT NULL,"
+                " reminder_group TEXT NOT NULL,"
+                " sent_at REAL NOT NULL,"
+                " PRIMARY KEY (task_id, last_edited_time, reminder_group)"
+                ") WITHOUT ROWID"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def unsent(self, reminders):
+        """
+        Drops the reminders sent within the window.
+
+        :param reminders: Iterable of (group, task) pairs.
+        :return: List of the (group, task) pairs still to send, in input order.
+        """
+        reminders = list(reminders)
+        if not self.window:
+            return reminders
+        cutoff = self.clock() - self.window
+        connection = self._connection()
+        return [
+            (group, task)
+            for group, task in reminders
+            if connection.execute(
+                "SELECT 1 FROM reminders WHERE task_id = ? AND last_edited_time = ?"
+                " AND reminder_group = ? AND sent_at >= ?",
+                reminder_key(group, task) + (cutoff,),
+            ).fetchone()
+            is None
+        ]
+
+    def mark_sent(self, reminders):
+        """
+        Records reminders as sent now and prunes old rows.
+
+        :param reminders: Iterable of (group, task) pairs that were delivered.
+        """
+        now = self.clock()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO reminders VALUES (?, ?, ?, ?)",
+                (reminder_key(group, task) + (now,) for group, task in reminders),
+            )
+            connection.execute(
+                "DELETE FROM reminders WHERE sent_at < ?",
+                (now - max(self.window, RETENTION),),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
@@ -0,0 +1,165 @@
+"""
+This module routes link URLs to platform scrapers.
+
+Hosts are matched against a precompiled index of registered domains by
+walking their suffixes (so "m.youtube.com" matches "youtube.com" but
+"notx.com" doesn't match "x.com"), each platform has its own page ID
+extractor, and scraper instances are pooled so their sessions and auth
+survive across URLs.
+"""
+import queue
+import re
+import threading
+import urllib.parse
+from collections import namedtuple
+from contextlib import contextmanager
+
+PLATFORM_DOMAINS = {
+    "instagram.com": "Instagram",
+    "instagr.am": "Instagram",
+    "threads.net": "Threads",
+    "threads.com": "Threads",
+    "youtube.com": "YouTube",
+    "youtu.be": "YouTube",
+    "youtube-nocookie.com": "YouTube",
+    "x.com": "Twitter",
+    "twitter.com": "Twitter",
+}
+
+Route = namedtuple("Route", "platform page_id")
+
+YOUTUBE_PATH = re.compile(r"^/(?:shorts|embed|live|v|e)/([\w-]{6,})")
+INSTAGRAM_PATH = re.compile(r"^/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)")
+TWITTER_PATH = re.compile(r"^/(?:\w+|i/web)/status(?:es)?/(\d+)")
+THREADS_PATH = re.compile(r"^/@[\w.]+/post/([\w-]+)")
+
+
+def normalize_host(domain):
+    """Lower-cases a host and strips the port, trailing dot and "www." prefix."""
+    host = domain.lower().rsplit("@", 1)[-1].split(":", 1)[0].rstrip(".")
+    return host[4:] if host.startswith("www.") else host
+
+
+def platform_for_host(domain):
+    """
+    Returns the platform a host belongs to.
+
+    :param domain: Host name, e.g. "m.youtube.com".
+    :return: Platform name, or None for hosts without a scraper.
+    """
+    labels = normalize_host(domain).split(".")
+    for start in range(len(labels) - 1):
+        platform = PLATFORM_DOMAINS.get(".".join(labels[start:]))
+        if platform is not None:
+            return platform
+    return None
+
+
+def last_path_segment(path):
+    return path.strip("/").split("/")[-1]
+
+
+def youtube_id(host, path, query):
+    if normalize_host(host) == "youtu.be":
+        return last_path_segment(path) or None
+    match = YOUTUBE_PATH.match(path)
+    if match:
+        return match.group(1)
+    return urllib.parse.parse_qs(query).get("v", [None])[0]
+
+
+def _path_id(pattern):
+    def extract(host, path, query):
+        match = pattern.match(path)
+        return match.group(1) if match else last_path_segment(path)
+
+    return extract
+
+
+ID_EXTRACTORS = {
+    "YouTube": youtube_id,
+    "Instagram": _path_id(INSTAGRAM_PATH),
+    "Twitter": _path_id(TWITTER_PATH),
+    "Threads": _path_id(THREADS_PATH),
+}
+
+
+def extract_page_id(platform, host, path, query):
+    """
+    Extracts the platform's page ID from a URL's parts.
+
+    :param platform: Platform name or None.
+    :param host: Host of the URL.
+    :param path: Path of the URL.
+    :param query: Query string of the URL.
+    :return: Page ID (the last path segment for unknown platforms).
+    """
+    extractor = ID_EXTRACTORS.get(platform)
+    if extractor is None:
+        return last_path_segment(path)
+    return extractor(host, path, query)
+
+
+def route(url):
+    """
+    Routes a URL to its platform and page ID.
+
+    :param url: The URL to route.
+    :return: Route(platform, page_id); platform is None for generic pages.
+    """
+    parsed = urllib.parse.urlparse(url)
+    platform = platform_for_host(parsed.netloc)
+    page_id = extract_page_id(platform, parsed.netloc, parsed.path, parsed.query)
+    return Route(platform, page_id)
+
+
+class ScraperPool:
+    """
+    Keeps long-lived scraper instances per platform and lends them to threads.
+    """
+
+    def __init__(self, factories, size=4):
+        """
+        :param factories: Dict mapping platform name to a scraper class or factory.
+        :param size: Maximum instances per platform.
+        """
+        self.factories = factories
+        self.size = size
+        self._idle = {platform: queue.LifoQueue() for platform in factories}
+        self._created = dict.fromkeys(factories, 0)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, platform):
+        """
+        Lends a scraper for the platform, creating one if the pool isn't full.
+
+        :param platform: Platform name.
+        :return: Context manager yielding a scraper instance.
+        """
+        idle = self._idle[platform]
+        try:
+            scraper = idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created[platform] < self.size
+                if create:
+                    self._created[platform] += 1
+            if create:
+                try:
+                    scraper = self.factories[platform]()
+                except Exception:
+                    with self._lock:
+                        self._created[platform] -= 1
+                    raise
+            else:
+                scraper = idle.get()
+        try:
+            yield scraper
+        finally:
+            idle.put(scraper)
+
+    def get_data(self, platform, page_id):
+        """Scrapes page_id with a pooled scraper for the platform."""
+        with self.lease(platform) as scraper:
+            return scraper.get_data(page_id)
@@ -0,0 +1,298 @@
+"""
+This module caches secrets read from AWS Secrets Manager so that warm
+invocations don't wait on a remote call before doing any work.
+
+Secrets are kept in process for a configurable TTL and, when a key is
+configured, in an encrypted file on disk so a fresh worker can skip the
+round trip too. A downstream auth failure forces a refresh.
+"""
+# pipedream add-package boto3
+# pipedream add-package cryptography
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+import boto3
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # The disk tier is optional.
+    Fernet = None
+    InvalidToken = Exception
+
+DEFAULT_TTL = float(os.environ.get("SECRETS_CACHE_TTL", 300))
+AUTH_STATUS_CODES = (401, 403)
+AUTH_ERROR_CODES = (
+    "unauthorized",
+    "UnrecognizedClientException",
+    "InvalidClientTokenId",
+    "ExpiredToken",
+    "ExpiredTokenException",
+    "AccessDenied",
+    "AccessDeniedException",
+)
+
+
+def secrets_manager_client(region_name, aws_access_key_id=None, aws_secret_access_key=None):
+    """
+    Creates a Secrets Manager client.
+
+    Setting SECRETS_MANAGER_ENDPOINT points the client at a local stand-in
+    (e.g. moto or localstack) instead of AWS.
+
+    :param region_name: AWS region the secret lives in.
+    :param aws_access_key_id: Optional explicit access key.
+    :param aws_secret_access_key: Optional explicit secret key.
+    :return: A boto3 Secrets Manager client.
+    """
+    session = boto3.session.Session(aws_access_key_id, aws_secret_access_key)
+    return session.client(
+        service_name="secretsmanager",
+        region_name=region_name,
+        endpoint_url=os.environ.get("SECRETS_MANAGER_ENDPOINT") or None,
+    )
+
+
+class LocalSecretsManager:
+    """
+    Minimal stand-in for a Secrets Manager client backed by a dict or JSON file.
+
+    It implements the one call the cache makes, so handlers can run offline.
+    """
+
+    def __init__(self, secrets=None, path=None):
+        if path is not None:
+            with open(path) as infile:
+                secrets = json.load(infile)
+        self.secrets = dict(secrets or {})
+        self.versions = {name: 1 for name in self.secrets}
+        self.calls = 0
+
+    def put_secret_value(self, SecretId, SecretString):
+        self.secrets[SecretId] = json.loads(SecretString)
+        self.versions[SecretId] = self.versions.get(SecretId, 0) + 1
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        if SecretId not in self.secrets:
+            raise KeyError("Secret %s not found" % SecretId)
+        return {
+            "Name": SecretId,
+            "SecretString": json.dumps(self.secrets[SecretId]),
+            "VersionId": "v%d" % self.versions[SecretId],
+        }
+
+
+def is_auth_error(error):
+    """
+    Guesses whether an exception raised by a downstream client is an auth failure.
+
+    Understands HTTP status codes (requests, notion_client, google), botocore
+    error codes, and errors flagged with a true auth_failed attribute (e.g.
+    notifications.PushoverAuthError, which arrives as HTTP 400).
+
+    :param error: The exception to inspect.
+    :return: True if the error looks like rejected or expired credentials.
+    """
+    if getattr(error, "auth_failed", False):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None) or getattr(
+            response, "status", None
+        )
+    if status in AUTH_STATUS_CODES or status in AUTH_ERROR_CODES:
+        return True
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        return code in AUTH_ERROR_CODES
+    return False
+
+
+class SecretsCache(Mapping):
+    """
+    In-process secrets cache with a TTL and an optional encrypted disk tier.
+
+    The cache is a read-only mapping, so it can be used wherever the plain
+    secrets dict was used before; every lookup goes through the TTL check.
+    """
+
+    def __init__(
+        self,
+        secret_name,
+        client_factory,
+        ttl=DEFAULT_TTL,
+        disk_path=None,
+        encryption_key=None,
+        clock=time.time,
+    ):
+        """
+        :param secret_name: Name of the secret in Secrets Manager.
+        :param client_factory: Callable returning a client with get_secret_value.
+        :param ttl: Seconds a fetched secret stays fresh.
+        :param disk_path: Path of the encrypted on-disk tier, or None to disable it.
+        :param encryption_key: Fernet key for the disk tier; without one the tier is off.
+        :param clock: Time source, in seconds.
+        """
+        self.secret_name = secret_name
+        self.client_factory = client_factory
+        self.ttl = ttl
+        self.clock = clock
+        self.version_id = None
+        self.fetches = 0
+        self._secret = None
+        self._expires_at = 0.0
+        self._client = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._fernet = None
+        self.disk_path = None
+        if disk_path and encryption_key:
+            if Fernet is None:
+                logging.warning("cryptography is not installed; disk secrets cache disabled")
+            else:
+                self._fernet = Fernet(encryption_key)
+                self.disk_path = disk_path
+
+    def get(self, key=None, default=None, force_refresh=False):
+        """
+        Returns the secrets dict (or one value from it), fetching it if stale.
+
+        :param key: Optional key to look up in the secret.
+        :param default: Value returned when key is missing.
+        :param force_refresh: Skip both cache tiers and read from Secrets Manager.
+        :return: The secrets dict, or the value stored under key.
+        """
+        secret = self._current(force_refresh)
+        if key is None:
+            return secret
+        return secret.get(key, default)
+
+    def refresh(self):
+        """Forces a fetch from Secrets Manager and returns the new secrets."""
+        return self._current(force_refresh=True)
+
+    def invalidate(self):
+        """Drops the in-process copy and the disk tier."""
+        with self._lock:
+            self._secret = None
+            self._expires_at = 0.0
+            if self.disk_path and os.path.exists(self.disk_path):
+                os.remove(self.disk_path)
+
+    def on_rotation(self, callback):
+        """
+        Registers a callback run whenever a fetch returns a new secret version,
+        or an auth error forced a refresh, e.g. to rebuild clients made from it.
+
+        :param callback: Callable taking the new secrets dict.
+        """
+        self._listeners.append(callback)
+
+    def call_with_refresh(self, func, *args, **kwargs):
+        """
+        Calls func and retries it once with refreshed secrets after an auth error.
+
+        The rotation callbacks run after the refresh even if the version didn't
+        change, so clients holding the rejected credentials are rebuilt.
+
+        :param func: Callable that reads secrets (or clients built from them)
+            when it is called, so the retry sees the refreshed values.
+        :return: Whatever func returns.
+        """
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if not is_auth_error(error):
+                raise
+            logging.info("Auth error from downstream call, refreshing %s", self.secret_name)
+            self._current(force_refresh=True, notify=True)
+            return func(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+    def _current(self, force_refresh=False, notify=False):
+        with self._lock:
+            now = self.clock()
+            if not force_refresh and self._secret is not None and now < self._expires_at:
+                return self._secret
+            if not force_refresh:
+                cached = self._read_disk(now)
+                if cached is not None:
+                    return cached
+            secret, version_id = self._fetch()
+            rotated = self.version_id is not None and version_id != self.version_id
+            self._store(secret, version_id, now)
+        if rotated or notify:
+            for callback in self._listeners:
+                callback(secret)
+        return secret
+
+    def _fetch(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        response = self._client.get_secret_value(SecretId=self.secret_name)
+        self.fetches += 1
+        return json.loads(response["SecretString"]), response.get("VersionId")
+
+    def _store(self, secret, version_id, fetched_at):
+        self._secret = secret
+        self.version_id = version_id
+        self._expires_at = fetched_at + self.ttl
+        if self._fernet is None:
+            return
+        payload = json.dumps(
+            {"fetched_at": fetched_at, "version_id": version_id, "secret": secret}
+        ).encode()
+        tmp_path = self.disk_path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(self._fernet.encrypt(payload))
+        os.replace(tmp_path, self.disk_path)
+
+    def _read_disk(self, now):
+        if self._fernet is None or not os.path.exists(self.disk_path):
+            return None
+        try:
+            with open(self.disk_path, "rb") as infile:
+                payload = json.loads(self._fernet.decrypt(infile.read()))
+        except (OSError, ValueError, InvalidToken):
+            logging.warning("Ignoring unreadable secrets cache at %s", self.disk_path)
+            return None
+        if now >= payload["fetched_at"] + self.ttl:
+            return None
+        self._secret = payload["secret"]
+        self.version_id = payload["version_id"]
+        self._expires_at = payload["fetched_at"] + self.ttl
+        return self._secret
+
+
+def from_environment(secret_name, region_name, **client_kwargs):
+    """
+    Builds a SecretsCache configured from environment variables.
+
+    SECRETS_CACHE_TTL sets the TTL, SECRETS_CACHE_PATH and SECRETS_CACHE_KEY
+    enable the encrypted disk tier.
+
+    :param secret_name: Name of the secret in Secrets Manager.
+    :param region_name: AWS region the secret lives in.
+    :return: A SecretsCache instance.
+    """
+    return SecretsCache(
+        secret_name,
+        lambda: secrets_manager_client(region_name, **client_kwargs),
+        ttl=float(os.environ.get("SECRETS_CACHE_TTL", DEFAULT_TTL)),
+        disk_path=os.environ.get("SECRETS_CACHE_PATH"),
+        encryption_key=os.environ.get("SECRETS_CACHE_KEY"),
+    )
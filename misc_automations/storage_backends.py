@@ -0,0 +1,259 @@
+"""
+This module provides the object storage backends used by the video pipeline.
+
+Every backend uploads a local file under a key, verifies the stored checksum
+and can tell whether a key already holds the same bytes. Large files are
+split into parts uploaded in parallel (GCS compose / S3 multipart).
+"""
+# pipedream add-package boto3
+# pipedream add-package google-cloud-storage
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import video_cache
+
+DEFAULT_PART_SIZE = int(os.environ.get("STORAGE_PART_SIZE", 32 * 1024 * 1024))
+DEFAULT_WORKERS = int(os.environ.get("STORAGE_WORKERS", 8))
+# GCS compose accepts at most 32 source objects per call.
+MAX_COMPOSE_SOURCES = 32
+
+
+class ChecksumMismatch(Exception):
+    """Raised when an uploaded object doesn't match the local file."""
+
+
+def part_ranges(size, part_size):
+    """Returns (offset, length) pairs covering a file of the given size."""
+    return [
+        (offset, min(part_size, size - offset)) for offset in range(0, size, part_size)
+    ]
+
+
+class StorageBackend:
+    """
+    Base class for object storage backends.
+    """
+
+    def uri(self, key):
+        """Returns the URI other services use to address key."""
+        raise NotImplementedError
+
+    def matches(self, key, path):
+        """Returns True if key already holds exactly the bytes of path."""
+        raise NotImplementedError
+
+    def _upload(self, path, key, content_type):
+        raise NotImplementedError
+
+    def upload_file(self, path, key, content_type="video/mp4", skip_if_present=True):
+        """
+        Uploads a local file under key and verifies its checksum.
+
+        :param path: Path of the local file.
+        :param key: Object key / blob name.
+        :param content_type: MIME type stored with the object.
+        :param skip_if_present: Don't upload if key already holds the same bytes.
+        :return: URI of the stored object.
+        :raises ChecksumMismatch: If the stored object doesn't match the file.
+        """
+        if skip_if_present and self.matches(key, path):
+            logging.info("%s already up to date, skipping upload", self.uri(key))
+            return self.uri(key)
+        self._upload(path, key, content_type)
+        if not self.matches(key, path):
+            raise ChecksumMismatch("Checksum mismatch after uploading %s" % self.uri(key))
+        return self.uri(key)
+
+
+class GCSBackend(StorageBackend):
+    """
+    Google Cloud Storage backend using parallel part uploads and compose.
+
+    Without google-crc32c, files are uploaded in a single stream instead.
+    """
+
+    def __init__(
+        self,
+        storage_client,
+        bucket_name,
+        part_size=DEFAULT_PART_SIZE,
+        workers=DEFAULT_WORKERS,
+    ):
+        self.bucket = storage_client.bucket(bucket_name)
+        self.part_size = part_size
+        self.workers = workers
+
+    def uri(self, key):
+        return "gs://%s/%s" % (self.bucket.name, key)
+
+    def matches(self, key, path):
+        return video_cache.blob_matches(self.bucket.blob(key), path)
+
+    def _upload(self, path, key, content_type):
+        size = os.path.getsize(path)
+        # A composed object has no MD5, so only CRC32C can verify it.
+        if size <= self.part_size or video_cache.google_crc32c is None:
+            self.bucket.blob(key).upload_from_filename(path, content_type=content_type)
+            return
+
+        def upload_part(item):
+            index, (offset, length) = item
+            part = self.bucket.blob("%s.parts/%05d" % (key, index))
+            with open(path, "rb") as infile:
+                infile.seek(offset)
+                part.upload_from_file(infile, size=length)
+            return part
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            parts = list(
+                executor.map(upload_part, enumerate(part_ranges(size, self.part_size)))
+            )
+        try:
+            self._compose(parts, key, content_type)
+        finally:
+            for part in parts:
+                part.delete()
+
+    def _compose(self, parts, key, content_type):
+        intermediates = []
+        level = 0
+        try:
+            while len(parts) > MAX_COMPOSE_SOURCES:
+                grouped = []
+                for start in range(0, len(parts), MAX_COMPOSE_SOURCES):
+                    target = self.bucket.blob(
+                        "%s.parts/compose-%d-%05d" % (key, level, start)
+                    )
+                    target.compose(parts[start : start + MAX_COMPOSE_SOURCES])
+                    grouped.append(target)
+                intermediates.extend(grouped)
+                parts = grouped
+                level += 1
+            target = self.bucket.blob(key)
+            target.content_type = content_type
+            target.compose(parts)
+        finally:
+            for blob in intermediates:
+                blob.delete()
+
+
+def s3_multipart_etag(path, part_size, threshold):
+    """
+    Computes the ETag S3 assigns to an upload done with the given part size.
+
+    :param path: Path of the local file.
+    :param part_size: Multipart chunk size.
+    :param threshold: Size at which the upload switches to multipart.
+    :return: ETag string without quotes.
+    """
+    size = os.path.getsize(path)
+    digests = []
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(part_size), b""):
+            digests.append(hashlib.md5(chunk).digest())
+    if size < threshold:
+        return digests[0].hex() if digests else hashlib.md5(b"").hexdigest()
+    return "%s-%d" % (hashlib.md5(b"".join(digests)).hexdigest(), len(digests))
+
+
+class S3Backend(StorageBackend):
+    """
+    Amazon S3 backend using boto3's managed parallel multipart upload.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        part_size=DEFAULT_PART_SIZE,
+        workers=DEFAULT_WORKERS,
+    ):
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = s3_client
+        self.bucket_name = bucket_name
+        self.part_size = part_size
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=workers,
+        )
+
+    def uri(self, key):
+        return "s3://%s/%s" % (self.bucket_name, key)
+
+    def matches(self, key, path):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        if head["ContentLength"] != os.path.getsize(path):
+            return False
+        expected = s3_multipart_etag(path, self.part_size, self.part_size)
+        return head["ETag"].strip('"') == expected
+
+    def _upload(self, path, key, content_type):
+        self.client.upload_file(
+            path,
+            self.bucket_name,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config,
+        )
+
+
+class LocalBackend(StorageBackend):
+    """
+    Filesystem backend for running the pipeline offline.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def uri(self, key):
+        return "file://" + os.path.abspath(self._path(key))
+
+    def matches(self, key, path):
+        target = self._path(key)
+        if not os.path.exists(target) or os.path.getsize(target) != os.path.getsize(
+            path
+        ):
+            return False
+        return video_cache.file_sha256(target) == video_cache.file_sha256(path)
+
+    def _upload(self, path, key, content_type):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target + ".tmp")
+        os.replace(target + ".tmp", target)
+
+
+def backend_from_env(gcs_client=None, s3_client=None):
+    """
+    Builds the backend named by STORAGE_BACKEND ("gcs", "s3" or "local").
+
+    GCS and S3 use the GOOGLE_BLOB / S3_BUCKET bucket, the local backend
+    writes under STORAGE_LOCAL_ROOT.
+
+    :param gcs_client: google.cloud.storage Client, required for "gcs".
+    :param s3_client: boto3 S3 client, required for "s3".
+    :return: A StorageBackend.
+    """
+    name = os.environ.get("STORAGE_BACKEND", "gcs")
+    if name == "gcs":
+        return GCSBackend(gcs_client, os.environ["GOOGLE_BLOB"])
+    if name == "s3":
+        return S3Backend(s3_client, os.environ["S3_BUCKET"])
+    if name == "local":
+        return LocalBackend(os.environ.get("STORAGE_LOCAL_ROOT", "/tmp/storage"))
+    raise ValueError("Unknown STORAGE_BACKEND %r" % name)
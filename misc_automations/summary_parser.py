@@ -0,0 +1,157 @@
+"""
+This module parses the TITLE/KEYPOINTS/SUMMARY/TAGS response format in a
+single pass, as the model streams it.
+
+Chunks are fed as they arrive and each field is emitted as soon as its
+closing tag is seen, so downstream stages can start before generation
+finishes. Missing, unclosed or mismatched tags are tolerated.
+"""
+import re
+
+FIELDS = ("TITLE", "KEYPOINTS", "SUMMARY", "TAGS")
+TAG_PATTERN = re.compile(r"<(/?)(%s)>" % "|".join(FIELDS), re.IGNORECASE)
+# Longest possible tag, "</KEYPOINTS>"; a partial tag at the end of a chunk is shorter.
+MAX_TAG_LENGTH = max(len(field) for field in FIELDS) + 3
+# Notion rejects rich text longer than this, which merged summaries can reach.
+MAX_TEXT_LENGTH = 2000
+
+
+def empty_summary():
+    """Returns the parsed summary shape with every field unset."""
+    return {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+
+
+def split_tags(value):
+    """Splits the comma separated TAGS field into a list."""
+    return [x.strip() for x in value.strip().split(",")]
+
+
+class SummaryStreamParser:
+    """
+    Incremental parser for the tagged summary format.
+    """
+
+    def __init__(self, on_field=None):
+        """
+        :param on_field: Optional callback called with (field, value) as soon as a
+            field is complete.
+        """
+        self.on_field = on_field
+        self.result = empty_summary()
+        self._field = None
+        self._parts = []
+        self._pending = ""
+        self._done = set()
+
+    def feed(self, chunk):
+        """
+        Consumes the next chunk of model output.
+
+        :param chunk: Text chunk.
+        :return: List of (field, value) pairs completed by this chunk.
+        """
+        if not self._pending and "<" not in chunk:
+            # Most chunks are plain text inside a field.
+            self._parts.append(chunk)
+            return []
+        text = self._pending + chunk
+        completed = []
+        position = 0
+        for match in TAG_PATTERN.finditer(text):
+            self._parts.append(text[position : match.start()])
+            position = match.end()
+            completed.extend(self._on_tag(match.group(1) == "/", match.group(2).upper()))
+
+        # Hold back a trailing "<..." that may be the start of a tag split across chunks.
+        tail = text[position:]
+        cut = tail.rfind("<", max(0, len(tail) - MAX_TAG_LENGTH + 1))
+        if cut == -1:
+            self._parts.append(tail)
+            self._pending = ""
+        else:
+            self._parts.append(tail[:cut])
+            self._pending = tail[cut:]
+        return completed
+
+    def close(self):
+        """
+        Finishes parsing; an unclosed field keeps the text collected so far.
+
+        :return: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+        """
+        self._parts.append(self._pending)
+        self._pending = ""
+        if self._field is not None:
+            self._finish(self._field, "".join(self._parts))
+            self._field = None
+        self._parts = []
+        return self.result
+
+    def _on_tag(self, closing, field):
+        text = "".join(self._parts)
+        self._parts = []
+        if not closing:
+            # A new opening tag implicitly closes a field that was never closed.
+            completed = []
+            if self._field is not None:
+                completed = self._finish(self._field, text)
+            self._field = field
+            return completed
+        if self._field is None:
+            # Closing tag without an opening one: take the text since the last tag.
+            return self._finish(field, text)
+        current, self._field = self._field, None
+        return self._finish(current, text)
+
+    def _finish(self, field, text):
+        if field in self._done:
+            return []
+        self._done.add(field)
+        value = split_tags(text) if field == "TAGS" else text.strip()
+        self.result[field] = value
+        if self.on_field is not None:
+            self.on_field(field, value)
+        return [(field, value)]
+
+
+def parse_chunks(chunks, on_field=None):
+    """
+    Parses an iterable of text chunks, e.g. a streamed model response.
+
+    :param chunks: Iterable of strings.
+    :param on_field: Optional callback called with (field, value) per completed field.
+    :return: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+    """
+    parser = SummaryStreamParser(on_field)
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_summary(input_string):
+    """Parses a complete response string."""
+    return parse_chunks([input_string])
+
+
+def merge_summaries(summaries):
+    """
+    Merges the parsed summaries of consecutive segments into one.
+
+    The title comes from the first segment with one, key points and summaries
+    are concatenated in order (capped at MAX_TEXT_LENGTH), and tags are
+    de-duplicated.
+
+    :param summaries: Parsed summaries, in playback order.
+    :return: Dict with TITLE, KEYPOINTS, SUMMARY and TAGS.
+    """
+    merged = empty_summary()
+    merged["TITLE"] = next((s["TITLE"] for s in summaries if s["TITLE"]), "")
+    keypoints = "\n".join(s["KEYPOINTS"] for s in summaries if s["KEYPOINTS"])
+    merged["KEYPOINTS"] = keypoints[:MAX_TEXT_LENGTH]
+    summary = " ".join(s["SUMMARY"] for s in summaries if s["SUMMARY"])
+    merged["SUMMARY"] = summary[:MAX_TEXT_LENGTH]
+    for summary in summaries:
+        for tag in summary["TAGS"]:
+            if tag and tag not in merged["TAGS"]:
+                merged["TAGS"].append(tag)
+    return merged
@@ -1,67 +1,482 @@
 # pipedream add-package boto3
-import http.client
+# pipedream add-package aiohttp
+# pipedream add-package notion-client
+import datetime
+import html
 import json
+import logging
 import os
-import urllib
-import boto3
+import tempfile
 import time
-import urlparse
+
+from notion_client import Client
+
+import notifications
+import reminder_state
+import secrets_cache
+import tracing
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9: dates are taken in UTC.
+    ZoneInfo = None
+
+TASKS_DATABASE_ID = os.environ.get("NOTION_TASKS_DB")
+TASK_SNAPSHOT_PATH = os.environ.get("TASK_SNAPSHOT_PATH", "/tmp/notion_tasks.json")
+TITLE_PROPERTY = "Task name"
+DUE_PROPERTY = os.environ.get("TASK_DUE_PROPERTY", "Due")
+DONE_PROPERTY = os.environ.get("TASK_DONE_PROPERTY", "Done")
+# Status names that count as done when the done property is a status or select.
+DONE_STATUSES = ("Done", "Complete", "Completed")
+UPCOMING_DAYS = int(os.environ.get("TASK_UPCOMING_DAYS", 3))
+TASK_TIMEZONE = os.environ.get("TASK_TIMEZONE", "UTC")
+# Deleted or archived tasks never show up in a delta query; a periodic full
+# sync drops them from the snapshot.
+FULL_SYNC_SECONDS = float(os.environ.get("TASK_FULL_SYNC_SECONDS", 86400))
+PAGE_SIZE = 100
+SNAPSHOT_VERSION = 1
+# "digest" packs every reminder of a run into as few messages as fit.
+REMINDER_MODE = os.environ.get("REMINDER_MODE", "each")
 
 
 class SecretsManager:
+    cache = None
+
+    @staticmethod
+    def get_secrets(force_refresh=False):
+        if SecretsManager.cache is None:
+            SecretsManager.cache = secrets_cache.from_environment(
+                os.environ.get("NOTION_GPT_SECRET_NAME", "notionGPT"),
+                os.environ.get("AWS_REGION", "us-east-1"),
+            )
+        with tracing.span("secrets"):
+            return SecretsManager.cache.get(force_refresh=force_refresh)
+
     @staticmethod
-    def get_secrets():
-        secret_name = os.environ.get("NOTION_GPT_SECRET_NAME", "notionGPT")
-        region_name = os.environ.get("AWS_REGION", "us-east-1")
+    def call_with_refresh(func):
+        """Calls func, and once more with refreshed secrets after an auth error."""
+        SecretsManager.get_secrets()
+        return SecretsManager.cache.call_with_refresh(func)
+
+
+def _compact(page):
+    # Only what bucketing and the notification payload read is kept in the snapshot.
+    properties = page.get("properties", {})
+    return {
+        "id": page["id"],
+        "url": page["url"],
+        "last_edited_time": page["last_edited_time"],
+        "properties": {
+            name: properties[name]
+            for name in (TITLE_PROPERTY, DUE_PROPERTY, DONE_PROPERTY)
+            if name in properties
+        },
+    }
+
+
+def due_date(task):
+    """Returns the task's due date as YYYY-MM-DD, or None without one."""
+    due = task["properties"].get(DUE_PROPERTY) or {}
+    start = (due.get("date") or {}).get("start")
+    return start[:10] if start else None
+
+
+def is_done(task):
+    """True if the task's done checkbox is ticked or its status is a done status."""
+    done = task["properties"].get(DONE_PROPERTY) or {}
+    kind = done.get("type")
+    if kind == "checkbox":
+        return bool(done["checkbox"])
+    if kind in ("status", "select"):
+        return (done.get(kind) or {}).get("name") in DONE_STATUSES
+    return False
+
+
+def bucket_tasks(tasks, today, upcoming_days=UPCOMING_DAYS):
+    """
+    Sorts open tasks into late, today and upcoming by due date.
+
+    :param tasks: Iterable of task pages.
+    :param today: Today's date as YYYY-MM-DD.
+    :param upcoming_days: How many days ahead count as upcoming.
+    :return: Dict with "late", "today" and "upcoming" lists, each by due date.
+    """
+    horizon = (
+        datetime.date.fromisoformat(today) + datetime.timedelta(days=upcoming_days)
+    ).isoformat()
+    buckets = {"late": [], "today": [], "upcoming": []}
+    for task in tasks:
+        due = due_date(task)
+        if due is None or is_done(task):
+            continue
+        if due < today:
+            buckets["late"].append(task)
+        elif due == today:
+            buckets["today"].append(task)
+        elif due <= horizon:
+            buckets["upcoming"].append(task)
+    for bucket in buckets.values():
+        bucket.sort(key=lambda task: (due_date(task), task["id"]))
+    return buckets
+
+
+class TaskSource:
+    """
+    Reads the task database with one paginated query per run.
+
+    The first run (and one every FULL_SYNC_SECONDS) fetches every task with a
+    due date; later runs fetch only tasks edited since the newest
+    last_edited_time seen and merge them into a local snapshot.
+    """
+
+    def __init__(
+        self,
+        client,
+        database_id,
+        snapshot_path=TASK_SNAPSHOT_PATH,
+        full_sync_seconds=FULL_SYNC_SECONDS,
+        clock=time.time,
+    ):
+        """
+        :param client: notion_client.Client.
+        :param database_id: ID of the task database.
+        :param snapshot_path: JSON file the snapshot and cursor are kept in.
+        :param full_sync_seconds: Max age of the last full sync.
+        :param clock: Returns the current time in seconds.
+        """
+        self.client = client
+        self.database_id = database_id
+        self.snapshot_path = snapshot_path
+        self.full_sync_seconds = full_sync_seconds
+        self.clock = clock
+        self._data_source_id = None
+
+    def load_snapshot(self):
+        """Returns the stored snapshot, or None if missing, corrupt or stale."""
+        try:
+            with open(self.snapshot_path) as infile:
+                snapshot = json.load(infile)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning("Ignoring corrupt task snapshot %s", self.snapshot_path)
+            return None
+        if (
+            snapshot.get("version") != SNAPSHOT_VERSION
+            or snapshot.get("database_id") != self.database_id
+            or self.clock() - snapshot.get("full_sync_at", 0) > self.full_sync_seconds
+        ):
+            return None
+        return snapshot
+
+    def store_snapshot(self, snapshot):
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # A unique temp file, so concurrent runs never write the same one.
+        fd, work_path = tempfile.mkstemp(
+            dir=directory or ".", prefix=".notion_tasks-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                json.dump(snapshot, outfile)
+            os.replace(work_path, self.snapshot_path)
+        except BaseException:
+            os.remove(work_path)
+            raise
+
+    def data_source_id(self):
+        """
+        Returns the ID of the task database's (first) data source.
+
+        Notion API 2025-09-03 (notion-client 2.5+) queries data sources instead
+        of databases; the ID is looked up once per TaskSource.
+        """
+        if self._data_source_id is None:
+            database = self.client.databases.retrieve(database_id=self.database_id)
+            sources = database.get("data_sources") or []
+            if not sources:
+                raise ValueError("Database %s has no data source" % self.database_id)
+            if len(sources) > 1:
+                logging.warning(
+                    "Database %s has %s data sources, reading %s",
+                    self.database_id,
+                    len(sources),
+                    sources[0].get("name") or sources[0]["id"],
+                )
+            self._data_source_id = sources[0]["id"]
+        return self._data_source_id
+
+    def _query_page(self, **kwargs):
+        # notion-client 3 dropped databases.query; older clients lack data_sources.
+        if hasattr(self.client, "data_sources"):
+            return self.client.data_sources.query(self.data_source_id(), **kwargs)
+        return self.client.databases.query(self.database_id, **kwargs)
+
+    def query(self, query_filter):
+        """
+        Streams the pages matching query_filter, oldest edit first.
+
+        :param query_filter: Notion filter object.
+        :return: Generator of pages.
+        """
+        cursor = None
+        while True:
+            kwargs = {
+                "filter": query_filter,
+                "sorts": [{"timestamp": "last_edited_time", "direction": "ascending"}],
+                "page_size": PAGE_SIZE,
+            }
+            if cursor:
+                kwargs["start_cursor"] = cursor
+            response = self._query_page(**kwargs)
+            yield from response["results"]
+            if not response.get("has_more"):
+                return
+            cursor = response["next_cursor"]
+
+    def sync(self):
+        """
+        Brings the snapshot up to date.
+
+        :return: List of every open task with a due date.
+        """
+        snapshot = self.load_snapshot()
+        if snapshot is None:
+            snapshot = {
+                "version": SNAPSHOT_VERSION,
+                "database_id": self.database_id,
+                "full_sync_at": self.clock(),
+                "cursor": None,
+                "tasks": {},
+            }
+            query_filter = {"property": DUE_PROPERTY, "date": {"is_not_empty": True}}
+        else:
+            # Not filtered on the due date: a task that lost it must leave the snapshot.
+            query_filter = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": snapshot["cursor"]},
+            }
 
-        session = boto3.session.Session()
-        client = session.client(service_name="secretsmanager", region_name=region_name)
-        get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-        return json.loads(get_secret_value_response["SecretString"])
+        tasks = snapshot["tasks"]
+        with tracing.span("tasks_query", full=snapshot["cursor"] is None) as span:
+            changed = 0
+            for page in self.query(query_filter):
+                changed += 1
+                task = _compact(page)
+                if due_date(task) is None or is_done(task):
+                    tasks.pop(task["id"], None)
+                else:
+                    tasks[task["id"]] = task
+                edited = task["last_edited_time"]
+                if snapshot["cursor"] is None or edited > snapshot["cursor"]:
+                    snapshot["cursor"] = edited
+            span.set(changed=changed, tasks=len(tasks))
+        self.store_snapshot(snapshot)
+        return list(tasks.values())
+
+
+def today_in(timezone=TASK_TIMEZONE):
+    """Returns today's date in timezone as YYYY-MM-DD."""
+    tz = ZoneInfo(timezone) if ZoneInfo is not None else datetime.timezone.utc
+    return datetime.datetime.now(tz).date().isoformat()
+
+
+class NotionManager:
+    client = None
+    token = None
+
+    @staticmethod
+    def get_client(secrets):
+        # Rebuilt when the token changes, e.g. after a refresh on an auth error.
+        if NotionManager.client is None or NotionManager.token != secrets["NOTION"]:
+            NotionManager.client = Client(auth=secrets["NOTION"])
+            NotionManager.token = secrets["NOTION"]
+        return NotionManager.client
+
+
+def task_name(note_json):
+    return note_json["properties"][TITLE_PROPERTY]["title"][0]["plain_text"]
+
+
+def task_url(note_json):
+    # Opens the Notion app instead of the browser.
+    return note_json["url"].replace("https://www.notion.so/", "notion://notion.so/")
+
+
+def _truncate_escaped(text, length):
+    # Cut before escaping, so an entity like &amp; is never split.
+    escaped = html.escape(text)
+    while len(escaped) > length and text:
+        text = text[: len(text) - max(1, len(escaped) - length)]
+        escaped = html.escape(text) + "…"
+    return escaped
 
 
 class NotificationSender:
     @staticmethod
-    def send_notification(title, note_json, secrets):
-        conn = http.client.HTTPSConnection("api.pushover.net", 443)
-        message = note_json["properties"]["Task name"]["title"][0]["plain_text"]
-        url = note_json["url"].replace("https://www.notion.so/", "notion://notion.so/")
-        payload = {
-            "token": secrets["PUSHOVER_APP"],
-            "user": secrets["PUSHOVER_USER"],
+    def build_payload(title, note_json):
+        return {
             "title": title,
-            "message": message,
-            "url": url,
+            "message": task_name(note_json),
+            "url": task_url(note_json),
             "url_title": "Open Notion",
         }
-        headers = {"Content-type": "application/x-www-form-urlencoded"}
-        conn.request("POST", "/1/messages.json", urlparse.urlencode(payload), headers)
-        conn.getresponse()
-        return 200
 
+    @staticmethod
+    def build_digests(reminders, max_length=notifications.MAX_MESSAGE_LENGTH):
+        """
+        Packs reminders into HTML messages of at most max_length characters,
+        one deep link per task, under a bold heading per group.
 
-def process_tasks(task_list, message, sleep_time, secrets):
-    for task in task_list:
-        NotificationSender.send_notification(message, task, secrets)
-        time.sleep(sleep_time)
+        :param reminders: List of (group, task) pairs in priority order.
+        :param max_length: Message length limit.
+        :return: List of (payload, reminders in that payload).
+        """
+        digests = []
+        lines, members, group = [], [], None
+        for reminder_group, task in reminders:
+            heading = "<b>%s</b>" % html.escape(reminder_group)
+            url = html.escape(task_url(task), quote=True)
+            room = max_length - len(heading) - len('• <a href=""></a>') - len(url) - 2
+            name = _truncate_escaped(task_name(task), room)
+            line = '• <a href="%s">%s</a>' % (url, name)
+            added = [line] if reminder_group == group else [heading, line]
+            if lines and len("\n".join(lines + added)) > max_length:
+                digests.append((lines, members))
+                lines, members, added = [], [], [heading, line]
+            lines.extend(added)
+            members.append((reminder_group, task))
+            group = reminder_group
+        if lines:
+            digests.append((lines, members))
 
+        total = len(reminders)
+        payloads = []
+        for index, (lines, members) in enumerate(digests):
+            title = "%d task reminder%s" % (total, "" if total == 1 else "s")
+            if len(digests) > 1:
+                title += " (%d/%d)" % (index + 1, len(digests))
+            payload = {
+                "title": title[: notifications.MAX_TITLE_LENGTH],
+                "message": "\n".join(lines),
+                "html": 1,
+            }
+            payloads.append((payload, members))
+        return payloads
 
-def handler(pd):
-    secrets = SecretsManager.get_secrets()
+    @staticmethod
+    def send_notification(title, note_json, secrets, state=None):
+        """
+        Sends one task's reminder unless state says it was sent recently.
+
+        :return: The Pushover status, or None if the reminder was suppressed.
+        """
+        if state is not None and not state.unsent([(title, note_json)]):
+            return None
+        payload = NotificationSender.build_payload(title, note_json)
+        [(_, status)] = notifications.send_messages(secrets, [(0, payload)])
+        if isinstance(status, Exception):
+            raise status
+        if state is not None:
+            state.mark_sent([(title, note_json)])
+        return status
 
-    today = pd.steps["Today_tasks"]["$return_value"]["results"]
-    upcoming = pd.steps["Upcoming_tasks"]["$return_value"]["results"]
-    late = pd.steps["Late_tasks"]["$return_value"]["results"]
 
-    sleep_time = 5
-    total_tasks = len(today) + len(late) + len(upcoming)
-    total_available_time = 250.0
-    max_sleep_time_per_task = (
-        total_available_time / total_tasks if total_tasks else total_available_time
+def process_tasks(task_groups, secrets, state=None, mode=REMINDER_MODE):
+    """
+    Sends reminders for the tasks, highest priority group first.
+
+    :param task_groups: List of (title, tasks) pairs in priority order.
+    :param secrets: Mapping holding the Pushover credentials.
+    :param state: ReminderState; reminders it has seen recently are skipped and
+        delivered ones are recorded. None sends everything.
+    :param mode: "each" for one message per task, "digest" to pack them.
+    :return: List of (payload, status or exception) per message sent.
+    """
+    reminders = [(title, task) for title, tasks in task_groups for task in tasks]
+    if state is not None:
+        reminders = state.unsent(reminders)
+    if mode == "digest":
+        batches = NotificationSender.build_digests(reminders)
+    else:
+        batches = [
+            (NotificationSender.build_payload(title, task), [(title, task)])
+            for title, task in reminders
+        ]
+    if not batches:
+        return []
+    # Each task's group index is its priority; a digest takes its first task's.
+    priorities = {title: priority for priority, (title, _) in enumerate(task_groups)}
+    results = notifications.send_messages(
+        secrets,
+        [(priorities[members[0][0]], payload) for payload, members in batches],
     )
+    if state is not None:
+        state.mark_sent(
+            reminder
+            for (_, members), (_, status) in zip(batches, results)
+            if not isinstance(status, Exception)
+            for reminder in members
+        )
+    return results
+
+
+def tasks_from_steps(steps):
+    """Reads the buckets from the legacy Today/Upcoming/Late query steps."""
+    return {
+        "today": steps["Today_tasks"]["$return_value"]["results"],
+        "upcoming": steps["Upcoming_tasks"]["$return_value"]["results"],
+        "late": steps["Late_tasks"]["$return_value"]["results"],
+    }
+
+
+def fetch_tasks(secrets):
+    """
+    Queries the task database (NOTION_TASKS_DB, or the secret's TASKS_DB) and
+    buckets the open tasks.
 
-    process_tasks(today, "Task due today", max_sleep_time_per_task, secrets)
-    process_tasks(upcoming, "Upcoming tasks due", max_sleep_time_per_task, secrets)
-    process_tasks(late, "Late task", max_sleep_time_per_task, secrets)
+    :param secrets: Mapping holding the Notion token.
+    :return: Dict with "late", "today" and "upcoming" lists.
+    """
+    database_id = TASKS_DATABASE_ID or secrets["TASKS_DB"]
+    source = TaskSource(NotionManager.get_client(secrets), database_id)
+    return bucket_tasks(source.sync(), today_in())
+
+
+def send_reminders(task_groups, state):
+    """
+    Runs process_tasks, raising the first auth failure so that
+    SecretsManager.call_with_refresh can retry with fresh credentials; the
+    reminders that were delivered are skipped by state on the retry.
+    """
+    results = process_tasks(task_groups, SecretsManager.get_secrets(), state=state)
+    for _, status in results:
+        if secrets_cache.is_auth_error(status):
+            raise status
+    return results
+
+
+@tracing.instrument_handler("task_reminders")
+def handler(pd):
+    if "Today_tasks" in pd.steps:
+        buckets = tasks_from_steps(pd.steps)
+    else:
+        buckets = SecretsManager.call_with_refresh(
+            lambda: fetch_tasks(SecretsManager.get_secrets())
+        )
+    today, upcoming, late = buckets["today"], buckets["upcoming"], buckets["late"]
+
+    state = reminder_state.ReminderState()
+    SecretsManager.call_with_refresh(
+        lambda: send_reminders(
+            [
+                ("Late task", late),
+                ("Task due today", today),
+                ("Upcoming tasks due", upcoming),
+            ],
+            state,
+        )
+    )
 
     return "Complete"
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+import job_queue
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return job_queue.JobQueue(str(tmp_path / "jobs.sqlite3"), clock=clock)
+
+
+def _worker(queue, owner, **kwargs):
+    echo = job_queue.Pipeline([("echo", lambda payload, checkpoints: payload)])
+    pipelines = {"echo": echo}
+    return job_queue.Worker(
+        queue, pipelines, owner=owner, poll_interval=0.01, lease_seconds=15, **kwargs
+    )
+
+
+def test_retry_takes_over_the_lease_of_a_dead_inline_attempt(queue, clock):
+    job_id = queue.enqueue("echo", {"n": 1}, dedupe_key="echo:1")
+    # The first attempt leased the job and was killed mid-run.
+    assert queue.lease("inline:dead", job_id=job_id, lease_seconds=15) is not None
+    clock.now += 16
+
+    retry = _worker(queue, "inline:retry")
+    assert queue.enqueue("echo", {"n": 1}, dedupe_key="echo:1") == job_id
+    assert retry.run_inline(job_id) == {"n": 1}
+    assert queue.get(job_id).state == "done"
+
+
+def test_inline_lease_is_short(queue, clock):
+    job_id = queue.enqueue("echo", {"n": 1})
+    queue.lease("inline:a", job_id=job_id, lease_seconds=15)
+    clock.now += 16
+    # A regular lease of LEASE_SECONDS would still be held here.
+    assert queue.lease("worker", job_id=job_id) is not None
+
+
+def test_retry_waits_for_a_live_attempt_to_finish(queue):
+    job_id = queue.enqueue("echo", {"n": 1})
+    queue.lease("inline:live", job_id=job_id, lease_seconds=15)
+
+    def finish():
+        time.sleep(0.1)
+        queue.complete(job_id, "inline:live", {"n": "first"})
+
+    thread = threading.Thread(target=finish)
+    thread.start()
+    try:
+        assert _worker(queue, "inline:retry").run_inline(job_id) == {"n": "first"}
+    finally:
+        thread.join()
+
+
+def test_retry_gives_up_after_waiting(queue):
+    job_id = queue.enqueue("echo", {"n": 1})
+    queue.lease("inline:live", job_id=job_id, lease_seconds=15)
+
+    with pytest.raises(job_queue.LeaseLost):
+        _worker(queue, "inline:retry").run_inline(job_id, wait_seconds=0.05)
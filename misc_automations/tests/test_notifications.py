@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+import notifications
+import secrets_cache
+from benchmarks import fakes
+
+
+@pytest.fixture
+def pushover():
+    with fakes.FakeWebServer(pushover_token="fresh-token") as server:
+        yield server
+
+
+def _send(secrets, url):
+    [(_, status)] = notifications.send_messages(
+        secrets, [(0, {"message": "hello"})], url=url, max_retries=0
+    )
+    if isinstance(status, Exception):
+        raise status
+    return status
+
+
+def test_invalid_token_is_an_auth_error(pushover):
+    url = pushover.base_url + "/1/messages.json"
+    secrets = {"PUSHOVER_APP": "stale-token", "PUSHOVER_USER": "user"}
+
+    with pytest.raises(notifications.PushoverAuthError) as caught:
+        _send(secrets, url)
+
+    assert caught.value.status == 400
+    assert secrets_cache.is_auth_error(caught.value)
+
+
+def test_other_client_errors_are_not_auth_errors():
+    error = notifications.delivery_error(400, json.dumps({"message": "too long"}))
+
+    assert type(error) is notifications.DeliveryError
+    assert not secrets_cache.is_auth_error(error)
+    assert not secrets_cache.is_auth_error(notifications.delivery_error(400, "<html>"))
+
+
+def test_call_with_refresh_retries_with_a_rotated_token(pushover):
+    url = pushover.base_url + "/1/messages.json"
+    manager = secrets_cache.LocalSecretsManager(
+        {"app": {"PUSHOVER_APP": "stale-token", "PUSHOVER_USER": "user"}}
+    )
+    cache = secrets_cache.SecretsCache("app", lambda: manager)
+    cache["PUSHOVER_APP"]  # Loaded before the rotation.
+    manager.put_secret_value(
+        "app", json.dumps({"PUSHOVER_APP": "fresh-token", "PUSHOVER_USER": "user"})
+    )
+
+    assert cache.call_with_refresh(lambda: _send(cache, url)) == 200
+    assert [message["token"] for message in pushover.messages] == [["fresh-token"]]
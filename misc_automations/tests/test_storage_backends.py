@@ -0,0 +1,44 @@
+import pytest
+
+import storage_backends
+import video_cache
+from benchmarks import fakes
+
+PART_SIZE = 1024
+
+
+@pytest.fixture
+def backend():
+    return storage_backends.GCSBackend(
+        fakes.FakeStorageClient(), "bench", part_size=PART_SIZE, workers=2
+    )
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(range(256)) * (5 * PART_SIZE // 256 + 1))
+    return str(path)
+
+
+def test_multipart_upload_is_composed_and_verified(backend, video):
+    pytest.importorskip("google_crc32c")
+
+    uri = backend.upload_file(video, "videos/v.mp4")
+
+    assert uri == "gs://bench/videos/v.mp4"
+    assert "videos/v.mp4" in backend.bucket.composed
+    assert list(backend.bucket.objects) == ["videos/v.mp4"]
+
+
+def test_multipart_upload_without_crc32c_uses_one_stream(
+    backend, video, monkeypatch
+):
+    monkeypatch.setattr(video_cache, "google_crc32c", None)
+
+    uri = backend.upload_file(video, "videos/v.mp4")
+
+    assert uri == "gs://bench/videos/v.mp4"
+    assert not backend.bucket.composed
+    assert list(backend.bucket.objects) == ["videos/v.mp4"]
+    assert backend.matches("videos/v.mp4", video)
@@ -0,0 +1,131 @@
+import json
+
+import httpx
+import pytest
+from notion_client import Client
+
+import task_reminders
+
+DATABASE_ID = "db0"
+DATA_SOURCE_ID = "ds0"
+
+
+def _task(page_id, edited, due="2026-10-20", done=False):
+    return {
+        "id": page_id,
+        "url": "https://www.notion.so/%s" % page_id,
+        "last_edited_time": edited,
+        "properties": {
+            task_reminders.TITLE_PROPERTY: {
+                "type": "title",
+                "title": [{"plain_text": "Task %s" % page_id}],
+            },
+            task_reminders.DUE_PROPERTY: {"type": "date", "date": {"start": due}},
+            task_reminders.DONE_PROPERTY: {"type": "checkbox", "checkbox": done},
+            "Ignored": {"type": "rich_text", "rich_text": []},
+        },
+    }
+
+
+class NotionAPI:
+    """Serves the database retrieve and data source query endpoints."""
+
+    def __init__(self, tasks, page_size=2):
+        self.tasks = tasks
+        self.page_size = page_size
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        if request.method == "GET" and request.url.path == "/v1/databases/%s" % (
+            DATABASE_ID
+        ):
+            return httpx.Response(
+                200,
+                json={
+                    "object": "database",
+                    "id": DATABASE_ID,
+                    "data_sources": [{"id": DATA_SOURCE_ID, "name": "Tasks"}],
+                },
+            )
+        if request.method == "POST" and request.url.path == (
+            "/v1/data_sources/%s/query" % DATA_SOURCE_ID
+        ):
+            body = json.loads(request.content or b"{}")
+            since = body["filter"].get("last_edited_time", {}).get("on_or_after")
+            tasks = [
+                task for task in self.tasks
+                if not since or task["last_edited_time"] >= since
+            ]
+            start = int(body.get("start_cursor") or 0)
+            end = start + self.page_size
+            return httpx.Response(
+                200,
+                json={
+                    "object": "list",
+                    "results": tasks[start:end],
+                    "has_more": end < len(tasks),
+                    "next_cursor": str(end) if end < len(tasks) else None,
+                },
+            )
+        return httpx.Response(
+            404, json={"object": "error", "status": 404, "code": "object_not_found",
+                       "message": "Unexpected %s %s" % (request.method, request.url)},
+        )
+
+
+@pytest.fixture
+def api():
+    return NotionAPI(
+        [
+            _task("a", "2026-10-01T00:00:00.000Z"),
+            _task("b", "2026-10-02T00:00:00.000Z", done=True),
+            _task("c", "2026-10-03T00:00:00.000Z"),
+        ]
+    )
+
+
+@pytest.fixture
+def source(api, tmp_path):
+    transport = httpx.MockTransport(api)
+    client = Client(auth="secret", client=httpx.Client(transport=transport))
+    now = [1000.0]
+    task_source = task_reminders.TaskSource(
+        client,
+        DATABASE_ID,
+        snapshot_path=str(tmp_path / "tasks.json"),
+        full_sync_seconds=3600,
+        clock=lambda: now[0],
+    )
+    task_source.now = now
+    return task_source
+
+
+def _ids(tasks):
+    return sorted(task["id"] for task in tasks)
+
+
+def test_full_sync_reads_every_page_of_the_data_source(api, source):
+    tasks = source.sync()
+
+    assert _ids(tasks) == ["a", "c"]
+    paths = [request.url.path for request in api.requests]
+    assert paths.count("/v1/databases/%s" % DATABASE_ID) == 1
+    assert paths.count("/v1/data_sources/%s/query" % DATA_SOURCE_ID) == 2
+
+
+def test_incremental_sync_applies_edits_since_the_cursor(api, source):
+    source.sync()
+    api.tasks[0] = _task("a", "2026-10-04T00:00:00.000Z", done=True)
+    api.tasks.append(_task("d", "2026-10-05T00:00:00.000Z"))
+    api.requests.clear()
+    source.now[0] += 60
+
+    tasks = source.sync()
+
+    assert _ids(tasks) == ["c", "d"]
+    # The data source ID is resolved once, and only edited pages are re-read.
+    assert all(request.url.path != "/v1/databases/%s" % DATABASE_ID
+               for request in api.requests)
+    first = json.loads(api.requests[0].content)
+    assert first["filter"]["last_edited_time"]["on_or_after"] >= "2026-10-03"
@@ -0,0 +1,318 @@
+"""
+This module records how long each stage of a handler takes.
+
+Stages are recorded as spans carrying their duration, error and attributes
+(sizes, bitrates, retry counts, ...). Finished spans are appended to a JSON
+lines file and aggregated into per-stage metrics in the Prometheus text
+format, so a run that blows the serverless time limit shows which stage ate
+the budget. cProfile and tracemalloc capture can be switched on per handler:
+
+    TRACE_FILE            JSON lines destination (spans are logged when unset)
+    TRACE_METRICS_FILE    Prometheus textfile, rewritten after every handler run
+    TRACE_CPROFILE        handlers to profile, e.g. "video_summarize,links" or "all"
+    TRACE_TRACEMALLOC     handlers to trace allocations for, same format
+    TRACE_PROFILE_DIR     where .prof files are written (default /tmp)
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+METRICS_FILE = os.environ.get("TRACE_METRICS_FILE")
+PROFILE_DIR = os.environ.get("TRACE_PROFILE_DIR", "/tmp")
+METRIC_PREFIX = "notion_automations_stage"
+TOP_ALLOCATIONS = 10
+
+
+class Span:
+    """
+    One timed stage. Attributes set while the span is open end up in the export.
+    """
+
+    def __init__(
+        self, name, trace_id, parent_id=None, attributes=None, clock=time.perf_counter
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.duration = None
+        self.clock = clock
+        self.start_time = time.time()
+        self._started = clock()
+
+    @property
+    def elapsed(self):
+        """Seconds since the span started."""
+        return self.clock() - self._started
+
+    def set(self, **attributes):
+        """Adds or overwrites attributes, e.g. span.set(size_kb=812, retries=1)."""
+        self.attributes.update(attributes)
+
+    def mark(self, event):
+        """Records the time since the start as <event>_seconds, e.g. first_token."""
+        self.attributes.setdefault(event + "_seconds", self.elapsed)
+
+    def finish(self, error=None):
+        if error is not None:
+            self.error = "%s: %s" % (type(error).__name__, error)
+        self.duration = self.elapsed
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Creates spans, nests them per thread, and exports the finished ones.
+    """
+
+    def __init__(
+        self, trace_file=TRACE_FILE, metrics_file=METRICS_FILE, clock=time.perf_counter
+    ):
+        """
+        :param trace_file: JSON lines file for finished spans; None logs them instead.
+        :param metrics_file: Prometheus textfile written by write_metrics.
+        :param clock: Monotonic time source, in seconds.
+        """
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.clock = clock
+        # stage -> [count, errors, total seconds, max seconds]
+        self.stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Returns the innermost open span on this thread, or None."""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    def start_span(self, name, **attributes):
+        """Starts a span under the current one without making it current."""
+        parent = self.current()
+        if parent is None:
+            return Span(name, uuid.uuid4().hex, None, attributes, self.clock)
+        return Span(name, parent.trace_id, parent.span_id, attributes, self.clock)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the enclosed block as a stage.
+
+        :param name: Stage name, e.g. "compress".
+        :param attributes: Initial span attributes.
+        :return: Context manager yielding the Span.
+        """
+        span = self.start_span(name, **attributes)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.finish(error)
+            raise
+        else:
+            span.finish()
+        finally:
+            stack.pop()
+            self.record(span)
+
+    def traced(self, name=None):
+        """Decorator timing every call of a function as a stage (default: its name)."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name or function.__name__):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stream(self, name, chunks, **attributes):
+        """
+        Times a streamed response from the first request to the last chunk.
+
+        The span records first_chunk_seconds (time to first token for LLM
+        streams), the number of chunks, and consumer_seconds: the time the
+        consumer spent between chunks, e.g. an incremental parser.
+
+        :param name: Stage name, e.g. "llm".
+        :param chunks: Iterable of chunks; iteration starts the request.
+        :return: Generator yielding the chunks unchanged.
+        """
+        span = self.start_span(name, **attributes)
+        count = 0
+        consumer_seconds = 0.0
+        try:
+            for chunk in chunks:
+                if not count:
+                    span.mark("first_chunk")
+                count += 1
+                handed_over = self.clock()
+                yield chunk
+                consumer_seconds += self.clock() - handed_over
+        except GeneratorExit:
+            # The consumer stopped early, which is not a failure of the stage.
+            span.finish()
+            raise
+        except BaseException as error:
+            span.finish(error)
+            raise
+        else:
+            span.finish()
+        finally:
+            span.set(chunks=count, consumer_seconds=consumer_seconds)
+            self.record(span)
+
+    def record(self, span):
+        """Aggregates a finished span and exports it as a JSON line."""
+        with self._lock:
+            stats = self.stats.setdefault(span.name, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += span.error is not None
+            stats[2] += span.duration
+            stats[3] = max(stats[3], span.duration)
+            line = json.dumps(span.to_dict(), default=str)
+            if self.trace_file:
+                with open(self.trace_file, "a") as outfile:
+                    outfile.write(line + "\n")
+        if not self.trace_file:
+            logging.info("span %s", line)
+
+    def prometheus_text(self):
+        """Returns the per-stage metrics in the Prometheus text exposition format."""
+        with self._lock:
+            stats = sorted(
+                (stage, tuple(values)) for stage, values in self.stats.items()
+            )
+        metrics = [
+            ("duration_seconds", "summary", "Time spent per handler stage."),
+            ("duration_seconds_max", "gauge", "Slowest run of each stage."),
+            ("errors_total", "counter", "Stage runs that raised."),
+        ]
+        lines = []
+        for metric, kind, description in metrics:
+            name = "%s_%s" % (METRIC_PREFIX, metric)
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for stage, (count, errors, total, slowest) in stats:
+                label = '{stage="%s"}' % stage
+                if metric == "duration_seconds":
+                    lines.append("%s_count%s %d" % (name, label, count))
+                    lines.append("%s_sum%s %.6f" % (name, label, total))
+                elif metric == "duration_seconds_max":
+                    lines.append("%s%s %.6f" % (name, label, slowest))
+                else:
+                    lines.append("%s%s %d" % (name, label, errors))
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path=None):
+        """Atomically rewrites the Prometheus textfile, e.g. for node_exporter."""
+        path = path or self.metrics_file
+        if not path:
+            return
+        work_path = path + ".tmp"
+        with open(work_path, "w") as outfile:
+            outfile.write(self.prometheus_text())
+        os.replace(work_path, path)
+
+
+TRACER = Tracer()
+
+
+def span(name, **attributes):
+    """Times the enclosed block as a stage of the current handler run."""
+    return TRACER.span(name, **attributes)
+
+
+def stream(name, chunks, **attributes):
+    """Times a streamed response, recording the time to its first chunk."""
+    return TRACER.stream(name, chunks, **attributes)
+
+
+def traced(name=None):
+    """Decorator timing every call of a function as a stage."""
+    return TRACER.traced(name)
+
+
+def _enabled(variable, handler_name):
+    names = {name.strip() for name in os.environ.get(variable, "").split(",")}
+    return handler_name in names or "all" in names
+
+
+@contextmanager
+def _profiled(root, handler_name):
+    profile = None
+    if _enabled("TRACE_CPROFILE", handler_name):
+        profile = cProfile.Profile()
+        profile.enable()
+    started_tracemalloc = False
+    if _enabled("TRACE_TRACEMALLOC", handler_name) and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracemalloc = True
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            path = os.path.join(
+                PROFILE_DIR, "%s-%s.prof" % (handler_name, root.trace_id)
+            )
+            profile.dump_stats(path)
+            root.set(cprofile=path)
+        if started_tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+            tracemalloc.stop()
+            root.set(
+                peak_memory_bytes=peak,
+                top_allocations=[
+                    "%s: %d B" % (stat.traceback, stat.size) for stat in top
+                ],
+            )
+
+
+def instrument_handler(handler_name):
+    """
+    Decorator for a Pipedream handler: times the whole run as a span named
+    handler_name, applies the per-handler profiling switches and rewrites
+    the metrics file.
+
+    :param handler_name: Name matched against TRACE_CPROFILE/TRACE_TRACEMALLOC.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                with TRACER.span(handler_name) as root:
+                    with _profiled(root, handler_name):
+                        return function(*args, **kwargs)
+            finally:
+                TRACER.write_metrics()
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,198 @@
+"""
+This module canonicalizes link URLs and keeps a persistent index of the
+links that already have a Notion page.
+
+The index is a SQLite database in WAL mode, so several workers on one host
+can share it, and lookups stay a single B-tree probe with millions of rows.
+"""
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import scraper_registry
+
+DEFAULT_DB_PATH = os.environ.get("LINK_INDEX_DB", "/tmp/link_index.sqlite3")
+# A claim that hasn't been completed in this long is assumed to be from a dead worker.
+CLAIM_TIMEOUT = 15 * 60
+
+TRACKING_PARAMS = frozenset(
+    (
+        "fbclid",
+        "gclid",
+        "dclid",
+        "msclkid",
+        "igshid",
+        "igsh",
+        "mc_cid",
+        "mc_eid",
+        "ref",
+        "ref_src",
+        "ref_url",
+        "si",
+        "feature",
+        "_ga",
+        "spm",
+    )
+)
+# Hosts serving the same content under another domain.
+HOST_ALIASES = {"threads.net": "threads.com"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Query parameters that only carry tracking data on specific platforms.
+PLATFORM_TRACKING_PARAMS = {
+    "Twitter": frozenset(("s", "t")),
+    "YouTube": frozenset(("t",)),
+}
+
+
+class InFlightError(Exception):
+    """Raised when another worker is already processing the same link."""
+
+
+def _is_tracking(name, platform):
+    name = name.lower()
+    return (
+        name.startswith("utm_")
+        or name in TRACKING_PARAMS
+        or name in PLATFORM_TRACKING_PARAMS.get(platform, ())
+    )
+
+
+def canonicalize_url(url):
+    """
+    Returns one canonical form for the URL variants that point at the same content.
+
+    Drops fragments, default ports, tracking parameters and trailing slashes,
+    sorts the remaining query, forces https (adding it to schemeless URLs), and
+    rewrites platform URLs (youtu.be, shorts, m./mobile. hosts, reels,
+    twitter.com, threads.net) to a single form.
+
+    :param url: The URL to canonicalize.
+    :return: Canonical URL string.
+    """
+    url = url.strip()
+    if url.startswith("//"):
+        url = "https:" + url
+    elif "://" not in url:
+        url = "https://" + url
+    parsed = urllib.parse.urlparse(url)
+    host = scraper_registry.normalize_host(parsed.netloc)
+    platform = scraper_registry.platform_for_host(host)
+    page_id = scraper_registry.extract_page_id(
+        platform, host, parsed.path, parsed.query
+    )
+    if platform == "YouTube" and page_id:
+        return "https://www.youtube.com/watch?v=%s" % page_id
+    if platform == "Instagram" and scraper_registry.INSTAGRAM_PATH.match(parsed.path):
+        return "https://www.instagram.com/p/%s/" % page_id
+    if platform == "Twitter" and scraper_registry.TWITTER_PATH.match(parsed.path):
+        return "https://x.com/i/status/%s" % page_id
+
+    for prefix in ("m.", "mobile."):
+        if platform and host.startswith(prefix):
+            host = host[len(prefix) :]
+    host = HOST_ALIASES.get(host, host)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    # https is forced, so 443 is dropped along with the scheme's own default.
+    if port is not None and port not in (DEFAULT_PORTS.get(parsed.scheme), 443):
+        host = "%s:%d" % (host, port)
+    path = parsed.path.rstrip("/") or "/"
+    query = urllib.parse.urlencode(
+        sorted(
+            (name, value)
+            for name, value in urllib.parse.parse_qsl(
+                parsed.query, keep_blank_values=True
+            )
+            if not _is_tracking(name, platform)
+        )
+    )
+    return urllib.parse.urlunparse(("https", host, path, "", query, ""))
+
+
+class SeenIndex:
+    """
+    Persistent map from canonical URL to the Notion page created for it.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, clock=time.time):
+        """
+        :param path: SQLite database file, shared by every worker on the host.
+        :param clock: Time source, in seconds since the epoch.
+        """
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                " canonical_url TEXT PRIMARY KEY,"
+                " notion_url TEXT,"
+                " updated_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, canonical_url):
+        """Returns the Notion URL recorded for a canonical URL, or None."""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT notion_url FROM links WHERE canonical_url = ?", (canonical_url,)
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def claim(self, canonical_url):
+        """
+        Atomically claims a link for processing.
+
+        :param canonical_url: Canonical URL of the link.
+        :return: (claimed, notion_url). notion_url is set for links already
+            processed; claimed is False if another worker holds a live claim.
+        """
+        now = self.clock()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT notion_url, updated_at FROM links WHERE canonical_url = ?",
+                (canonical_url,),
+            ).fetchone()
+            if row is not None and (row[0] or now - row[1] < CLAIM_TIMEOUT):
+                connection.execute("COMMIT")
+                return False, row[0]
+            connection.execute(
+                "INSERT OR REPLACE INTO links VALUES (?, NULL, ?)", (canonical_url, now)
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return True, None
+
+    def record(self, canonical_url, notion_url):
+        """Records the Notion page created for a link, completing its claim."""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO links VALUES (?, ?, ?)",
+            (canonical_url, notion_url, self.clock()),
+        )
+
+    def release(self, canonical_url):
+        """Drops an unfinished claim so the link can be retried."""
+        self._connection().execute(
+            "DELETE FROM links WHERE canonical_url = ? AND notion_url IS NULL",
+            (canonical_url,),
+        )
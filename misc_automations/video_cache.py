@@ -0,0 +1,150 @@
+"""
+This module provides a content-addressed cache for the video pipeline.
+
+Videos are keyed by a streaming SHA-256 of the input file. For each key the
+cache keeps the compressed artifact and the parsed Gemini summary, and the
+GCS blob is named after the key so an identical upload can be skipped.
+"""
+# pipedream add-package google-crc32c
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+try:
+    import google_crc32c
+except ImportError:  # Fall back to MD5 when the C extension isn't available.
+    google_crc32c = None
+
+CACHE_DIR = os.environ.get("VIDEO_CACHE_DIR", "/tmp/video_cache")
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    """
+    Hashes a file without reading it into memory.
+
+    :param path: Path of the file.
+    :param chunk_size: Bytes read per iteration.
+    :return: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_md5_base64(path, chunk_size=CHUNK_SIZE):
+    """Returns the base64 MD5 of a file, as reported by GCS in blob.md5_hash."""
+    digest = hashlib.md5()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode()
+
+
+def file_crc32c_base64(path, chunk_size=CHUNK_SIZE):
+    """Returns the base64 CRC32C of a file, as reported by GCS in blob.crc32c."""
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode()
+
+
+def blob_name(digest, extension=".mp4"):
+    """Returns the content-addressed GCS blob name for a video digest."""
+    return "videos/%s%s" % (digest, extension)
+
+
+def blob_matches(blob, path):
+    """
+    Checks whether a GCS blob already holds exactly the bytes of a local file.
+
+    Composite objects have no MD5, so CRC32C is preferred when available.
+
+    :param blob: google.cloud.storage Blob.
+    :param path: Path of the local file.
+    :return: True if the blob exists and its checksum matches.
+    """
+    if not blob.exists():
+        return False
+    blob.reload()
+    if blob.size != os.path.getsize(path):
+        return False
+    if google_crc32c is not None and blob.crc32c:
+        return blob.crc32c == file_crc32c_base64(path)
+    if blob.md5_hash:
+        return blob.md5_hash == file_md5_base64(path)
+    return False
+
+
+class VideoCache:
+    """
+    Stores compressed artifacts and parsed summaries under the input's SHA-256.
+    """
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def _entry(self, digest):
+        path = os.path.join(self.root, digest[:2], digest)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def compressed_path(self, digest):
+        """Returns where the compressed artifact for a digest is (or will be) kept."""
+        return os.path.join(self._entry(digest), "compressed.mp4")
+
+    def has_compressed(self, digest):
+        return os.path.exists(self.compressed_path(digest))
+
+    def store_compressed(self, digest, path):
+        """
+        Copies a compressed artifact into the cache.
+
+        :param digest: SHA-256 of the original input.
+        :param path: Path of the compressed file.
+        :return: Path of the cached copy.
+        """
+        target = self.compressed_path(digest)
+        # A unique temp file per writer; concurrent jobs may store the same digest.
+        fd, tmp_target = tempfile.mkstemp(
+            dir=os.path.dirname(target), prefix=".compressed-", suffix=".tmp"
+        )
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_target)
+            os.replace(tmp_target, target)
+        except BaseException:
+            os.remove(tmp_target)
+            raise
+        return target
+
+    def load_summary(self, digest):
+        """Returns the stored parsed summary for a digest, or None."""
+        path = os.path.join(self._entry(digest), "summary.json")
+        try:
+            with open(path) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning("Ignoring corrupt summary cache entry %s", path)
+            return None
+
+    def store_summary(self, digest, parsed_summary):
+        """Stores the parsed summary for a digest."""
+        entry = self._entry(digest)
+        fd, tmp_path = tempfile.mkstemp(dir=entry, prefix=".summary-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                json.dump(parsed_summary, outfile)
+            os.replace(tmp_path, os.path.join(entry, "summary.json"))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
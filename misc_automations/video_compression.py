@@ -0,0 +1,250 @@
+"""
+This module is the video compression engine shared by the video handlers.
+
+It probes the input once, predicts the x264 bitrate overshoot from a short
+sample encode, and then hits the target size in a single bounded pass
+instead of re-encoding recursively until the file fits.
+"""
+# pipedream add-package ffmpeg-python
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+import ffmpeg
+
+import tracing
+
+DEFAULT_PRESET = os.environ.get("VIDEO_PRESET", "veryfast")
+DEFAULT_THREADS = int(os.environ.get("VIDEO_THREADS", 0))
+
+# Adjust them to meet your minimum requirements (in bps), or the engine will refuse your video!
+TOTAL_BITRATE_LOWER_BOUND = 11000
+MIN_AUDIO_BITRATE = 32000
+MAX_AUDIO_BITRATE = 256000
+MIN_VIDEO_BITRATE = 100000
+# Container overhead allowance used by the original size estimate.
+OVERHEAD = 1.073741824
+
+VideoInfo = namedtuple("VideoInfo", "duration audio_bitrate size")
+CompressionResult = namedtuple("CompressionResult", "path size_kb wall_time passes")
+
+
+class CompressionError(Exception):
+    """Raised when a video cannot be compressed to the requested size."""
+
+
+def probe_video(path):
+    """
+    Probes a video once for everything the engine needs.
+
+    :param path: Path (or URL) of the video.
+    :return: VideoInfo with duration in s, audio bitrate in bps (None if there is
+        no audio track) and size in bytes (None if unknown).
+    """
+    probe = ffmpeg.probe(path)
+    audio = next((s for s in probe["streams"] if s["codec_type"] == "audio"), None)
+    audio_bitrate = None
+    if audio is not None:
+        audio_bitrate = float(audio.get("bit_rate") or MAX_AUDIO_BITRATE)
+    size = probe["format"].get("size")
+    return VideoInfo(
+        duration=float(probe["format"]["duration"]),
+        audio_bitrate=audio_bitrate,
+        size=int(size) if size else None,
+    )
+
+
+def plan_bitrates(info, size_upper_bound):
+    """
+    Splits the bitrate budget for a target size between video and audio.
+
+    :param info: VideoInfo of the input.
+    :param size_upper_bound: Max output size in KB.
+    :return: (video_bitrate, audio_bitrate) in bps; audio_bitrate is None without audio.
+    """
+    # Bitrate reference: https://en.wikipedia.org/wiki/Bit_rate#Encoding_bit_rate
+    target_total_bitrate = (size_upper_bound * 1024 * 8) / (OVERHEAD * info.duration)
+    if target_total_bitrate < TOTAL_BITRATE_LOWER_BOUND:
+        raise CompressionError("Bitrate is extremely low! Stop compress!")
+
+    best_min_size = (
+        (MIN_AUDIO_BITRATE + MIN_VIDEO_BITRATE) * (OVERHEAD * info.duration) / (8 * 1024)
+    )
+    if size_upper_bound < best_min_size:
+        logging.warning(
+            "Quality not good! Recommended minimum size: %s KB.",
+            "{:,}".format(int(best_min_size)),
+        )
+
+    audio_bitrate = info.audio_bitrate
+    if audio_bitrate is not None and 10 * audio_bitrate > target_total_bitrate:
+        audio_bitrate = target_total_bitrate / 10
+        if audio_bitrate < MIN_AUDIO_BITRATE < target_total_bitrate:
+            audio_bitrate = MIN_AUDIO_BITRATE
+        elif audio_bitrate > MAX_AUDIO_BITRATE:
+            audio_bitrate = MAX_AUDIO_BITRATE
+
+    video_bitrate = target_total_bitrate - (audio_bitrate or 0)
+    if video_bitrate < 1000:
+        raise CompressionError("Bitrate %s is extremely low! Stop compress." % video_bitrate)
+    return video_bitrate, audio_bitrate
+
+
+def encode_options(video_bitrate, audio_bitrate, preset, threads):
+    """Returns the ffmpeg output options for a single constrained ABR pass."""
+    options = {
+        "c:v": "libx264",
+        "b:v": int(video_bitrate),
+        "maxrate": int(video_bitrate * 1.5),
+        "bufsize": int(video_bitrate * 2),
+        "preset": preset,
+        "threads": threads,
+        "movflags": "+faststart",
+    }
+    if audio_bitrate is None:
+        options["an"] = None
+    else:
+        options.update({"c:a": "aac", "b:a": int(audio_bitrate)})
+    return options
+
+
+def predict_overshoot(
+    path, info, video_bitrate, preset, threads, sample_seconds=6, workdir=None
+):
+    """
+    Encodes a short sample from the middle of the video to measure how far x264
+    lands from the requested video bitrate on this content.
+
+    :param workdir: Directory the sample is written to; the system temp dir if None.
+    :return: Ratio of achieved to requested video bitrate, clamped to [0.5, 2].
+    """
+    if info.duration < 3 * sample_seconds:
+        return 1.0
+    start = (info.duration - sample_seconds) / 2
+    fd, sample_path = tempfile.mkstemp(suffix=".mp4", dir=workdir)
+    os.close(fd)
+    try:
+        options = encode_options(video_bitrate, None, preset, threads)
+        ffmpeg.output(
+            ffmpeg.input(path, ss=start, t=sample_seconds), sample_path, **options
+        ).overwrite_output().run(quiet=True)
+        achieved = os.path.getsize(sample_path) * 8 / sample_seconds
+    finally:
+        os.remove(sample_path)
+    return min(2.0, max(0.5, achieved / video_bitrate))
+
+
+def compress_video(
+    video_full_path,
+    size_upper_bound,
+    output_path=None,
+    preset=DEFAULT_PRESET,
+    threads=DEFAULT_THREADS,
+    max_passes=2,
+    sample_seconds=6,
+):
+    """
+    Compresses a video to at most size_upper_bound KB.
+
+    The output is encoded to a separate file and, without output_path, moved
+    over the input once it is complete.
+
+    :param video_full_path: The video you want to compress.
+    :param size_upper_bound: Max video size in KB.
+    :param output_path: Where to write the result; defaults to replacing the input.
+    :param preset: x264 speed/quality preset, e.g. "ultrafast", "veryfast", "medium".
+    :param threads: Encoder threads, 0 lets ffmpeg decide.
+    :param max_passes: Upper bound on full encodes if the prediction misses.
+        If every pass misses, the smallest output is kept as long as it is
+        smaller than the source.
+    :param sample_seconds: Length of the sample encode used for prediction.
+    :return: CompressionResult(path, size_kb, wall_time, passes).
+    :raises CompressionError: If no pass came out smaller than the source.
+    """
+    started = time.monotonic()
+    with tracing.span("probe") as span:
+        info = probe_video(video_full_path)
+        span.set(duration_s=info.duration, size_bytes=info.size)
+    video_bitrate, audio_bitrate = plan_bitrates(info, size_upper_bound)
+    target_path = output_path or video_full_path
+    # Scratch files live next to the output, i.e. in the job's workspace.
+    workdir = os.path.dirname(os.path.abspath(target_path))
+    with tracing.span("predict_overshoot", sample_seconds=sample_seconds) as span:
+        overshoot = predict_overshoot(
+            video_full_path,
+            info,
+            video_bitrate,
+            preset,
+            threads,
+            sample_seconds,
+            workdir=workdir,
+        )
+        span.set(overshoot=overshoot)
+    video_bitrate /= overshoot
+
+    work_path = target_path + ".part.mp4"
+    best_path = target_path + ".best.mp4"
+    best_size = None
+    stream = ffmpeg.input(video_full_path)
+    passes = 0
+    try:
+        while passes < max_passes:
+            passes += 1
+            options = encode_options(video_bitrate, audio_bitrate, preset, threads)
+            with tracing.span(
+                "encode",
+                attempt=passes,
+                video_bitrate=int(video_bitrate),
+                audio_bitrate=audio_bitrate and int(audio_bitrate),
+                preset=preset,
+            ) as span:
+                ffmpeg.output(stream, work_path, **options).overwrite_output().run(
+                    quiet=True
+                )
+                size = os.path.getsize(work_path)
+                span.set(size_kb=size / 1024)
+            if best_size is None or size < best_size:
+                os.replace(work_path, best_path)
+                best_size = size
+            if size <= size_upper_bound * 1024:
+                break
+            # Scale the video bitrate by the miss instead of re-probing the output.
+            video_bitrate *= 0.95 * size_upper_bound * 1024 / size
+        else:
+            source_size = info.size or os.path.getsize(video_full_path)
+            if best_size >= source_size:
+                raise CompressionError(
+                    "Could not reach %s KB in %s passes and every pass was larger"
+                    " than the source" % (size_upper_bound, passes)
+                )
+            logging.warning(
+                "Could not reach %s KB in %s passes, keeping the smallest output"
+                " (%.0f KB)",
+                size_upper_bound,
+                passes,
+                best_size / 1024,
+            )
+        os.replace(best_path, target_path)
+        size = best_size
+    finally:
+        for path in (work_path, best_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    result = CompressionResult(
+        path=target_path,
+        size_kb=size / 1024,
+        wall_time=time.monotonic() - started,
+        passes=passes,
+    )
+    logging.info(
+        "Compressed %s to %.0f KB in %.1fs (%s pass(es), overshoot %.2f)",
+        video_full_path,
+        result.size_kb,
+        result.wall_time,
+        result.passes,
+        overshoot,
+    )
+    return result
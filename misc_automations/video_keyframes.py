@@ -0,0 +1,236 @@
+"""
+This module turns a video into a handful of keyframes plus a small audio
+track, an alternative to sending Gemini the whole (re-encoded) MP4.
+
+Keyframes are picked with ffmpeg's scene-change score, so a screen
+recording or talking-head clip reduces to the few frames where the picture
+actually changes; the audio is re-encoded to low-bitrate mono. Nothing is
+encoded with x264, so this mode also skips compression entirely.
+"""
+# pipedream add-package ffmpeg-python
+import glob
+import logging
+import os
+import re
+from collections import namedtuple
+
+import ffmpeg
+
+import tracing
+from video_compression import probe_video
+
+DEFAULT_MAX_FRAMES = int(os.environ.get("KEYFRAME_COUNT", 8))
+DEFAULT_SCENE_THRESHOLD = float(os.environ.get("KEYFRAME_SCENE_THRESHOLD", 0.3))
+FRAME_WIDTH = 768
+# ffmpeg's JPEG quality scale: 2 (best) to 31 (worst).
+FRAME_QUALITY = 5
+AUDIO_BITRATE = 24000
+AUDIO_SAMPLE_RATE = 16000
+# Scene scores are computed on frames scaled down to this width, which is faster
+# and barely changes which cuts are found.
+SCENE_DETECT_WIDTH = 320
+# Frame timestamps in the log lines of ffmpeg's showinfo filter.
+_PTS_TIME = re.compile(r"pts_time:\s*([0-9.]+)")
+
+FRAME_MIME_TYPE = "image/jpeg"
+AUDIO_MIME_TYPE = "audio/mp4"
+
+MediaParts = namedtuple("MediaParts", "frames audio")
+
+
+def _scale_filter(width):
+    # Never upscale, keep the aspect ratio and an even height.
+    return "scale='min(%d,iw)':-2" % width
+
+
+def spread_by_time(times, count, duration):
+    """
+    Picks up to count of the timestamps, spread evenly over the video.
+
+    The video is cut into count equal spans and the timestamp nearest the
+    middle of each span is taken, so a burst of cuts early in the video can't
+    crowd out the rest. Slots left by spans sharing a timestamp go to the
+    remaining timestamps farthest from the ones already picked.
+
+    :param times: Candidate timestamps in seconds, sorted.
+    :param count: Number of timestamps to return at most.
+    :param duration: Length of the video in seconds.
+    :return: Sorted list of distinct timestamps.
+    """
+    if len(times) <= count:
+        return list(times)
+    duration = max(duration, times[-1])
+    picked = set()
+    for index in range(count):
+        target = duration * (index + 0.5) / count
+        picked.add(min(times, key=lambda time: abs(time - target)))
+    while len(picked) < count:
+        picked.add(
+            max(
+                (time for time in times if time not in picked),
+                key=lambda time: min(abs(time - other) for other in picked),
+            )
+        )
+    return sorted(picked)
+
+
+def scene_change_times(path, threshold, width=SCENE_DETECT_WIDTH):
+    """
+    Scans the whole video for scene changes without writing any frames.
+
+    :param path: Path of the video.
+    :param threshold: Scene-change score (0-1) a frame must exceed.
+    :param width: Width frames are scaled to before scoring.
+    :return: Sorted timestamps in seconds, starting with the first frame.
+    """
+    _, stderr = (
+        ffmpeg.input(path)
+        .output(
+            "-",
+            format="null",
+            an=None,
+            vf="%s,select='gt(scene,%s)+eq(n,0)',showinfo"
+            % (_scale_filter(width), threshold),
+        )
+        .run(capture_stderr=True)
+    )
+    times = _PTS_TIME.findall(stderr.decode("utf-8", "replace"))
+    return sorted({float(time) for time in times})
+
+
+def _write_frame(path, output_path, time, width):
+    ffmpeg.input(path, ss=time).output(
+        output_path, vf=_scale_filter(width), **{"frames:v": 1, "q:v": FRAME_QUALITY}
+    ).overwrite_output().run(quiet=True)
+    return output_path
+
+
+def _write_frames(path, output_dir, prefix, video_filter, max_outputs):
+    pattern = os.path.join(output_dir, prefix + "_%04d.jpg")
+    ffmpeg.input(path).output(
+        pattern,
+        vf=video_filter,
+        vsync="vfr",
+        **{"frames:v": max_outputs, "q:v": FRAME_QUALITY}
+    ).overwrite_output().run(quiet=True)
+    return sorted(glob.glob(os.path.join(output_dir, prefix + "_*.jpg")))
+
+
+def extract_keyframes(
+    path,
+    output_dir,
+    max_frames=DEFAULT_MAX_FRAMES,
+    threshold=DEFAULT_SCENE_THRESHOLD,
+    width=FRAME_WIDTH,
+    info=None,
+):
+    """
+    Extracts up to max_frames representative frames as JPEGs.
+
+    Scene changes (plus the first frame) are collected over the whole video
+    and max_frames of them, spread evenly by time, are written out. If the
+    video has too few scene changes to fill half the budget, frames are
+    sampled uniformly instead.
+
+    :param path: Path of the video.
+    :param output_dir: Directory the JPEGs are written to.
+    :param max_frames: Number of frames to return at most.
+    :param threshold: Scene-change score (0-1) a frame must exceed.
+    :param width: Max frame width in pixels.
+    :param info: VideoInfo of the input, probed if not given.
+    :return: Sorted list of JPEG paths, in playback order.
+    """
+    info = info or probe_video(path)
+    with tracing.span("keyframes", threshold=threshold) as span:
+        candidates = scene_change_times(path, threshold)
+        times = spread_by_time(candidates, max_frames, info.duration)
+        if len(times) < max(1, max_frames // 2):
+            logging.info(
+                "Only %s scene changes in %s, sampling uniformly", len(times), path
+            )
+            frames = _write_frames(
+                path,
+                output_dir,
+                "uniform",
+                "fps=%.6f,%s"
+                % (max_frames / max(info.duration, 1e-3), _scale_filter(width)),
+                max_frames,
+            )
+            span.set(uniform=True)
+        else:
+            frames = [
+                _write_frame(
+                    path,
+                    os.path.join(output_dir, "scene_%04d.jpg" % (index + 1)),
+                    time,
+                    width,
+                )
+                for index, time in enumerate(times)
+            ]
+        span.set(
+            candidates=len(candidates),
+            frames=len(frames),
+            size_bytes=sum(os.path.getsize(frame) for frame in frames),
+        )
+    return frames
+
+
+def extract_audio(
+    path, output_path, bitrate=AUDIO_BITRATE, sample_rate=AUDIO_SAMPLE_RATE
+):
+    """
+    Re-encodes the audio track to low-bitrate mono AAC, dropping the video.
+
+    :param path: Path of the video.
+    :param output_path: Where to write the .m4a file.
+    :param bitrate: Audio bitrate in bps.
+    :param sample_rate: Sample rate in Hz; 16 kHz is plenty for speech.
+    :return: output_path.
+    """
+    with tracing.span("audio", bitrate=bitrate) as span:
+        ffmpeg.input(path).output(
+            output_path,
+            vn=None,
+            ac=1,
+            ar=sample_rate,
+            **{"c:a": "aac", "b:a": bitrate}
+        ).overwrite_output().run(quiet=True)
+        span.set(size_bytes=os.path.getsize(output_path))
+    return output_path
+
+
+def extract_media(
+    path,
+    output_dir,
+    max_frames=DEFAULT_MAX_FRAMES,
+    threshold=DEFAULT_SCENE_THRESHOLD,
+):
+    """
+    Extracts the keyframes and the audio track of a video.
+
+    :param path: Path of the video.
+    :param output_dir: Directory the extracted files are written to.
+    :param max_frames: Number of keyframes at most.
+    :param threshold: Scene-change score (0-1) a keyframe must exceed.
+    :return: MediaParts(frames, audio); audio is None without an audio track.
+    """
+    with tracing.span("probe"):
+        info = probe_video(path)
+    frames = extract_keyframes(path, output_dir, max_frames, threshold, info=info)
+    audio = None
+    if info.audio_bitrate is not None:
+        audio = extract_audio(path, os.path.join(output_dir, "audio.m4a"))
+    return MediaParts(frames, audio)
+
+
+def part_files(media):
+    """
+    Lists the files of a MediaParts with their MIME types, in prompt order.
+
+    :param media: MediaParts from extract_media.
+    :return: List of (path, mime_type).
+    """
+    parts = [(frame, FRAME_MIME_TYPE) for frame in media.frames]
+    if media.audio is not None:
+        parts.append((media.audio, AUDIO_MIME_TYPE))
+    return parts
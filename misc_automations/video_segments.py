@@ -0,0 +1,89 @@
+"""
+This module splits long videos into time segments for parallel summarization.
+
+Splitting uses ffmpeg's segment muxer with stream copy, so it costs one
+read of the file and no re-encode; cuts land on the keyframe at or after
+each segment boundary. Segments are sized so that each one fits the upload
+limit at the source bitrate, which usually means no segment needs x264 at
+all, instead of crushing the whole video under the limit.
+"""
+# pipedream add-package ffmpeg-python
+import glob
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+import tracing
+
+DEFAULT_WORKERS = int(os.environ.get("VIDEO_SEGMENT_WORKERS", 4))
+# Fixed segment length in seconds; 0 sizes segments from the source bitrate.
+SEGMENT_SECONDS = float(os.environ.get("VIDEO_SEGMENT_SECONDS", 0))
+MIN_SEGMENT_SECONDS = 30
+MAX_SEGMENT_SECONDS = 600
+# Keyframe-aligned cuts make segments run long; leave room for that.
+SIZE_HEADROOM = 0.8
+
+
+def plan_segment_seconds(info, size_upper_bound, segment_seconds=SEGMENT_SECONDS):
+    """
+    Picks a segment length that keeps each segment under the size limit.
+
+    :param info: VideoInfo of the source.
+    :param size_upper_bound: Max segment size in KB.
+    :param segment_seconds: Fixed length to use instead, if set.
+    :return: Segment length in seconds.
+    """
+    if segment_seconds:
+        return segment_seconds
+    if not info.size or not info.duration:
+        return MAX_SEGMENT_SECONDS
+    bytes_per_second = info.size / info.duration
+    seconds = SIZE_HEADROOM * size_upper_bound * 1024 / bytes_per_second
+    return min(MAX_SEGMENT_SECONDS, max(MIN_SEGMENT_SECONDS, math.floor(seconds)))
+
+
+def split_video(path, output_dir, segment_seconds):
+    """
+    Splits a video into segments with stream copy (no re-encode).
+
+    :param path: Path of the source video.
+    :param output_dir: Directory the segments are written to.
+    :param segment_seconds: Target segment length in seconds.
+    :return: Segment paths, in playback order.
+    """
+    pattern = os.path.join(output_dir, "segment_%03d.mp4")
+    with tracing.span("split", segment_seconds=segment_seconds) as span:
+        ffmpeg.input(path).output(
+            pattern,
+            c="copy",
+            map=0,
+            f="segment",
+            segment_time=segment_seconds,
+            reset_timestamps=1,
+            segment_format_options="movflags=+faststart",
+        ).overwrite_output().run(quiet=True)
+        segments = sorted(glob.glob(os.path.join(output_dir, "segment_*.mp4")))
+        span.set(segments=len(segments))
+    return segments
+
+
+def map_segments(function, segments, workers=DEFAULT_WORKERS):
+    """
+    Applies function to every segment on a bounded thread pool.
+
+    :param function: Callable taking one segment.
+    :param segments: Segments, in playback order.
+    :param workers: Segments processed at once.
+    :return: Results in the order of segments; the first failure is raised.
+    """
+    if not segments:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(segments)))) as pool:
+        return list(pool.map(function, segments))
+
+
+def encoder_threads(workers=DEFAULT_WORKERS):
+    """Splits the CPUs between concurrent encodes so they don't oversubscribe."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
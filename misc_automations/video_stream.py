@@ -0,0 +1,270 @@
+"""
+This module streams a video from a URL into Google Cloud Storage without
+touching the local disk.
+
+When the video is small enough the HTTP response is piped straight into a
+resumable upload. Otherwise it is piped through ffmpeg (stdin to stdout, as
+fragmented MP4) into the upload, so download, transcode and upload overlap.
+An MP4/MOV whose moov box sits after the media data can't be decoded from a
+pipe; such files are downloaded to a workspace first and transcoded from there.
+"""
+# pipedream add-package ffmpeg-python
+# pipedream add-package google-cloud-storage
+import collections
+import hashlib
+import itertools
+import logging
+import threading
+import uuid
+from collections import namedtuple
+
+import ffmpeg
+import requests
+
+import video_cache
+import video_compression
+import workspaces
+
+CHUNK_SIZE = 1024 * 1024
+# Resumable upload chunk size, must be a multiple of 256 KB.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+FRAGMENTED_MP4 = "frag_keyframe+empty_moov+default_base_moof"
+
+StreamResult = namedtuple(
+    "StreamResult", "blob_name sha256 bytes_in bytes_out transcoded"
+)
+
+
+def _pump(chunks, sink, digest, counter, errors, close_sink=False):
+    """Writes chunks to sink, hashing and counting them on the way."""
+    try:
+        for chunk in chunks:
+            digest.update(chunk)
+            counter[0] += len(chunk)
+            sink.write(chunk)
+    except Exception as error:
+        errors.append(error)
+    finally:
+        if close_sink:
+            sink.close()
+
+
+def moov_at_end(head):
+    """
+    Tells from its first bytes whether a video needs seeking to be decoded.
+
+    :param head: First chunk of the file.
+    :return: True for an MP4/MOV whose moov box isn't ahead of the media data
+        (not faststart); False for faststart files and other containers.
+    """
+    if head[4:8] not in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"):
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset : offset + 4], "big")
+        kind = head[offset + 4 : offset + 8]
+        if kind == b"moov":
+            return False
+        if kind == b"mdat":
+            return True
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = int.from_bytes(head[offset + 8 : offset + 16], "big")
+        if size < 8:
+            break
+        offset += size
+    # No moov in the head, so it comes later in the file.
+    return True
+
+
+def _transcode(
+    source, chunks, writer, info, size_upper_bound, preset, threads, digest, counter
+):
+    """
+    Transcodes source into writer.
+
+    :param source: ffmpeg input, a local file or "pipe:0".
+    :param chunks: Iterable of bytes fed to ffmpeg's stdin, or None for a file.
+    :return: Bytes written.
+    """
+    video_bitrate, audio_bitrate = video_compression.plan_bitrates(
+        info, size_upper_bound
+    )
+    options = video_compression.encode_options(
+        video_bitrate, audio_bitrate, preset, threads
+    )
+    options.update({"movflags": FRAGMENTED_MP4, "f": "mp4"})
+    process = (
+        ffmpeg.input(source)
+        .output("pipe:1", **options)
+        .run_async(pipe_stdin=chunks is not None, pipe_stdout=True, pipe_stderr=True)
+    )
+
+    errors = []
+    stderr_tail = collections.deque(maxlen=20)
+    helpers = [
+        threading.Thread(
+            target=lambda: stderr_tail.extend(process.stderr), daemon=True
+        )
+    ]
+    if chunks is not None:
+        helpers.append(
+            threading.Thread(
+                target=_pump,
+                args=(chunks, process.stdin, digest, counter),
+                kwargs={"errors": errors, "close_sink": True},
+                daemon=True,
+            )
+        )
+    for thread in helpers:
+        thread.start()
+
+    bytes_out = 0
+    try:
+        for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b""):
+            writer.write(chunk)
+            bytes_out += len(chunk)
+    except BaseException:
+        # Don't leave ffmpeg running after a failed upload.
+        process.kill()
+        process.wait()
+        for thread in helpers:
+            thread.join()
+        raise
+    returncode = process.wait()
+    for thread in helpers:
+        thread.join()
+    if returncode != 0 or errors:
+        raise video_compression.CompressionError(
+            "ffmpeg failed: %s"
+            % (errors[0] if errors else b"".join(stderr_tail).decode(errors="replace"))
+        )
+    return bytes_out
+
+
+def _transcode_download(
+    chunks, size, writer, info, size_upper_bound, preset, threads, digest, counter
+):
+    """Downloads chunks to a workspace and transcodes the local copy."""
+    with workspaces.workspace("stream-download", size) as workspace:
+        path = workspace.path_for("source")
+        errors = []
+        with open(path, "wb") as outfile:
+            _pump(chunks, outfile, digest, counter, errors)
+        if errors:
+            raise errors[0]
+        return _transcode(
+            path,
+            None,
+            writer,
+            info,
+            size_upper_bound,
+            preset,
+            threads,
+            digest,
+            counter,
+        )
+
+
+def _delete_quietly(blob):
+    try:
+        blob.delete()
+    except Exception as error:
+        # The upload may have failed before the blob was created.
+        logging.debug("Could not delete %s: %s", blob.name, error)
+
+
+def stream_to_gcs(
+    url,
+    bucket,
+    size_upper_bound,
+    preset=video_compression.DEFAULT_PRESET,
+    threads=video_compression.DEFAULT_THREADS,
+    timeout=30,
+):
+    """
+    Streams a video into GCS, transcoding on the fly if it is over the size bound.
+
+    The upload goes to a temporary blob first and is renamed to the
+    content-addressed name (see video_cache.blob_name) once the source SHA-256
+    is known; if that blob already exists the temporary one is dropped. The
+    temporary blob is deleted if the upload fails.
+
+    :param url: URL of the source video.
+    :param bucket: google.cloud.storage Bucket to upload into.
+    :param size_upper_bound: Max size in KB before the video is transcoded.
+    :param preset: x264 speed/quality preset.
+    :param threads: Encoder threads, 0 lets ffmpeg decide.
+    :param timeout: Connect/read timeout for the download, in seconds.
+    :return: StreamResult(blob_name, sha256, bytes_in, bytes_out, transcoded).
+    """
+    response = requests.get(url, stream=True, timeout=timeout)
+    response.raise_for_status()
+    content_length = int(response.headers.get("Content-Length") or 0)
+    transcode = not content_length or content_length > size_upper_bound * 1024
+    info = None
+    if transcode:
+        info = video_compression.probe_video(url)
+        transcode = info.size is None or info.size > size_upper_bound * 1024
+
+    digest = hashlib.sha256()
+    counter = [0]
+    chunks = response.iter_content(CHUNK_SIZE)
+    head = next(chunks, b"")
+    chunks = itertools.chain([head], chunks)
+    temp_blob = bucket.blob("incoming/%s.mp4" % uuid.uuid4().hex)
+    try:
+        with temp_blob.open(
+            "wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="video/mp4"
+        ) as writer:
+            if not transcode:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    counter[0] += len(chunk)
+                    writer.write(chunk)
+                bytes_out = counter[0]
+            elif moov_at_end(head):
+                logging.info("%s is not faststart, transcoding from disk", url)
+                bytes_out = _transcode_download(
+                    chunks,
+                    content_length or info.size or 0,
+                    writer,
+                    info,
+                    size_upper_bound,
+                    preset,
+                    threads,
+                    digest,
+                    counter,
+                )
+            else:
+                bytes_out = _transcode(
+                    "pipe:0",
+                    chunks,
+                    writer,
+                    info,
+                    size_upper_bound,
+                    preset,
+                    threads,
+                    digest,
+                    counter,
+                )
+    except BaseException:
+        _delete_quietly(temp_blob)
+        raise
+
+    sha256 = digest.hexdigest()
+    final_name = video_cache.blob_name(sha256)
+    if bucket.blob(final_name).exists():
+        temp_blob.delete()
+    else:
+        bucket.rename_blob(temp_blob, final_name)
+    logging.info(
+        "Streamed %s bytes into gs://%s/%s (%s bytes, transcoded=%s)",
+        counter[0],
+        bucket.name,
+        final_name,
+        bytes_out,
+        transcode,
+    )
+    return StreamResult(final_name, sha256, counter[0], bytes_out, transcode)
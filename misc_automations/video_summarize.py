@@ -2,220 +2,204 @@
 # pipedream add-package ffmpeg-python
 # pipedream add-package google-cloud-aiplatform
 # pipedream add-package dropbox
+import logging
 import os
-import re
-from datetime import datetime
-import time
-import ffmpeg
-from google.cloud import storage
-from google.oauth2 import service_account
-import json
 
-# pipedream add-package google-cloud-aiplatform
-import json
-import os
-import requests
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel
 from vertexai.preview import generative_models
-from google.oauth2 import service_account
-import re
-
 
-def compress_video(
-    video_full_path, size_upper_bound, two_pass=True, filename_suffix="cps_"
-):
+import config
+import job_queue
+import storage_backends
+import summary_parser
+import tracing
+import video_cache
+import video_keyframes
+import video_segments
+import workspaces
+from video_compression import (
+    DEFAULT_THREADS,
+    CompressionError,
+    compress_video,
+    probe_video,
+)
+
+# "video" sends the whole MP4; "keyframes" sends scene-change JPEGs plus mono audio;
+# "segments" splits long videos and summarizes the pieces in parallel.
+DEFAULT_SUMMARY_MODE = os.environ.get("VIDEO_SUMMARY_MODE", "video")
+SUMMARY_MODES = ("video", "keyframes", "segments")
+KEYFRAMES_NOTE = (
+    "The video is given as keyframes in playback order, taken at scene changes, "
+    "followed by its audio track."
+)
+
+
+UPLOAD_LIMIT_KB = 9500
+VIDEO_STORAGE_BACKENDS = ("gcs", "local")
+# Workspace reserved for keyframe extraction: candidate JPEGs plus mono audio.
+KEYFRAMES_WORKSPACE_BYTES = 64 * 1024 * 1024
+
+
+def compress_if_needed(filename, threads=DEFAULT_THREADS, output_path=None):
     """
-    Compress video file to max-supported size.
-    :param video_full_path: the video you want to compress.
-    :param size_upper_bound: Max video size in KB.
-    :param two_pass: Set to True to enable two-pass calculation.
-    :param filename_suffix: Add a suffix for new video.
-    :return: out_put_name or error
+    Compresses a video that is over the upload limit.
+
+    :param filename: Path of the video.
+    :param threads: Encoder threads.
+    :param output_path: Where to write the compressed video; defaults to
+        replacing the input.
+    :return: Path of the video to upload.
     """
-    output_file_name = video_full_path
-
-    # Adjust them to meet your minimum requirements (in bps), or maybe this function will refuse your video!
-    total_bitrate_lower_bound = 11000
-    min_audio_bitrate = 32000
-    max_audio_bitrate = 256000
-    min_video_bitrate = 100000
-    print(
-        "%s Compressing video: %s",
-        datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-        video_full_path,
-    )
 
-    try:
-        # Bitrate reference: https://en.wikipedia.org/wiki/Bit_rate#Encoding_bit_rate
-        probe = ffmpeg.probe(video_full_path)
-        # Video duration, in s.
-        duration = float(probe["format"]["duration"])
-        # Audio bitrate, in bps.
-        audio_bitrate = float(
-            next((s for s in probe["streams"] if s["codec_type"] == "audio"), None)[
-                "bit_rate"
-            ]
-        )
-        # Target total bitrate, in bps.
-        target_total_bitrate = (size_upper_bound * 1024 * 8) / (1.073741824 * duration)
-        if target_total_bitrate < total_bitrate_lower_bound:
-            print(
-                "%s Bitrate is extremely low! Stop compress!",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-            )
-            return False
+    original_size = os.path.getsize(filename) / 1024
 
-        # Best min size, in kB.
-        best_min_size = (
-            (min_audio_bitrate + min_video_bitrate)
-            * (1.073741824 * duration)
-            / (8 * 1024)
-        )
-        if size_upper_bound < best_min_size:
-            print(
-                "%s Quality not good! Recommended minimum size: %s KB.",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                "{:,}".format(int(best_min_size)),
-            )
-            # return False
-
-        # target audio bitrate, in bps
-        if 10 * audio_bitrate > target_total_bitrate:
-            audio_bitrate = target_total_bitrate / 10
-            if audio_bitrate < min_audio_bitrate < target_total_bitrate:
-                audio_bitrate = min_audio_bitrate
-            elif audio_bitrate > max_audio_bitrate:
-                audio_bitrate = max_audio_bitrate
-
-        # Target video bitrate, in bps.
-        video_bitrate = target_total_bitrate - audio_bitrate
-        if video_bitrate < 1000:
-            print(
-                "%s Bitrate %s is extremely low! Stop compress.",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                video_bitrate,
-            )
-            return False
-
-        i = ffmpeg.input(video_full_path)
-        if two_pass:
-            ffmpeg.output(
-                i,
-                os.devnull,
-                **{"c:v": "libx264", "b:v": video_bitrate, "pass": 1, "f": "mp4"},
-            ).overwrite_output().run()
-            ffmpeg.output(
-                i,
-                output_file_name,
-                **{
-                    "c:v": "libx264",
-                    "b:v": video_bitrate,
-                    "pass": 2,
-                    "c:a": "aac",
-                    "b:a": audio_bitrate,
-                },
-            ).overwrite_output().run()
-        else:
-            ffmpeg.output(
-                i,
-                output_file_name,
-                **{
-                    "c:v": "libx264",
-                    "b:v": video_bitrate,
-                    "c:a": "aac",
-                    "b:a": audio_bitrate,
-                },
-            ).overwrite_output().run()
-
-        if os.path.getsize(output_file_name) <= size_upper_bound * 1024:
-            print(
-                "%s Compressed video: %s",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                output_file_name,
-            )
-            return output_file_name
-        elif os.path.getsize(output_file_name) < os.path.getsize(
-            video_full_path
-        ):  # Do it again
-            print(
-                "%s Compressed video: %s",
-                datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-                output_file_name,
-            )
-            return compress_video(output_file_name, size_upper_bound)
+    with tracing.span("compress", input_kb=original_size) as span:
+        if original_size <= UPLOAD_LIMIT_KB:
+            logging.info("File size is already under 9MB, no need to compress.")
         else:
-            return False
-    except FileNotFoundError:
-        print(
-            "%s You do not have ffmpeg installed!",
-            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-        )
-        print(
-            "%s You can install ffmpeg by reading https://github.com/kkroening/ffmpeg-python/issues/251",
-            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-        )
-        return False
+            try:
+                result = compress_video(
+                    filename, UPLOAD_LIMIT_KB, output_path=output_path, threads=threads
+                )
+                span.set(output_kb=result.size_kb, passes=result.passes)
+                return result.path
+            except CompressionError as error:
+                logging.warning("Could not compress %s: %s", filename, error)
+            except FileNotFoundError:
+                logging.error(
+                    "You do not have ffmpeg installed! You can install ffmpeg by "
+                    "reading https://github.com/kkroening/ffmpeg-python/issues/251"
+                )
 
+    return filename
 
-def compress_if_needed(filename):
-    """Compress and upload video to GCS"""
 
-    original_size = os.path.getsize(filename) / 1024
+def upload_blob(storage_client, bucket_name, source_file_name, destination_blob_name):
+    """Uploads a file to the bucket in parallel parts, skipping identical blobs."""
+    backend = storage_backends.GCSBackend(storage_client, bucket_name)
+    return backend.upload_file(source_file_name, destination_blob_name)
 
-    if original_size <= 9500:
-        print(
-            "%s File size is already under 9MB, no need to compress.",
-            datetime.fromtimestamp(time.time()).strftime("%Y%m%d%H%M%S"),
-        )
-    else:
-        compress_video(filename, 9500)
 
-    return filename
+def storage_backend_name():
+    """
+    Returns STORAGE_BACKEND if the video pipeline can use it.
 
+    Gemini reads uploads by gs:// URI, so only "gcs" (the default) and, for
+    offline runs against a stand-in model, "local" are accepted.
 
-def upload_blob(storage_client, bucket_name, source_file_name, destination_blob_name):
-    """Uploads a file to the bucket."""
-    # The ID of your GCS bucket
-    # The path to your file to upload
-    # The ID to give your file on GCS
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
+    :raises ValueError: For any other backend, e.g. "s3".
+    """
+    name = os.getenv("STORAGE_BACKEND", "gcs")
+    if name not in VIDEO_STORAGE_BACKENDS:
+        raise ValueError(
+            "STORAGE_BACKEND=%s can't be used for videos, Gemini only reads"
+            " gs:// URIs; use one of %s" % (name, ", ".join(VIDEO_STORAGE_BACKENDS))
+        )
+    return name
 
-    blob.upload_from_filename(source_file_name)
 
+def storage_backend():
+    """Returns the storage backend selected by STORAGE_BACKEND (GCS by default)."""
+    if storage_backend_name() == "gcs":
+        return storage_backends.backend_from_env(
+            gcs_client=config.get_client("GCS_CLIENT")
+        )
+    return storage_backends.backend_from_env()
 
-def save_to_google_cloud(tmp_file, filename):
-    print("Saving %s to GCP..." % (tmp_file))
-    credentials = service_account.Credentials.from_service_account_file(
-        "/tmp/google_auth.json"
-    )
 
-    storage_client = storage.Client(credentials=credentials)
-    upload_blob(
-        storage_client,
-        bucket_name=os.getenv("GOOGLE_BLOB"),
-        source_file_name=tmp_file,
-        destination_blob_name=filename,
-    )
-    print("Successfully uploaded to: %s" % ("gs://notion3000/" + filename))
+def save_to_google_cloud(tmp_file, filename, content_type="video/mp4"):
+    logging.info("Saving %s to object storage...", tmp_file)
+    with tracing.span("upload", size_bytes=os.path.getsize(tmp_file)):
+        uri = storage_backend().upload_file(tmp_file, filename, content_type)
+    logging.info("Successfully uploaded to: %s", uri)
     # Return data for use in future steps
-    return "gs://notion3000/" + filename
+    return uri
 
 
-def get_video_summary(filename):
-    credentials = service_account.Credentials.from_service_account_file(
-        "/tmp/google_auth.json"
-    )
+def save_keyframes(tmp_file, digest):
+    """
+    Extracts keyframes and audio from a video and uploads them.
+
+    :param tmp_file: Path of the (uncompressed) video.
+    :param digest: SHA-256 of the video, used to name the uploaded parts.
+    :return: List of (uri, mime_type) in prompt order.
+    """
+    with workspaces.workspace(
+        "keyframes-" + digest[:12], KEYFRAMES_WORKSPACE_BYTES
+    ) as workspace:
+        media = video_keyframes.extract_media(tmp_file, workspace.path)
+        return [
+            (
+                save_to_google_cloud(
+                    path,
+                    "keyframes/%s/%s" % (digest, os.path.basename(path)),
+                    mime_type,
+                ),
+                mime_type,
+            )
+            for path, mime_type in video_keyframes.part_files(media)
+        ]
 
-    vertexai.init(
-        credentials=credentials,
-        project=os.getenv("GOOGLE_PROJECT_ID"),
-        location=os.getenv("GOOGLE_LOCATION"),
+
+def save_segments(tmp_file, digest):
+    """
+    Splits a video into stream-copied segments, then compresses (if needed) and
+    uploads them in parallel.
+
+    :param tmp_file: Path of the (uncompressed) video.
+    :param digest: SHA-256 of the video, used to name the uploaded segments.
+    :return: List of segment URIs in playback order.
+    """
+    with tracing.span("probe"):
+        info = probe_video(tmp_file)
+    seconds = video_segments.plan_segment_seconds(info, UPLOAD_LIMIT_KB)
+    threads = video_segments.encoder_threads()
+    # The segments add up to the input; each concurrent encode adds its output.
+    size = os.path.getsize(tmp_file) + (
+        video_segments.DEFAULT_WORKERS * 2 * UPLOAD_LIMIT_KB * 1024
     )
-    gemini_pro_vision_model = GenerativeModel("gemini-pro-vision")
 
-    response = gemini_pro_vision_model.generate_content(
+    with workspaces.workspace("segments-" + digest[:12], size) as workspace:
+        segments = video_segments.split_video(tmp_file, workspace.path, seconds)
+
+        def upload(path):
+            compress_if_needed(path, threads=threads)
+            blob = "segments/%s/%s" % (digest, os.path.basename(path))
+            return save_to_google_cloud(path, blob)
+
+        return video_segments.map_segments(upload, segments)
+
+
+def summarize_segments(uris):
+    """
+    Summarizes uploaded segments in parallel.
+
+    :param uris: Segment URIs in playback order.
+    :return: Gemini's raw tagged output per segment, in the same order.
+    """
+
+    def summarize(uri):
+        return "".join(tracing.stream("llm", stream_video_summary(uri)))
+
+    return video_segments.map_segments(summarize, uris)
+
+
+def stream_video_summary(filename, parts=None):
+    """
+    Streams Gemini's tagged summary of a video.
+
+    :param filename: URI of the uploaded video.
+    :param parts: (uri, mime_type) pairs sent instead of the video, e.g. keyframes.
+    :return: Generator of text chunks.
+    """
+    if parts is None:
+        media = [generative_models.Part.from_uri(filename, mime_type="video/mp4")]
+    else:
+        media = [KEYFRAMES_NOTE] + [
+            generative_models.Part.from_uri(uri, mime_type=mime_type)
+            for uri, mime_type in parts
+        ]
+    # One client per process: initialized once, with retries and a shared limit.
+    return config.get_client("GEMINI_CLIENT").stream(
         [
             """Your task is to create a comprehensive summary of this video that includes:
 - a creative title that captures the essence of the video
@@ -233,63 +217,178 @@ Please format your response using HTML tags as follows:
 </KEYPOINTS>
 <SUMMARY> [Your analytical summary here, encompassing the key insights and their wider implications] </SUMMARY>
 <TAGS> [comma seperated 1-word tags that you choose to label the video as] </TAGS>""",
-            generative_models.Part.from_uri(filename, mime_type="video/mp4"),
-        ],
-        stream=True,
+        ]
+        + media
     )
 
-    final = ""
-    for chunk in response:
-        final += chunk.text
-    return final
+
+def get_video_summary(filename, parts=None):
+    return "".join(stream_video_summary(filename, parts))
 
 
 def parse_html_tags(input_string):
-    # Define a dictionary to hold the parsed content
-    parsed_content = {"TITLE": "", "KEYPOINTS": "", "SUMMARY": "", "TAGS": []}
+    return summary_parser.parse_summary(input_string)
 
-    # Define regular expression patterns for each tag
-    title_pattern = r"<TITLE>(.*?)</TITLE>"
-    keypoints_pattern = r"<KEYPOINTS>(.*?)</KEYPOINTS>"
-    summary_pattern = r"<SUMMARY>(.*?)</SUMMARY>"
-    tags_pattern = r"<TAGS>(.*?)</TAGS>"
 
-    # Extract content for each tag
-    title_match = re.search(title_pattern, input_string, re.DOTALL)
-    if title_match:
-        parsed_content["TITLE"] = title_match.group(1).strip()
+def _summary_key(payload, checkpoints):
+    # Summaries from keyframes are cached apart from summaries of the full video.
+    digest = checkpoints["digest"]
+    if payload["mode"] == "video":
+        return digest
+    return "%s-%s" % (digest, payload["mode"])
 
-    keypoints_match = re.search(keypoints_pattern, input_string, re.DOTALL)
-    if keypoints_match:
-        parsed_content["KEYPOINTS"] = keypoints_match.group(1).strip()
 
-    summary_match = re.search(summary_pattern, input_string, re.DOTALL)
-    if summary_match:
-        parsed_content["SUMMARY"] = summary_match.group(1).strip()
+def _cached_summary(payload, checkpoints):
+    return video_cache.VideoCache().load_summary(_summary_key(payload, checkpoints))
 
-    tags_match = re.search(tags_pattern, input_string, re.DOTALL)
-    if tags_match:
-        # Split the keypoints into a list
-        tags = tags_match.group(1).strip().split(",")
-        tags = [x.strip() for x in tags]
-        # Clean up each keypoint
-        parsed_content["TAGS"] = tags
 
-    return parsed_content
+def hash_stage(payload, checkpoints):
+    if payload.get("digest"):
+        return payload["digest"]
+    path = payload["path"]
+    with tracing.span("hash", size_bytes=os.path.getsize(path)):
+        return video_cache.file_sha256(path)
 
 
-def handler(pd: "pipedream"):
-    print("Running video pipeline...")
-    filename = pd.steps["trigger"]["event"]["body"]["filename"]
-    filepath = pd.steps["trigger"]["event"]["body"]["filepath"]
-    tmp_file = "/tmp/" + filename
+def compress_stage(payload, checkpoints):
+    """
+    Returns the path of the video to upload: the compressed copy in the cache,
+    or the input itself if it needed no compression (None outside video mode).
+    """
+    if payload["mode"] != "video" or _cached_summary(payload, checkpoints) is not None:
+        return None
+    cache = video_cache.VideoCache()
+    digest = checkpoints["digest"]
+    if cache.has_compressed(digest):
+        logging.info("Compressed video cache hit for %s", digest)
+        return cache.compressed_path(digest)
+    logging.info("Compressing...")
+    # The encode and its sample go to a workspace; the input is left untouched.
+    with workspaces.workspace(
+        "compress-" + digest[:12], 2 * UPLOAD_LIMIT_KB * 1024
+    ) as workspace:
+        compressed = compress_if_needed(
+            payload["path"], output_path=workspace.path_for("compressed.mp4")
+        )
+        if compressed == payload["path"]:
+            # Small enough already (or not compressible): nothing worth caching.
+            return compressed
+        return cache.store_compressed(digest, compressed)
 
-    print("Compressing...")
-    compress_if_needed(tmp_file)
-    # Return data for use in future steps
-    print("Compress done - uploading to GCP...")
-    gcp_file = save_to_google_cloud(tmp_file, filename)
-    summary = get_video_summary(gcp_file)
-    html_parse = parse_html_tags(summary)
-    notion_url = config.save_to_notion(html_parse)
-    return {"url": notion_url}
+
+def upload_stage(payload, checkpoints):
+    """
+    Returns the video's URI, the (uri, mime_type) parts in keyframe mode, or the
+    segment URIs in segment mode.
+    """
+    if _cached_summary(payload, checkpoints) is not None:
+        return None
+    digest = checkpoints["digest"]
+    if payload["mode"] == "segments":
+        logging.info("Splitting into segments...")
+        return save_segments(payload["path"], digest)
+    if payload["mode"] == "keyframes":
+        logging.info("Extracting keyframes...")
+        return save_keyframes(payload["path"], digest)
+    compressed = checkpoints["compressed"]
+    if not os.path.exists(compressed):
+        # Resumed on a host without the cached file.
+        compressed = compress_stage(payload, checkpoints)
+    logging.info("Compress done - uploading to GCP...")
+    return save_to_google_cloud(compressed, video_cache.blob_name(digest))
+
+
+def llm_stage(payload, checkpoints):
+    """Returns Gemini's raw tagged output (a list of them in segment mode)."""
+    if _cached_summary(payload, checkpoints) is not None:
+        return None
+    uploaded = checkpoints["gcs_uri"]
+    if payload["mode"] == "segments":
+        return summarize_segments(uploaded)
+    if payload["mode"] == "keyframes":
+        chunks = stream_video_summary(None, uploaded)
+    else:
+        chunks = stream_video_summary(uploaded)
+    return "".join(tracing.stream("llm", chunks))
+
+
+def summary_stage(payload, checkpoints):
+    html_parse = _cached_summary(payload, checkpoints)
+    if html_parse is not None:
+        logging.info("Summary cache hit for %s", checkpoints["digest"])
+        return html_parse
+    llm_output = checkpoints["llm_output"]
+    with tracing.span("parse"):
+        if payload["mode"] == "segments":
+            html_parse = summary_parser.merge_summaries(
+                [summary_parser.parse_summary(text) for text in llm_output]
+            )
+        else:
+            html_parse = summary_parser.parse_summary(llm_output)
+    cache = video_cache.VideoCache()
+    cache.store_summary(_summary_key(payload, checkpoints), html_parse)
+    return html_parse
+
+
+def create_notion_page(summary_content):
+    """Creates the Notion page for a video summary."""
+    return config.create_notion_page(summary_content)
+
+
+def notion_stage(payload, checkpoints):
+    config.get_secrets()
+    page = {"url": create_notion_page(checkpoints["summary"])}
+    workspaces.release_input(payload["path"])
+    return page
+
+
+job_queue.register_pipeline(
+    "video",
+    [
+        ("digest", hash_stage),
+        ("compressed", compress_stage),
+        ("gcs_uri", upload_stage),
+        ("llm_output", llm_stage),
+        ("summary", summary_stage),
+        ("notion_page", notion_stage),
+    ],
+)
+
+
+@tracing.instrument_handler("video_summarize")
+def handler(pd: "pipedream"):
+    """
+    Enqueues the video pipeline for the uploaded file and, with JOB_MODE=inline
+    (the default), runs it right away.
+
+    The upload is first moved out of /tmp to a path owned by the job, so jobs
+    for files with the same name don't collide; in queue mode a worker on this
+    host must run the job. Jobs are deduplicated by the video's digest and
+    mode, so a retried step resumes the job its first attempt started, and the
+    upload it claimed again is deleted.
+
+    :return: {"url": notion_url} inline, {"job_id": id} in queue mode.
+    :raises ValueError: If the mode isn't one of SUMMARY_MODES or the storage
+        backend can't serve Gemini.
+    """
+    logging.info("Running video pipeline...")
+    body = pd.steps["trigger"]["event"]["body"]
+    mode = body.get("mode", DEFAULT_SUMMARY_MODE)
+    if mode not in SUMMARY_MODES:
+        raise ValueError(
+            "Unknown summary mode %r, expected one of %s"
+            % (mode, ", ".join(SUMMARY_MODES))
+        )
+    storage_backend_name()
+    path = workspaces.claim_input("/tmp/" + body["filename"])
+    with tracing.span("hash", size_bytes=os.path.getsize(path)):
+        digest = video_cache.file_sha256(path)
+    payload = {"path": path, "mode": mode, "digest": digest}
+    dedupe_key = "video:%s:%s" % (digest, mode)
+    try:
+        return job_queue.run_handler_job("video", payload, dedupe_key=dedupe_key)
+    finally:
+        # A retry or re-upload joins the existing job, which reads its own claim.
+        job = config.get_client("JOB_QUEUE").find(dedupe_key)
+        if job is not None and job.payload["path"] != path:
+            workspaces.release_input(path)
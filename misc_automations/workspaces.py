@@ -0,0 +1,239 @@
+"""
+This module gives every video job its own scratch directory, so several jobs
+can run on one worker without overwriting each other's files.
+
+Workspaces go on tmpfs (/dev/shm) when the job's estimated footprint fits the
+RAM budget and on disk otherwise. Jobs reserve their estimate before they
+start; a job that doesn't fit waits for running jobs to release theirs
+(admission control) instead of filling the disk. A workspace is deleted when
+its job leaves it, failure included, and workspaces left behind by a killed
+process are swept when the next manager starts.
+"""
+import functools
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import tracing
+
+WORKSPACE_DIR = os.environ.get("WORKSPACE_DIR", "/tmp/workspaces")
+RAM_WORKSPACE_DIR = os.environ.get("WORKSPACE_RAM_DIR", "/dev/shm/workspaces")
+MB = 1024 * 1024
+DISK_BUDGET = int(float(os.environ.get("WORKSPACE_DISK_BUDGET_MB", 4096)) * MB)
+# 0 keeps every workspace on disk.
+RAM_BUDGET = int(float(os.environ.get("WORKSPACE_RAM_BUDGET_MB", 512)) * MB)
+ADMISSION_TIMEOUT = float(os.environ.get("WORKSPACE_ADMISSION_TIMEOUT", 600))
+# Free space left untouched on either filesystem, for everything else on the host.
+FREE_SPACE_RESERVE = 256 * MB
+# Claimed inputs of jobs that never finished are removed after this long.
+INPUT_TTL = 2 * 24 * 60 * 60
+INPUTS = "inputs"
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class WorkspaceUnavailable(Exception):
+    """Raised when a job's workspace doesn't fit the budget in time."""
+
+
+class Workspace:
+    """
+    A job's scratch directory.
+    """
+
+    def __init__(self, path, tier, reserved):
+        self.path = path
+        self.tier = tier
+        self.reserved = reserved
+
+    def path_for(self, name):
+        """Returns the path of a file in the workspace."""
+        return os.path.join(self.path, name)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WorkspaceManager:
+    """
+    Hands out per-job workspaces within a disk and a RAM budget.
+    """
+
+    def __init__(
+        self,
+        disk_root=WORKSPACE_DIR,
+        ram_root=RAM_WORKSPACE_DIR,
+        disk_budget=DISK_BUDGET,
+        ram_budget=RAM_BUDGET,
+        timeout=ADMISSION_TIMEOUT,
+        clock=time.monotonic,
+    ):
+        """
+        :param disk_root: Directory disk workspaces are created in.
+        :param ram_root: Directory on tmpfs for RAM workspaces.
+        :param disk_budget: Bytes all disk workspaces may reserve together.
+        :param ram_budget: Bytes all RAM workspaces may reserve together.
+        :param timeout: Seconds a job waits for admission.
+        :param clock: Monotonic time source.
+        """
+        self.roots = {"disk": disk_root, "ram": ram_root}
+        self.budgets = {"disk": disk_budget, "ram": ram_budget}
+        self.timeout = timeout
+        self.clock = clock
+        self._reserved = {"disk": 0, "ram": 0}
+        self._condition = threading.Condition()
+        os.makedirs(disk_root, exist_ok=True)
+        if ram_budget and os.path.isdir(os.path.dirname(ram_root)):
+            os.makedirs(ram_root, exist_ok=True)
+        else:
+            self.budgets["ram"] = 0
+        self.sweep()
+
+    def _free(self, tier):
+        return shutil.disk_usage(self.roots[tier]).free - FREE_SPACE_RESERVE
+
+    def _tier_for(self, size):
+        """Returns the tier the size fits in right now, RAM first, or None."""
+        for tier in ("ram", "disk"):
+            if (
+                self.budgets[tier]
+                and self._reserved[tier] + size <= self.budgets[tier]
+                and size <= self._free(tier)
+            ):
+                return tier
+        return None
+
+    def _admit(self, name, size):
+        if size > max(self.budgets.values()):
+            raise WorkspaceUnavailable(
+                "%s needs %.0f MB, more than the workspace budget" % (name, size / MB)
+            )
+        deadline = self.clock() + self.timeout
+        with tracing.span("admission", reserved_mb=size / MB) as span:
+            with self._condition:
+                tier = self._tier_for(size)
+                while tier is None:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        raise WorkspaceUnavailable(
+                            "No room for %s (%.0f MB) after %ss"
+                            % (name, size / MB, self.timeout)
+                        )
+                    self._condition.wait(remaining)
+                    tier = self._tier_for(size)
+                self._reserved[tier] += size
+            span.set(tier=tier)
+        return tier
+
+    def _release(self, tier, size):
+        with self._condition:
+            self._reserved[tier] -= size
+            self._condition.notify_all()
+
+    @contextmanager
+    def workspace(self, name, size_bytes=0):
+        """
+        Creates a workspace for a job and deletes it when the block exits.
+
+        :param name: Label for the directory, e.g. the job's kind and digest.
+        :param size_bytes: Most the job will write to the workspace at once.
+        :return: Context manager yielding a Workspace.
+        :raises WorkspaceUnavailable: If the reservation doesn't fit in time.
+        """
+        tier = self._admit(name, size_bytes)
+        try:
+            path = tempfile.mkdtemp(
+                prefix="%d-%s-" % (os.getpid(), _UNSAFE.sub("_", name)[:40]),
+                dir=self.roots[tier],
+            )
+            try:
+                yield Workspace(path, tier, size_bytes)
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+        finally:
+            self._release(tier, size_bytes)
+
+    def claim_input(self, path):
+        """
+        Moves a file a job will read (e.g. an upload in /tmp) to a unique path
+        that no other job uses.
+
+        Claiming is idempotent: if the file is already gone, e.g. because a
+        retried handler claimed it on its first attempt, the latest claim of a
+        file with that name is returned instead.
+
+        :param path: Path of the file.
+        :return: The file's new path.
+        :raises FileNotFoundError: If the file was neither found nor claimed.
+        """
+        inputs = os.path.join(self.roots["disk"], INPUTS)
+        os.makedirs(inputs, exist_ok=True)
+        name = os.path.basename(path)
+        if not os.path.exists(path):
+            claims = [
+                os.path.join(inputs, entry)
+                for entry in os.listdir(inputs)
+                if entry.split("-", 1)[-1] == name
+            ]
+            if not claims:
+                raise FileNotFoundError("%s was not found or claimed" % path)
+            return max(claims, key=os.path.getctime)
+        target = os.path.join(inputs, "%s-%s" % (uuid.uuid4().hex, name))
+        shutil.move(path, target)
+        return target
+
+    def sweep(self):
+        """Deletes workspaces of dead processes and claimed inputs past INPUT_TTL."""
+        for root in self.roots.values():
+            if not os.path.isdir(root):
+                continue
+            for entry in os.listdir(root):
+                pid = entry.split("-", 1)[0]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    logging.info("Removing orphaned workspace %s", entry)
+                    shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+        inputs = os.path.join(self.roots["disk"], INPUTS)
+        if os.path.isdir(inputs):
+            cutoff = time.time() - INPUT_TTL
+            for entry in os.listdir(inputs):
+                path = os.path.join(inputs, entry)
+                if os.path.getmtime(path) < cutoff:
+                    logging.info("Removing abandoned input %s", entry)
+                    os.remove(path)
+
+
+@functools.lru_cache(maxsize=None)
+def default_manager():
+    """Returns the process-wide manager, so every job shares one budget."""
+    return WorkspaceManager()
+
+
+def workspace(name, size_bytes=0):
+    """Creates a workspace with the process-wide manager."""
+    return default_manager().workspace(name, size_bytes)
+
+
+def claim_input(path):
+    """Moves a job input to a unique path with the process-wide manager."""
+    return default_manager().claim_input(path)
+
+
+def release_input(path):
+    """Deletes a claimed input once its job no longer needs it."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass